@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from DjangoGramm.sharding import SHARD_KEYS, shard_aliases
+
+
+def estimated_row_count(model, using: str) -> int | None:
+    """Returns the number of rows the database's statistics estimate for a model's table.
+
+    Returns:
+        The estimate, or None if the backend keeps no statistics or the
+        table was never analyzed.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)',
+                           [connection.ops.quote_name(model._meta.db_table)])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [model._meta.db_table])
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for a table that was never vacuumed or analyzed.
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginates a changelist without counting every row of a large, unfiltered table.
+
+    Filtered or searched lists are counted exactly, which stays cheap as long
+    as the filters are indexed.
+    """
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= settings.ADMIN_EXACT_COUNT_BELOW:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """An admin for tables with millions of rows.
+
+    The changelist reads newest first by primary key, so each page is a walk
+    down the key's index, and only sorts by the columns in ``sortable_by``.
+    It shows an estimated total and skips the second count Django runs for
+    filtered lists. Subclasses should name their foreign keys in
+    ``raw_id_fields`` or ``autocomplete_fields`` instead of rendering a
+    dropdown of every row, join the rows their columns display with
+    ``list_select_related``, and only filter and search on indexed columns.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-pk',)
+    sortable_by = ()
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """Picks the shard a changelist of a sharded model reads, the first one unless another is chosen."""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shard_aliases()] if settings.DATABASE_SHARDS else []
+
+    def alias(self) -> str:
+        aliases = shard_aliases()
+        return self.value() if self.value() in aliases else aliases[0]
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.alias()) if settings.DATABASE_SHARDS else queryset
+
+    def choices(self, changelist):
+        current = self.alias()
+        for alias, title in self.lookup_choices:
+            yield {'selected': alias == current, 'display': title,
+                   'query_string': changelist.get_query_string({self.parameter_name: alias})}
+
+
+class ShardedModelAdmin(LargeTableAdmin):
+    """A ``LargeTableAdmin`` for posts, likes and follows, which may be spread over ``DATABASE_SHARDS``.
+
+    While sharded, the changelist reads one shard at a time, picked with
+    ``ShardFilter``, and a row is looked up on every shard. Related rows
+    live on the default database then, so ``list_select_related`` becomes
+    one ``prefetch_related`` query instead of a join, and the shard key
+    cannot be changed, since that would leave the row on the wrong shard.
+    """
+    list_filter = (ShardFilter,)
+
+    def get_list_select_related(self, request):
+        return () if settings.DATABASE_SHARDS else super().get_list_select_related(request)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if settings.DATABASE_SHARDS and self.list_select_related:
+            queryset = queryset.prefetch_related(*self.list_select_related)
+        return queryset
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly = super().get_readonly_fields(request, obj)
+        if settings.DATABASE_SHARDS and obj is not None:
+            key = SHARD_KEYS[self.model._meta.label_lower].removesuffix('_id')
+            readonly = (*readonly, key)
+        return readonly
+
+    def get_object(self, request, object_id, from_field=None):
+        if not settings.DATABASE_SHARDS:
+            return super().get_object(request, object_id, from_field)
+        queryset = self.get_queryset(request)
+        try:
+            pk = self.model._meta.pk.to_python(object_id)
+        except ValidationError:
+            return None
+        for alias in shard_aliases():
+            obj = queryset.using(alias).filter(pk=pk).first()
+            if obj is not None:
+                return obj
+        return None
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class DjangoGrammConfig(AppConfig):
+    name = 'DjangoGramm'
+
+    def ready(self):
+        from DjangoGramm import checks
@@ -52,7 +52,8 @@ SOCIAL_AUTH_PIPELINE = (
     'social_core.pipeline.user.user_details',
 )
 
-# Application definition
+# Application definition; only apps every environment needs, since each one is
+# imported at startup (see `manage.py importtime`)
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -60,17 +61,20 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'django_extensions',
     'cloudinary',
-    'storages',
     'social_django',
     'users',
     'posts',
     'photos',
+    'DjangoGramm',
 ]
 
 MIDDLEWARE = [
+    'DjangoGramm.middleware.MetricsMiddleware',
+    'DjangoGramm.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'DjangoGramm.middleware.CompressionMiddleware',
+    'DjangoGramm.middleware.ReadYourWritesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -95,16 +99,181 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'social_django.context_processors.backends',
                 'social_django.context_processors.login_redirect',
+                'posts.context_processors.live_counts',
             ],
         },
     },
 ]
 
-# Static files
+# Response compression: brotli or gzip for text responses of at least COMPRESSION_MIN_SIZE
+# bytes; pages with a CSRF token are gzipped with up to COMPRESSION_MAX_RANDOM_BYTES of padding
+COMPRESSION_ENCODINGS = ('br', 'gzip')
+COMPRESSION_MIN_SIZE = 860
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_MAX_RANDOM_BYTES = 100
+COMPRESSION_CONTENT_TYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'text/csv',
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+)
+
+# Like and subscribe toggles: token buckets per user and per target, kept in the
+# THROTTLE_CACHE, which must be shared between workers in production (checked by `manage.py check --deploy`)
+THROTTLE_ENABLED = True
+THROTTLE_CACHE = 'default'
+THROTTLE_RATES = {
+    'like_user': '60/min',
+    'like_target': '1200/min',
+    'subscribe_user': '30/min',
+    'subscribe_target': '600/min',
+}
+TOGGLE_GUARD_SECONDS = 5
+
+# Write-behind likes: each toggle is appended to PendingLike as a signed row and applied in
+# batches by `manage.py flush_likes`, which must run alongside the app when enabled
+LIKES_WRITE_BEHIND = False
+
+# `manage.py archive_posts` moves posts older than this into the archive tables,
+# which `manage.py partition_archive` range-partitions by year on PostgreSQL
+POST_ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_PAGE_SIZE = 20
+
+# Prometheus metrics at /metrics, behind an `Authorization: Bearer METRICS_TOKEN` header when a token
+# is set. Under gunicorn, set PROMETHEUS_MULTIPROC_DIR so the scrape sums every worker (see gunicorn.conf.py)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '') == '1'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Slow-query log: queries of views taking SLOW_QUERY_THRESHOLD_MS or longer are appended to SLOW_QUERY_LOG
+# with their EXPLAIN plan, measured with EXPLAIN ANALYZE for SLOW_QUERY_ANALYZE_RATE of them;
+# `manage.py slow_queries` summarizes the log. None disables it. Query parameters and the quoted
+# values in plans, which hold emails, password hashes and post texts, are only kept with SLOW_QUERY_LOG_PARAMS
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS')) if os.getenv('SLOW_QUERY_THRESHOLD_MS') else None
+SLOW_QUERY_LOG = BASE_DIR / 'slow_queries.jsonl'
+SLOW_QUERY_ANALYZE_RATE = 0.0
+SLOW_QUERY_LOG_PARAMS = False
+
+# Database routing: listing views read from DATABASE_REPLICAS, a client's reads
+# stay on the primary for REPLICA_PIN_SECONDS after it writes
+DATABASE_ROUTERS = ['DjangoGramm.routers.ShardRouter', 'DjangoGramm.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = 5
+
+# Sharding: with DATABASE_SHARDS set, posts, likes and follows are split across those aliases in
+# SHARD_BUCKETS buckets by author, post author and follower id (see DjangoGramm.sharding). The bucket
+# count is fixed once posts exist, since post ids carry it. Run `manage.py rebalance_shards` when
+# sharding is first enabled, which records where every bucket is, and again after appending a shard
+# to move buckets onto it; workers reread the bucket map every SHARD_MAP_REFRESH_SECONDS. Listings
+# spanning shards query them from SHARD_QUERY_THREADS threads at once, or one after another when 0
+DATABASE_SHARDS = []
+SHARD_BUCKETS = 1024
+SHARD_MAP_REFRESH_SECONDS = 30
+SHARD_QUERY_THREADS = 0
+
+# Static files; the compressed manifest storages in DjangoGramm.storage write
+# content-hashed names with .gz/.br siblings at collectstatic time
 STATICFILES_DIRS = [BASE_DIR / 'static']
+STATIC_COMPRESSED_EXTENSIONS = ('.js', '.css', '.svg', '.map', '.json', '.txt')
+STATIC_COMPRESS_MIN_SIZE = 1024
+STATIC_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STATIC_MUTABLE_CACHE_CONTROL = 'no-cache'
 
 WSGI_APPLICATION = 'DjangoGramm.wsgi.application'
 
+# Project messages, such as how long a worker took to load the application, go to the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'DjangoGramm': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Listing pages can send the page head first and stream post cards in chunks
+STREAMING_LISTING_PAGES = False
+STREAMING_CHUNK_SIZE = 20
+
+# Image variants rendered locally at upload time
+IMAGE_VARIANTS_ENABLED = True
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', '2'))
+IMAGE_VARIANT_FORMATS = ('avif', 'webp', 'jpeg')
+
+# The new images of a post are uploaded to Cloudinary from up to IMAGE_UPLOAD_WORKERS threads at once;
+# 1 uploads them one after another
+IMAGE_UPLOAD_WORKERS = int(os.getenv('IMAGE_UPLOAD_WORKERS', '4'))
+
+# Unreferenced assets are deleted in batches by `manage.py delete_remote_assets`
+ASSET_DELETION_MAX_ATTEMPTS = 5
+
+# Reuse a stored asset for uploads that look the same, not only identical bytes: same dimensions, same
+# 64-bit perceptual hash and at most IMAGE_DEDUP_MAX_DISTANCE of 256 bits apart in a finer one
+IMAGE_DEDUP_PERCEPTUAL = False
+IMAGE_DEDUP_MAX_DISTANCE = 6
+
+# Browsers upload post images in chunks straight to storage; the post form submits their public ids.
+# LocalDirectUpload keeps them in the default storage for tests and offline development.
+DIRECT_UPLOAD_BACKEND = 'photos.uploads.CloudinaryDirectUpload'
+DIRECT_UPLOAD_FOLDER = 'direct'
+DIRECT_UPLOAD_CHUNK_SIZE = 6 * 1024 * 1024  # Cloudinary needs at least 5 MB per chunk but the last
+DIRECT_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+DIRECT_UPLOAD_MAX_AGE = 3600  # seconds a signed upload stays valid
+
+# Per-worker follow graph (users.follow_graph): follow lists of up to FOLLOW_GRAPH_MAX_USERS users
+# in memory, caught up from the FollowChange log, which `manage.py prune_follow_log` trims, and read
+# again from Followers every FOLLOW_GRAPH_RELOAD_SECONDS
+FOLLOW_GRAPH_MAX_USERS = 50000
+FOLLOW_GRAPH_REFRESH_SECONDS = 1
+FOLLOW_GRAPH_REFRESH_OVERLAP_SECONDS = 10
+FOLLOW_GRAPH_LOG_RETENTION_HOURS = 24
+FOLLOW_GRAPH_RELOAD_SECONDS = 600
+
+# Live like and follower counts are pushed to the posts and profiles on screen over server-sent events
+# from the ASGI application. Workers share changes through the LiveCountEvent table, which
+# `manage.py prune_live_events` trims; posts.live.InProcessBroker is a single-process stand-in.
+# Off unless LIVE_COUNTS_ENABLED=1, which also makes gunicorn.conf.py serve the ASGI application
+LIVE_COUNTS_ENABLED = os.getenv('LIVE_COUNTS_ENABLED', '') == '1'
+LIVE_COUNTS_BROKER = 'posts.live.DatabaseBroker'
+LIVE_COUNTS_INTERVAL_SECONDS = 2  # changes are coalesced and, with DatabaseBroker, polled this often
+LIVE_COUNTS_HEARTBEAT_SECONDS = 25
+LIVE_COUNTS_RETRY_MS = 5000
+LIVE_COUNTS_MAX_CHANNELS = 200
+LIVE_EVENT_RETENTION_MINUTES = 10
+
+# "New since last visit" listings: the posts each user was shown are kept in two generations of Bloom
+# filters of SEEN_POSTS_BYTES_PER_USER in total, cached and written to SeenPostsFilter every
+# SEEN_POSTS_PERSIST_EVERY new posts; only the SEEN_POSTS_CANDIDATES newest posts of a listing are checked.
+# The SEEN_POSTS_CACHE must be shared between workers in production (checked by `manage.py check --deploy`)
+SEEN_POSTS_ENABLED = False
+SEEN_POSTS_FALSE_POSITIVE_RATE = 0.01
+SEEN_POSTS_BYTES_PER_USER = 4096
+SEEN_POSTS_CANDIDATES = 500
+SEEN_POSTS_PERSIST_EVERY = 100
+SEEN_POSTS_CACHE = 'default'
+SEEN_POSTS_CACHE_SECONDS = 7 * 86400
+
+# Tag autocomplete is served from a per-worker prefix index (posts.tag_index) that picks up new tags
+# every TAG_INDEX_REFRESH_SECONDS and reloads all post counts every TAG_INDEX_REBUILD_SECONDS
+TAG_AUTOCOMPLETE_LIMIT = 8
+TAG_INDEX_CACHED_PREFIXES = 10000
+TAG_INDEX_REFRESH_SECONDS = 5
+TAG_INDEX_REBUILD_SECONDS = 600
+
+# User data exports are written by `manage.py export_data` and downloadable for a limited time; the
+# writing worker renews its claim every EXPORT_HEARTBEAT_SECONDS, and an export whose claim was not
+# renewed for EXPORT_RUNNING_TIMEOUT lost its worker and is claimed again
+EXPORT_ROOT = BASE_DIR / 'exports'
+EXPORT_RETENTION_DAYS = 7
+EXPORT_HEARTBEAT_SECONDS = 60
+EXPORT_RUNNING_TIMEOUT = 600  # seconds
+EXPORT_IMAGE_WORKERS = 8
+EXPORT_CHUNK_SIZE = 2000
+
+# Admin changelists of unfiltered tables show the planner's row estimate instead of running COUNT(*),
+# unless the estimate is below ADMIN_EXACT_COUNT_BELOW rows or the database keeps none
+ADMIN_EXACT_COUNT_BELOW = 100000
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -0,0 +1,329 @@
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+
+from posts.models import Like, Post, Tag
+from users.models import Followers, Profile
+
+User = get_user_model()
+
+SCENARIOS = {}
+
+
+def scenario(name: str):
+    """Registers a function as a benchmark scenario of ``manage.py benchmark``."""
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def seed_benchmark_data(users: int, posts: int, likes_per_post: int, tags: int = 30) -> User:
+    """Bulk-creates a synthetic social graph and returns the user viewing it.
+
+    Args:
+        users: Number of users; every user follows the first one.
+        posts: Number of posts, spread evenly over the users.
+        likes_per_post: Number of distinct users liking each post.
+        tags: Size of the tag vocabulary; each post gets three tags.
+    """
+    created = User.objects.bulk_create(
+        User(username=f'bench_user_{number}', email=f'bench_{number}@example.com', password='!')
+        for number in range(users)
+    )
+    Profile.objects.bulk_create(Profile(user=user) for user in created)
+    Followers.objects.bulk_create(Followers(user=created[0], follower=user) for user in created[1:])
+    Followers.objects.bulk_create(
+        Followers(user=user, follower=created[0]) for user in created[1:]
+    )
+    vocabulary = Tag.objects.bulk_create(Tag(name=f'bench_tag_{number}') for number in range(tags))
+    created_posts = Post.objects.bulk_create(
+        Post(user=created[number % users], text=f'Benchmark post {number} ' + 'lorem ipsum ' * 20,
+             author_username=created[number % users].username)
+        for number in range(posts)
+    )
+    Post.tags.through.objects.bulk_create(
+        Post.tags.through(post=post, tag=vocabulary[(index + offset) % tags])
+        for index, post in enumerate(created_posts) for offset in range(3)
+    )
+    Like.objects.bulk_create(
+        Like(post=post, user=created[(index + offset) % users])
+        for index, post in enumerate(created_posts) for offset in range(min(likes_per_post, users))
+    )
+    return created[0]
+
+
+def measure_response(view, request, *args) -> dict:
+    """Calls a view and reads its response the way a WSGI server would.
+
+    Returns:
+        The time until the first body chunk is available, the total time,
+        the number of bytes and the peak memory traced while responding.
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = view(request, *args)
+    chunks = iter(response)
+    first = next(chunks, b'')
+    first_byte = time.perf_counter() - started
+    size = len(first) + sum(len(chunk) for chunk in chunks)
+    total = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'ttfb_ms': first_byte * 1000, 'total_ms': total * 1000, 'bytes': size, 'peak_kib': peak / 1024}
+
+
+@scenario('listing')
+def listing_pages(viewer: User, write) -> None:
+    """Compares buffered and streamed rendering of the listing pages."""
+    from posts.views import feed, friends_news
+    from users.views import profile
+
+    factory = RequestFactory()
+    pages = [
+        ('feed', feed, ()),
+        ('friends_news', friends_news, ()),
+        ('profile', profile, (viewer.username,)),
+    ]
+    write(f"{'page':<14}{'mode':<11}{'TTFB ms':>10}{'total ms':>10}{'KiB sent':>10}{'peak KiB':>10}")
+    for name, view, args in pages:
+        for streaming in (False, True):
+            with override_settings(STREAMING_LISTING_PAGES=streaming):
+                request = factory.get('/')
+                request.user = viewer
+                measure_response(view, request, *args)
+                request = factory.get('/')
+                request.user = viewer
+                result = measure_response(view, request, *args)
+            mode = 'streaming' if streaming else 'buffered'
+            write(f"{name:<14}{mode:<11}{result['ttfb_ms']:>10.1f}{result['total_ms']:>10.1f}"
+                  f"{result['bytes'] / 1024:>10.0f}{result['peak_kib']:>10.0f}")
+
+
+@scenario('delete')
+def delete_posts_and_users(viewer: User, write) -> None:
+    """Compares collector-based deletion with the set-based helpers."""
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+
+    from posts.utils import delete_posts
+    from users.utils import delete_user_account
+
+    cases = [
+        ('post', lambda: Post.objects.filter(user=viewer).first().delete(),
+         lambda: delete_posts(Post.objects.filter(pk=Post.objects.filter(user=viewer).first().pk))),
+        ('user', lambda: User.objects.get(pk=viewer.pk).delete(),
+         lambda: delete_user_account(User.objects.get(pk=viewer.pk))),
+    ]
+    write(f"{'target':<10}{'mode':<11}{'ms':>10}{'queries':>10}")
+    for name, collector, set_based in cases:
+        for mode, delete in (('collector', collector), ('set-based', set_based)):
+            with transaction.atomic():
+                savepoint = transaction.savepoint()
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    delete()
+                    elapsed = (time.perf_counter() - started) * 1000
+                transaction.savepoint_rollback(savepoint)
+            write(f"{name:<10}{mode:<11}{elapsed:>10.1f}{len(queries):>10}")
+
+
+@scenario('compression')
+def compressed_pages(viewer: User, write) -> None:
+    """Reports the bytes sent for the listing pages under each negotiated encoding."""
+    from django.middleware.csrf import CsrfViewMiddleware
+
+    from DjangoGramm.middleware import CompressionMiddleware
+    from posts.views import feed, friends_news
+    from users.views import profile
+
+    factory = RequestFactory()
+    pages = [
+        ('feed', feed, ()),
+        ('friends_news', friends_news, ()),
+        ('profile', profile, (viewer.username,)),
+    ]
+    write(f"{'page':<14}{'mode':<11}{'accept':<11}{'encoding':<10}{'KiB sent':>10}{'saved':>8}{'total ms':>10}")
+    for name, view, args in pages:
+        for streaming in (False, True):
+            mode = 'streaming' if streaming else 'buffered'
+            identity_bytes = None
+            for accept in ('identity', 'gzip', 'br, gzip'):
+                responses = []
+
+                def compressed_view(request, *view_args, view=view):
+                    # CsrfViewMiddleware resets the token flags on the way out, as in the real stack.
+                    stack = CompressionMiddleware(CsrfViewMiddleware(lambda request: view(request, *view_args)))
+                    response = stack(request)
+                    responses.append(response)
+                    return response
+
+                with override_settings(STREAMING_LISTING_PAGES=streaming):
+                    request = factory.get('/', HTTP_ACCEPT_ENCODING=accept)
+                    request.user = viewer
+                    result = measure_response(compressed_view, request, *args)
+                encoding = responses[0].get('Content-Encoding', 'identity')
+                identity_bytes = identity_bytes or result['bytes']
+                saved = 1 - result['bytes'] / identity_bytes
+                write(f"{name:<14}{mode:<11}{accept:<11}{encoding:<10}{result['bytes'] / 1024:>10.0f}"
+                      f"{saved:>8.0%}{result['total_ms']:>10.1f}")
+
+
+@scenario('likes')
+def like_storm(viewer: User, write) -> None:
+    """Compares direct and write-behind like toggles from every user on one post."""
+    from django.db import connection, transaction
+
+    from posts.utils import flush_pending_likes
+    from posts.views import like
+
+    factory = RequestFactory()
+    post = Post.objects.create(user=viewer, text='Viral benchmark post')
+    users = list(User.objects.filter(username__startswith='bench_user_'))
+    write(f"{'mode':<14}{'toggles':>8}{'ms/toggle':>11}{'queries':>9}{'flush ms':>10}")
+    for write_behind in (False, True):
+        with transaction.atomic(), override_settings(LIKES_WRITE_BEHIND=write_behind, THROTTLE_ENABLED=False):
+            savepoint = transaction.savepoint()
+            queries = []
+            with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+                started = time.perf_counter()
+                for user in users * 2:
+                    request = factory.post('/')
+                    request.user = user
+                    like(request, post.id)
+                elapsed = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            flush_pending_likes(batch_size=len(users) * 2)
+            flush_ms = (time.perf_counter() - started) * 1000
+            transaction.savepoint_rollback(savepoint)
+        toggles = len(users) * 2
+        mode = 'write-behind' if write_behind else 'direct'
+        write(f"{mode:<14}{toggles:>8}{elapsed / toggles:>11.2f}{len(queries) / toggles:>9.1f}{flush_ms:>10.1f}")
+
+
+@scenario('export')
+def export_archive(viewer: User, write) -> None:
+    """Reports the time and peak memory of writing the viewer's data export."""
+    import shutil
+    import tempfile
+
+    from users.export import write_export
+    from users.models import DataExport
+
+    export_root = tempfile.mkdtemp()
+    try:
+        with override_settings(EXPORT_ROOT=export_root):
+            # Claimed the way run_pending_exports claims it, so the writer can renew the claim.
+            export = DataExport.objects.create(user=viewer, status=DataExport.RUNNING, started_at=timezone.now())
+            tracemalloc.start()
+            started = time.perf_counter()
+            write_export(export)
+            elapsed = (time.perf_counter() - started) * 1000
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(export_root, ignore_errors=True)
+    write(f"{'posts':>8}{'likes':>8}{'ms':>10}{'KiB written':>13}{'peak KiB':>10}")
+    write(f"{Post.objects.filter(user=viewer).count():>8}{Like.objects.filter(user=viewer).count():>8}"
+          f"{elapsed:>10.1f}{export.size / 1024:>13.0f}{peak / 1024:>10.0f}")
+
+
+@scenario('follow_graph')
+def follow_graph_checks(viewer: User, write) -> None:
+    """Compares relationship checks through the ORM with the in-memory follow graph."""
+    from users.follow_graph import FollowGraph
+
+    graph = FollowGraph()
+    others = list(User.objects.exclude(pk=viewer.pk).values_list('pk', flat=True)[:50])
+    target = others[0]
+    cases = [
+        ('is_following',
+         lambda: Followers.objects.filter(follower=target, user=viewer).exists(),
+         lambda: graph.is_following(target, viewer.pk)),
+        ('is_mutual',
+         lambda: (Followers.objects.filter(follower=target, user=viewer).exists()
+                  and Followers.objects.filter(follower=viewer, user=target).exists()),
+         lambda: graph.is_mutual(target, viewer.pk)),
+        ('followers_among(50)',
+         lambda: set(Followers.objects.filter(user=viewer, follower__in=others).values_list('follower_id', flat=True)),
+         lambda: graph.followers_among(viewer.pk, others)),
+        ('common_following',
+         lambda: set(Followers.objects.filter(follower=viewer).values_list('user_id', flat=True)
+                     .intersection(Followers.objects.filter(follower=target).values_list('user_id', flat=True))),
+         lambda: graph.common_following(viewer.pk, target)),
+    ]
+    write(f"{'check':<22}{'orm us':>10}{'graph us':>10}{'speedup':>9}")
+    for name, orm, indexed in cases:
+        assert orm() == indexed()
+        timings = []
+        for check in (orm, indexed):
+            rounds = 200 if check is orm else 20000
+            started = time.perf_counter()
+            for _ in range(rounds):
+                check()
+            timings.append((time.perf_counter() - started) / rounds * 1e6)
+        write(f"{name:<22}{timings[0]:>10.1f}{timings[1]:>10.2f}{timings[0] / timings[1]:>8.0f}x")
+
+
+@scenario('slow_query_log')
+def slow_query_log_overhead(viewer: User, write) -> None:
+    """Measures the per-query cost of the slow-query logger while queries stay under its threshold."""
+    from DjangoGramm.middleware import wrap_queries
+    from DjangoGramm.slow_queries import SlowQueryLogger
+
+    rounds = 5000
+    request = RequestFactory().get('/')
+    timings = {}
+    with override_settings(SLOW_QUERY_THRESHOLD_MS=60000):
+        for name in ('unwrapped', 'logger', 'unwrapped', 'logger'):
+            started = time.perf_counter()
+            with wrap_queries(SlowQueryLogger(request)) if name == 'logger' else nullcontext():
+                for _ in range(rounds):
+                    Post.objects.filter(pk=viewer.pk).exists()
+            timings[name] = (time.perf_counter() - started) / rounds * 1e6
+    write(f"{'query us':>10}{'logged us':>11}{'overhead us':>13}")
+    write(f"{timings['unwrapped']:>10.1f}{timings['logger']:>11.1f}{timings['logger'] - timings['unwrapped']:>13.2f}")
+
+
+@scenario('tag_autocomplete')
+def tag_autocomplete_lookups(viewer: User, write) -> None:
+    """Compares prefix lookups with LIKE queries and with the in-memory tag index, over 20000 extra tags."""
+    import random
+    import string
+
+    from django.db.models import Count
+
+    from posts.tag_index import TagIndex
+
+    rng = random.Random(42)
+    Tag.objects.bulk_create([Tag(name=''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 12))))
+                             for _ in range(20000)], ignore_conflicts=True)
+    index = TagIndex()
+    started = time.perf_counter()
+    index.rebuild()
+    write(f'index built in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+    prefixes = ['b', 'be', 'ben', 'bench_tag_1', 'q', 'qu', 'xyz']
+    write(f"{'prefix':<14}{'like us':>10}{'index us':>10}{'cold us':>10}")
+    for prefix in prefixes:
+        query = (Tag.objects.filter(name__startswith=prefix).annotate(weight=Count('posts'))
+                 .order_by('-weight', 'name').values_list('name', 'weight')[:8])
+        assert list(query) == index.complete(prefix)
+        rounds = 50
+        started = time.perf_counter()
+        for _ in range(rounds):
+            list(query.all())
+        like_us = (time.perf_counter() - started) / rounds * 1e6
+        started = time.perf_counter()
+        for _ in range(rounds * 100):
+            index.complete(prefix)
+        index_us = (time.perf_counter() - started) / (rounds * 100) * 1e6
+        index._top.clear()
+        started = time.perf_counter()
+        index.complete(prefix)
+        cold_us = (time.perf_counter() - started) * 1e6
+        write(f'{prefix:<14}{like_us:>10.1f}{index_us:>10.2f}{cold_us:>10.1f}')
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+
+def per_process_cache(alias: str) -> bool:
+    """Returns whether a cache lives in each worker's memory, so workers do not see each other's entries."""
+    return isinstance(caches[alias], LocMemCache)
+
+
+@register(Tags.caches, deploy=True)
+def check_throttle_cache(app_configs, **kwargs) -> list[Error]:
+    """Toggle throttling needs a cache shared by all workers, or each worker grants the whole rate."""
+    if settings.THROTTLE_ENABLED and per_process_cache(settings.THROTTLE_CACHE):
+        return [Error(f'THROTTLE_CACHE {settings.THROTTLE_CACHE!r} is kept per process.',
+                      hint='Point it at a Redis or Memcached cache shared by all workers.',
+                      id='DjangoGramm.E001')]
+    return []
+
+
+@register(Tags.caches, deploy=True)
+def check_seen_posts_cache(app_configs, **kwargs) -> list[Error]:
+    """Seen posts need a cache shared by all workers, or each worker shows a user posts another one marked."""
+    if settings.SEEN_POSTS_ENABLED and per_process_cache(settings.SEEN_POSTS_CACHE):
+        return [Error(f'SEEN_POSTS_CACHE {settings.SEEN_POSTS_CACHE!r} is kept per process.',
+                      hint='Point it at a Redis or Memcached cache shared by all workers.',
+                      id='DjangoGramm.E002')]
+    return []
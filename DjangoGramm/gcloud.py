@@ -0,0 +1,27 @@
+import mimetypes
+
+from django.conf import settings
+from storages.backends.gcloud import GoogleCloudStorage
+
+from DjangoGramm.storage import ENCODINGS, HASHED_NAME_RE, CompressedManifestMixin
+
+
+class CompressedManifestGoogleCloudStorage(CompressedManifestMixin, GoogleCloudStorage):
+    """Static files storage for the GCS bucket with long-lived caching of hashed names.
+
+    Compressed siblings are uploaded with the content type of the original file
+    and the matching ``Content-Encoding``.
+    """
+
+    def get_object_parameters(self, name):
+        parameters = super().get_object_parameters(name)
+        base_name, suffix = name, ''
+        if name[-3:] in ENCODINGS:
+            base_name, suffix = name[:-3], name[-3:]
+            parameters['content_encoding'] = ENCODINGS[suffix]
+            parameters['content_type'] = mimetypes.guess_type(base_name)[0] or 'application/octet-stream'
+        if HASHED_NAME_RE.search(base_name):
+            parameters['cache_control'] = settings.STATIC_IMMUTABLE_CACHE_CONTROL
+        else:
+            parameters['cache_control'] = settings.STATIC_MUTABLE_CACHE_CONTROL
+        return parameters
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from DjangoGramm.benchmarks import SCENARIOS, seed_benchmark_data
+
+
+class Command(BaseCommand):
+    help = 'Runs benchmark scenarios against synthetic data inside a transaction that is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+                            help=f"Scenarios to run, all by default: {', '.join(sorted(SCENARIOS))}.")
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--likes-per-post', type=int, default=10)
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or sorted(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        with transaction.atomic():
+            viewer = seed_benchmark_data(options['users'], options['posts'], options['likes_per_post'])
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(f'== {name}'))
+                SCENARIOS[name](viewer, self.stdout.write)
+            transaction.set_rollback(True)
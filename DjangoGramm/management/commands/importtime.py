@@ -0,0 +1,56 @@
+import re
+import subprocess
+import sys
+from collections import Counter
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+# What a fresh worker does before serving its first request.
+STARTUP_SCRIPT = '''
+import time
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+from django.core.handlers.wsgi import WSGIHandler
+WSGIHandler()
+print(f'{(time.perf_counter() - started) * 1000:.1f}')
+'''
+
+
+def parse_importtime(output: str) -> Counter:
+    """Sums the self time in microseconds of every module by top-level package."""
+    totals = Counter()
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            totals[match.group(4).split('.')[0]] += int(match.group(1))
+    return totals
+
+
+class Command(BaseCommand):
+    help = 'Reports the import time of a fresh process per installed app and top-level package.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='Number of packages to list.')
+
+    def handle(self, *args, **options):
+        # The child inherits DJANGO_SETTINGS_MODULE, so --settings applies to it too.
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+                                capture_output=True, text=True, cwd=settings.BASE_DIR)
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+
+        totals = parse_importtime(result.stderr)
+        app_packages = {config.name.split('.')[0] for config in apps.get_app_configs()}
+        self.stdout.write(f"{'package':<32}{'ms':>9}  installed app")
+        for package, microseconds in totals.most_common(options['top']):
+            marker = 'yes' if package in app_packages else ''
+            self.stdout.write(f'{package:<32}{microseconds / 1000:>9.1f}  {marker}')
+        self.stdout.write(f"{'total imports':<32}{sum(totals.values()) / 1000:>9.1f}")
+        self.stdout.write(f"{'startup (setup, URLs, handler)':<32}{float(result.stdout.strip()):>9.1f}")
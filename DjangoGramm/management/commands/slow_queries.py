@@ -0,0 +1,71 @@
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from DjangoGramm.slow_queries import normalize, read_entries
+
+SORT_KEYS = {
+    'total': lambda group: group['total_ms'],
+    'max': lambda group: group['slowest']['ms'],
+    'count': lambda group: group['count'],
+}
+
+
+def summarize(entries) -> list[dict]:
+    """Groups log entries by fingerprint, keeping counts, times, views and the slowest entry of each."""
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(entry['fingerprint'], {
+            'fingerprint': entry['fingerprint'], 'count': 0, 'total_ms': 0.0, 'views': set(), 'slowest': entry,
+        })
+        group['count'] += 1
+        group['total_ms'] += entry['ms']
+        group['views'].add(entry['view'])
+        if entry['ms'] > group['slowest']['ms']:
+            group['slowest'] = entry
+    return list(groups.values())
+
+
+class Command(BaseCommand):
+    help = 'Summarizes the slow-query log by query fingerprint, worst first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Number of fingerprints to list.')
+        parser.add_argument('--sort', choices=SORT_KEYS, default='total',
+                            help='Rank by total time, slowest single query or number of slow queries.')
+        parser.add_argument('--since', type=float, metavar='HOURS', help='Only count entries this recent.')
+        parser.add_argument('--plans', action='store_true', help='Print the plan of the slowest query of each.')
+
+    def handle(self, *args, **options):
+        path = settings.SLOW_QUERY_LOG
+        if not os.path.exists(path):
+            raise CommandError(f'No slow-query log at {path}.')
+        entries = read_entries(path)
+        if options['since'] is not None:
+            cutoff = timezone.now() - timedelta(hours=options['since'])
+            entries = (entry for entry in entries if datetime.fromisoformat(entry['at']) >= cutoff)
+
+        groups = sorted(summarize(entries), key=SORT_KEYS[options['sort']], reverse=True)[:options['top']]
+        if not groups:
+            self.stdout.write('No slow queries logged.')
+            return
+        self.stdout.write(f"{'fingerprint':<14}{'count':>7}{'total ms':>11}{'avg ms':>9}{'max ms':>9}  views")
+        for group in groups:
+            self.stdout.write(
+                f"{group['fingerprint']:<14}{group['count']:>7}{group['total_ms']:>11.1f}"
+                f"{group['total_ms'] / group['count']:>9.1f}{group['slowest']['ms']:>9.1f}  "
+                f"{', '.join(sorted(group['views']))}"
+            )
+        for group in groups:
+            slowest = group['slowest']
+            self.stdout.write(f"\n{group['fingerprint']}  {normalize(slowest['sql'])}")
+            self.stdout.write(f"  slowest: {slowest['ms']:.1f} ms in {slowest['view']} at {slowest['origin']}, "
+                              f"params {slowest['params']}")
+            if options['plans'] and slowest['plan']:
+                heading = 'EXPLAIN ANALYZE' if slowest['analyzed'] else 'EXPLAIN'
+                self.stdout.write(f'  {heading}:')
+                for line in slowest['plan'].splitlines():
+                    self.stdout.write(f'    {line}')
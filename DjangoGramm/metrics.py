@@ -0,0 +1,104 @@
+import os
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+# Metrics are written to memory-mapped files in PROMETHEUS_MULTIPROC_DIR when it is set, which it must be
+# before prometheus_client is imported, so every gunicorn worker's samples are summed by the scrape.
+REQUEST_SECONDS = Histogram(
+    'djangogramm_request_duration_seconds', 'Time to respond to a request, by URL name.', ['view', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RESPONSES = Counter('djangogramm_responses_total', 'Responses sent, by URL name and status code.',
+                    ['view', 'status'])
+DB_QUERIES = Counter('djangogramm_db_queries_total', 'Database queries run, by URL name and database.',
+                     ['view', 'database'])
+DB_QUERY_SECONDS = Counter('djangogramm_db_query_seconds_total', 'Time spent in database queries.',
+                           ['view', 'database'])
+CACHE_LOOKUPS = Counter('djangogramm_cache_lookups_total', 'Cache reads, by cache and hit or miss.',
+                        ['cache', 'result'])
+IMAGE_UPLOAD_SECONDS = Histogram(
+    'djangogramm_image_upload_duration_seconds', 'Time to upload new image content to storage.', ['kind'],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+EMAILS = Counter('djangogramm_emails_total', 'Emails sent, by kind and outcome.', ['kind', 'outcome'])
+
+UNRESOLVED = '<unresolved>'
+
+
+def view_label(request) -> str:
+    """Returns the URL name a request resolved to, e.g. ``feed``, to label its metrics with."""
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None and match.view_name else UNRESOLVED
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+@contextmanager
+def record_email(kind: str):
+    """Counts an email as sent, or as failed if the block raises."""
+    try:
+        yield
+    except Exception:
+        EMAILS.labels(kind, 'failed').inc()
+        raise
+    EMAILS.labels(kind, 'sent').inc()
+
+
+class QueryRecorder:
+    """Counts and times the queries run while installed, per database alias.
+
+    Totals are only added to the shared counters once per request, so a query
+    costs two clock reads and a dictionary update.
+    """
+
+    def __init__(self):
+        self.count = Tally()
+        self.seconds = Tally()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            alias = context['connection'].alias
+            self.count[alias] += 1
+            self.seconds[alias] += time.perf_counter() - started
+
+    def publish(self, view: str) -> None:
+        for alias, count in self.count.items():
+            DB_QUERIES.labels(view, alias).inc(count)
+            DB_QUERY_SECONDS.labels(view, alias).inc(self.seconds[alias])
+
+
+def registry() -> CollectorRegistry:
+    """Returns the registry to expose: every worker's samples in multiprocess mode, this process's otherwise."""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    collected = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collected)
+    return collected
+
+
+def metrics(request):
+    """Exposes the metrics in the Prometheus text format.
+
+    Answers 404 unless ``METRICS_ENABLED`` is set, and requires an
+    ``Authorization: Bearer <METRICS_TOKEN>`` header when a token is configured.
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN and not constant_time_compare(request.headers.get('Authorization', ''),
+                                                            f'Bearer {settings.METRICS_TOKEN}'):
+        response = HttpResponse('Unauthorized', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,236 @@
+import gzip
+import io
+import secrets
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+from DjangoGramm import metrics
+from DjangoGramm.slow_queries import SlowQueryLogger
+
+
+@contextmanager
+def wrap_queries(wrapper):
+    """Installs an execute wrapper on every database connection of the current thread."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+def stream_with_queries(chunks, wrapper, done=None):
+    """Keeps a wrapper installed while a streamed response renders, whose queries run after the view returned."""
+    try:
+        with wrap_queries(wrapper):
+            yield from chunks
+    finally:
+        if done is not None:
+            done()
+
+
+class MetricsMiddleware:
+    """Records each request's latency, status and database queries under its URL name.
+
+    Streamed responses are measured until their last chunk is sent, since the
+    queries of a streamed listing run while its cards are rendered. Not used
+    unless ``METRICS_ENABLED`` is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        queries = metrics.QueryRecorder()
+        with wrap_queries(queries):
+            response = self.get_response(request)
+        if response.streaming and not response.is_async:
+            response.streaming_content = stream_with_queries(
+                response.streaming_content, queries, lambda: self.record(request, response, queries, started))
+        else:
+            self.record(request, response, queries, started)
+        return response
+
+    @staticmethod
+    def record(request, response, queries, started) -> None:
+        view = metrics.view_label(request)
+        metrics.REQUEST_SECONDS.labels(view, request.method).observe(time.perf_counter() - started)
+        metrics.RESPONSES.labels(view, str(response.status_code)).inc()
+        queries.publish(view)
+
+
+class SlowQueryMiddleware:
+    """Logs the queries of a request that take ``SLOW_QUERY_THRESHOLD_MS`` or longer, with their plans.
+
+    Not used while the threshold is None.
+    """
+
+    def __init__(self, get_response):
+        if settings.SLOW_QUERY_THRESHOLD_MS is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        logger = SlowQueryLogger(request)
+        with wrap_queries(logger):
+            response = self.get_response(request)
+        if response.streaming and not response.is_async:
+            response.streaming_content = stream_with_queries(response.streaming_content, logger)
+        return response
+
+
+class ReadYourWritesMiddleware:
+    """Pins a client's reads to the primary database for a short time after it writes.
+
+    Replicas lag behind the primary, so a client that has just liked a post or
+    created one would otherwise be shown a page that does not reflect it yet.
+    """
+    cookie_name = 'pin_primary'
+    safe_methods = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        now = time.time()
+        try:
+            pinned_until = float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            pinned_until = 0
+        is_write = request.method not in self.safe_methods
+        request.pin_primary = is_write or pinned_until > now
+
+        response = self.get_response(request)
+
+        if is_write and response.status_code < 500:
+            window = settings.REPLICA_PIN_SECONDS
+            response.set_cookie(self.cookie_name, f'{now + window:.3f}', max_age=window,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class CompressionMiddleware:
+    """Compresses text responses with brotli or gzip, whichever the client prefers.
+
+    Streamed responses are compressed chunk by chunk and flushed after every
+    chunk, so the browser can still render the page head before the cards.
+    Pages that carry a CSRF token are only gzipped, with a random-length file
+    name in the gzip header, so their compressed length does not leak the
+    token (BREACH).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.is_compressible(response):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        breach_exposed = self.issued_csrf_token(request)
+        encoding = self.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''),
+                                  ('gzip',) if breach_exposed else settings.COMPRESSION_ENCODINGS)
+        if encoding is None:
+            return response
+        filename = _random_filename() if breach_exposed else None
+
+        if response.streaming:
+            response.streaming_content = ENCODERS[encoding](response.streaming_content, flush=True,
+                                                            filename=filename)
+            del response.headers['Content-Length']
+        else:
+            compressed = b''.join(ENCODERS[encoding]([response.content], flush=False, filename=filename))
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def issued_csrf_token(request) -> bool:
+        """Returns whether the response may carry a CSRF token.
+
+        ``get_token`` sets ``CSRF_COOKIE_NEEDS_UPDATE``, and CsrfViewMiddleware
+        sets it back to False once it wrote the cookie, so only the key's
+        presence tells, after the inner middleware ran, that a token was used.
+        """
+        return 'CSRF_COOKIE_NEEDS_UPDATE' in request.META
+
+    def is_compressible(self, response) -> bool:
+        if response.has_header('Content-Encoding') or response.status_code == 206:
+            return False
+        if response.streaming and response.is_async:
+            return False
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return False
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in settings.COMPRESSION_CONTENT_TYPES:
+            return False
+        return response.streaming or len(response.content) >= settings.COMPRESSION_MIN_SIZE
+
+    @staticmethod
+    def negotiate(accept_encoding: str, encodings: tuple) -> str | None:
+        """Returns the first of ``encodings`` the Accept-Encoding header allows, if any."""
+        accepted = {}
+        for item in accept_encoding.split(','):
+            name, _, params = item.strip().lower().partition(';')
+            quality = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            if name:
+                accepted[name] = quality
+        for encoding in encodings:
+            if accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return None
+
+
+def _random_filename() -> bytes:
+    return secrets.token_hex(secrets.randbelow(settings.COMPRESSION_MAX_RANDOM_BYTES) + 1).encode()
+
+
+def _brotli_chunks(chunks, flush: bool, filename: bytes | None = None):
+    import brotli
+
+    compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if flush:
+            data += compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def _gzip_chunks(chunks, flush: bool, filename: bytes | None = None):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(filename=filename, mode='wb', fileobj=buffer, mtime=0,
+                       compresslevel=settings.COMPRESSION_GZIP_LEVEL) as compressor:
+        for chunk in chunks:
+            compressor.write(chunk)
+            if flush:
+                compressor.flush()
+            data = buffer.getvalue()
+            if data:
+                buffer.seek(0)
+                buffer.truncate()
+                yield data
+    yield buffer.getvalue()
+
+
+ENCODERS = {'br': _brotli_chunks, 'gzip': _gzip_chunks}
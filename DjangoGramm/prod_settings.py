@@ -10,6 +10,8 @@ GS_CUSTOM_ENDPOINT = f'https://storage.googleapis.com/{GS_BUCKET_NAME}'
 STATIC_URL = f'{GS_CUSTOM_ENDPOINT}/'
 GS_DEFAULT_ACL = 'publicRead'
 
+STREAMING_LISTING_PAGES = True
+
 # Database
 DATABASES = {
     'default': {
@@ -22,6 +24,28 @@ DATABASES = {
     }
 }
 
+# Read replicas, e.g. DB_REPLICA_HOSTS=10.0.0.2,10.0.0.3
+DATABASE_REPLICAS = []
+for number, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica_{number}'] = {**DATABASES['default'], 'HOST': host.strip()}
+    DATABASE_REPLICAS.append(f'replica_{number}')
+
+# Shards besides the primary, e.g. DB_SHARD_HOSTS=10.0.1.2,10.0.1.3; the primary keeps its share of the buckets
+DATABASE_SHARDS = []
+for number, host in enumerate(filter(None, os.getenv('DB_SHARD_HOSTS', '').split(',')), start=1):
+    DATABASES[f'shard_{number}'] = {**DATABASES['default'], 'HOST': host.strip()}
+    DATABASE_SHARDS.append(f'shard_{number}')
+if DATABASE_SHARDS:
+    DATABASE_SHARDS.insert(0, 'default')
+
+# Cache shared by all workers, e.g. REDIS_URL=redis://10.0.0.4:6379/0; throttling and seen posts keep their state here
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    }
+}
+
 STORAGES = {
     "default": {
         "BACKEND": "storages.backends.gcloud.GoogleCloudStorage",
@@ -31,7 +55,7 @@ STORAGES = {
         },
     },
     "staticfiles": {
-        "BACKEND": "storages.backends.gcloud.GoogleCloudStorage",
+        "BACKEND": "DjangoGramm.gcloud.CompressedManifestGoogleCloudStorage",
         "OPTIONS": {
             "project_id": GS_PROJECT_ID,
             "bucket_name": GS_BUCKET_NAME,
@@ -0,0 +1,66 @@
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+from DjangoGramm.sharding import SHARD_KEYS, shard_for
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replica_reads(view):
+    """Sends the reads of a read-only view to a replica.
+
+    Requests pinned to the primary by ``ReadYourWritesMiddleware``, and any
+    request that is not a GET or HEAD, keep reading from the primary.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or getattr(request, 'pin_primary', False):
+            return view(request, *args, **kwargs)
+        token = _replica_reads.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+    return wrapper
+
+
+class ShardRouter:
+    """Routes posts, likes and follows to the shard of their shard key once ``DATABASE_SHARDS`` is set.
+
+    Only saves, deletes and queries made through an instance of a sharded
+    model, e.g. ``post.likes``, carry a key. Other queries on sharded tables
+    name their shard with ``using(shard_for(key))`` or read every shard
+    through ``across_shards``; any left fall through to the next router.
+    """
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints.get('instance'))
+
+    def _route(self, model, instance):
+        if not settings.DATABASE_SHARDS or model._meta.label_lower not in SHARD_KEYS or instance is None:
+            return None
+        key = SHARD_KEYS.get(instance._meta.label_lower)
+        if key is None or getattr(instance, key) is None:
+            return None
+        return shard_for(getattr(instance, key))
+
+
+class ReplicaRouter:
+    """Routes reads inside ``replica_reads`` views to a random replica and everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
@@ -0,0 +1,269 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from itertools import chain, islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+from django.db.models import QuerySet
+from django.db.models.functions import Mod
+
+# The tables split across DATABASE_SHARDS and the column whose value picks a row's bucket. Posts
+# live with their author; a post id carries its author's bucket (see ``sharded_id``), so likes
+# keyed by post id live with the post, and follows live with the follower.
+SHARD_KEYS = {
+    'posts.post': 'user_id',
+    'posts.like': 'post_id',
+    'users.followers': 'follower_id',
+}
+
+
+def bucket_of(key: int) -> int:
+    return key % settings.SHARD_BUCKETS
+
+
+def sharded_id(number: int, key: int) -> int:
+    """Returns an id built from a globally unique ``number`` that falls in the same bucket as ``key``."""
+    return number * settings.SHARD_BUCKETS + bucket_of(key)
+
+
+class BucketMap:
+    """Which shard holds each bucket, as recorded in ``ShardBucket``.
+
+    Buckets without a row sit on ``DATABASE_SHARDS[bucket % len(DATABASE_SHARDS)]``.
+    ``manage.py rebalance_shards`` records every bucket before moving any, so
+    appending a shard to the setting afterwards moves nothing by itself. The
+    rows are reloaded at most every ``SHARD_MAP_REFRESH_SECONDS``.
+
+    Loading refuses to work while posts created before sharding keep ids that
+    do not name their author's bucket; ``manage.py shard_existing_posts``
+    renumbers them.
+    """
+
+    def __init__(self):
+        self._aliases = {}
+        self._shards = None
+        self._loaded_at = None
+        self._numbered = False
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._aliases, self._shards, self._loaded_at, self._numbered = {}, None, None, False
+
+    def reload(self) -> None:
+        from posts.models import Post, PostNumber, ShardBucket
+
+        if not self._numbered:
+            # Numbers are only handed out to sharded post ids, so posts without any predate sharding.
+            if Post.objects.using('default').exists() and not PostNumber.objects.using('default').exists():
+                raise ImproperlyConfigured('Posts created before DATABASE_SHARDS was set must be renumbered '
+                                           'with `manage.py shard_existing_posts` first.')
+            self._numbered = True
+        aliases = dict(ShardBucket.objects.using('default').values_list('bucket', 'alias'))
+        with self._lock:
+            self._aliases, self._shards = aliases, list(settings.DATABASE_SHARDS)
+            self._loaded_at = time.monotonic()
+
+    def placement(self) -> dict[int, str]:
+        """Returns the shard of every bucket."""
+        self._ensure_current()
+        shards = self._shards
+        return {bucket: self._aliases.get(bucket) or shards[bucket % len(shards)]
+                for bucket in range(settings.SHARD_BUCKETS)}
+
+    def aliases(self) -> list[str]:
+        """Returns every database that may hold buckets, the configured shards first."""
+        self._ensure_current()
+        return list(dict.fromkeys([*self._shards, *self._aliases.values()]))
+
+    def alias(self, bucket: int) -> str:
+        self._ensure_current()
+        return self._aliases.get(bucket) or self._shards[bucket % len(self._shards)]
+
+    def _ensure_current(self) -> None:
+        if self._loaded_at is None or self._shards != settings.DATABASE_SHARDS or \
+                time.monotonic() - self._loaded_at >= settings.SHARD_MAP_REFRESH_SECONDS:
+            self.reload()
+
+
+bucket_map = BucketMap()
+
+
+def shard_for(key: int) -> str | None:
+    """Returns the database holding the rows with shard key ``key``: a user id for posts and follows, a post id
+    for likes. Returns None when sharding is off, so ``using(shard_for(key))`` leaves the choice to the routers.
+    """
+    if not settings.DATABASE_SHARDS:
+        return None
+    return bucket_map.alias(bucket_of(key))
+
+
+def shard_aliases() -> list[str | None]:
+    """Returns every shard, or None alone when sharding is off."""
+    return bucket_map.aliases() if settings.DATABASE_SHARDS else [None]
+
+
+def group_by_shard(keys) -> dict[str | None, list]:
+    """Groups shard keys by the database holding their rows."""
+    groups = defaultdict(list)
+    for key in keys:
+        groups[shard_for(key)].append(key)
+    return dict(groups)
+
+
+def bucket_rows(queryset: QuerySet, bucket: int) -> QuerySet:
+    """Narrows a queryset of a sharded model to the rows of one bucket."""
+    key = SHARD_KEYS[queryset.model._meta.label_lower]
+    return queryset.alias(shard_bucket=Mod(key, settings.SHARD_BUCKETS)).filter(shard_bucket=bucket)
+
+
+class ShardKeyQuerySet(QuerySet):
+    """The queryset of a sharded model: new rows go to the shard of their key unless a database was named.
+
+    Reads still need ``using(shard_for(key))``, or ``across_shards``, since a
+    router cannot see a query's filters.
+    """
+
+    def create(self, **kwargs):
+        if self._db is not None or not settings.DATABASE_SHARDS:
+            return super().create(**kwargs)
+        key = getattr(self.model(**kwargs), SHARD_KEYS[self.model._meta.label_lower])
+        return self.using(shard_for(key)).create(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None or not settings.DATABASE_SHARDS:
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        key = attrgetter(SHARD_KEYS[self.model._meta.label_lower])
+        groups = defaultdict(list)
+        for obj in objs:
+            groups[shard_for(key(obj))].append(obj)
+        for alias, group in groups.items():
+            self.using(alias).bulk_create(group, *args, **kwargs)
+        return objs
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _shard_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.SHARD_QUERY_THREADS, thread_name_prefix='shard-query')
+        return _executor
+
+
+def _run_in_worker(function, queryset):
+    # Worker threads keep their own connections; drop those past CONN_MAX_AGE as a request would.
+    close_old_connections()
+    try:
+        return function(queryset)
+    finally:
+        close_old_connections()
+
+
+class ShardedQuerySet:
+    """One queryset per shard, read as a single sequence merged by ``ordering``.
+
+    ``filter``, ``annotate``, ``prefetch_related`` and the other chainable
+    methods apply to every shard's queryset, so helpers such as
+    ``post_listing`` take it unchanged. Reading it sends one query per shard
+    and merges the rows, which each shard returns already sorted; with
+    ``SHARD_QUERY_THREADS`` set, the shards are queried at the same time.
+    Without an ordering the shards' rows are simply concatenated.
+    """
+
+    CHAINABLE = frozenset({'filter', 'exclude', 'annotate', 'alias', 'select_related', 'prefetch_related',
+                           'only', 'defer'})
+
+    def __init__(self, querysets: dict, ordering: str | None = '-created_at'):
+        self.querysets = {alias: queryset.order_by(ordering) if ordering else queryset
+                          for alias, queryset in querysets.items()}
+        self.ordering = ordering
+        self._result_cache = None
+
+    def __getattr__(self, name):
+        if name not in self.CHAINABLE:
+            raise AttributeError(name)
+
+        def chained(*args, **kwargs):
+            return ShardedQuerySet({alias: getattr(queryset, name)(*args, **kwargs)
+                                    for alias, queryset in self.querysets.items()}, self.ordering)
+        return chained
+
+    def order_by(self, ordering: str) -> 'ShardedQuerySet':
+        return ShardedQuerySet(self.querysets, ordering)
+
+    def gather(self, function) -> list:
+        """Calls ``function`` with each shard's queryset and returns the results."""
+        querysets = list(self.querysets.values())
+        if settings.SHARD_QUERY_THREADS and len(querysets) > 1:
+            # Each call gets a copy of the caller's context, so e.g. replica routing carries over.
+            futures = [_shard_executor().submit(copy_context().run, _run_in_worker, function, queryset)
+                       for queryset in querysets]
+            return [future.result() for future in futures]
+        return [function(queryset) for queryset in querysets]
+
+    def _merge(self, streams):
+        if len(streams) == 1:
+            return iter(streams[0])
+        if not self.ordering:
+            return chain.from_iterable(streams)
+        return heapq.merge(*streams, key=attrgetter(self.ordering.lstrip('-')),
+                           reverse=self.ordering.startswith('-'))
+
+    def _fetch_all(self) -> list:
+        if self._result_cache is None:
+            self._result_cache = list(self._merge(self.gather(list)))
+        return self._result_cache
+
+    def __iter__(self):
+        return iter(self._fetch_all())
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __bool__(self):
+        return bool(self._fetch_all())
+
+    def iterator(self, chunk_size: int | None = None):
+        """Merges the shards while reading each with a server-side cursor, one chunk at a time, without caching."""
+        return self._merge([queryset.iterator(chunk_size=chunk_size) for queryset in self.querysets.values()])
+
+    def __getitem__(self, item: slice) -> list:
+        if not isinstance(item, slice) or item.stop is None:
+            raise TypeError('Sharded querysets only support slices with an end.')
+        limited = ShardedQuerySet({alias: queryset[:item.stop] for alias, queryset in self.querysets.items()},
+                                  None)
+        return list(islice(self._merge(limited.gather(list)), item.start, item.stop, item.step))
+
+    def count(self) -> int:
+        return sum(self.gather(QuerySet.count))
+
+    def exists(self) -> bool:
+        return any(self.gather(QuerySet.exists))
+
+
+def across_shards(queryset: QuerySet, ordering: str | None = '-created_at') -> ShardedQuerySet:
+    """Reads a queryset of a sharded model from every shard."""
+    return ShardedQuerySet({alias: queryset.using(alias) for alias in shard_aliases()}, ordering)
+
+
+def scatter(queryset: QuerySet, field: str, keys, ordering: str | None = '-created_at') -> ShardedQuerySet:
+    """Narrows a queryset of a sharded model to rows whose ``field`` is in ``keys``, the model's shard keys.
+
+    Each shard is only asked for its own keys, and shards holding none of
+    them are not queried. With sharding off ``keys`` may be a subquery.
+    """
+    if not settings.DATABASE_SHARDS:
+        return ShardedQuerySet({None: queryset.filter(**{f'{field}__in': keys})}, ordering)
+    return ShardedQuerySet({alias: queryset.using(alias).filter(**{f'{field}__in': group})
+                            for alias, group in group_by_shard(keys).items()}, ordering)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from DjangoGramm.metrics import view_label
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+VALUES_RE = re.compile(r'(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+')
+SPACE_RE = re.compile(r'\s+')
+
+# Parameters are cut to this many characters in the log.
+MAX_PARAM_LENGTH = 200
+
+_write_lock = threading.Lock()
+
+
+def normalize(sql: str) -> str:
+    """Replaces literals and placeholders with ``?`` and lists of them with ``(...)``.
+
+    Queries that differ only in their values, such as ``id IN (1, 2)`` and
+    ``id IN (3, 4, 5)``, normalize to the same text.
+    """
+    sql = STRING_RE.sub('?', sql).replace('%s', '?')
+    sql = NUMBER_RE.sub('?', sql)
+    sql = VALUES_RE.sub(r'\1', LIST_RE.sub('(...)', sql))
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(sql: str) -> str:
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:12]
+
+
+def query_origin() -> str:
+    """Returns ``file:line in function`` of the innermost project frame that led to the query."""
+    root = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(root) and frame.filename != __file__ and 'site-packages' not in frame.filename:
+            return f'{Path(frame.filename).relative_to(root)}:{frame.lineno} in {frame.name}'
+    return ''
+
+
+def explain(connection, sql: str, params, analyze: bool) -> tuple[str, bool]:
+    """Returns the database's plan for a query and whether it was measured with EXPLAIN ANALYZE.
+
+    ANALYZE runs the query again, so it falls back to a plain EXPLAIN on
+    backends such as SQLite that do not support it.
+    """
+    prefix = None
+    if analyze:
+        try:
+            prefix = connection.ops.explain_query_prefix(analyze=True)
+        except ValueError:
+            analyze = False
+    prefix = prefix or connection.ops.explain_query_prefix()
+    # A savepoint keeps a failed EXPLAIN from breaking the transaction the query ran in.
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'{prefix} {sql}', params)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall()), analyze
+
+
+def redact(param: str) -> str:
+    return param if settings.SLOW_QUERY_LOG_PARAMS else '?'
+
+
+def append_entry(entry: dict) -> None:
+    line = json.dumps(entry, default=str) + '\n'
+    with _write_lock, open(settings.SLOW_QUERY_LOG, 'a', encoding='utf-8') as log:
+        log.write(line)
+
+
+def read_entries(path):
+    """Yields the entries of a slow-query log, skipping lines cut off by a crash."""
+    with open(path, encoding='utf-8') as log:
+        for line in log:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class SlowQueryLogger:
+    """An execute wrapper that logs the queries of a request taking ``SLOW_QUERY_THRESHOLD_MS`` or longer.
+
+    Queries under the threshold only cost two clock reads. Slow ones are
+    appended to ``SLOW_QUERY_LOG`` as JSON lines with their SQL, parameters,
+    view, the project code that ran them and, for single SELECTs, the
+    database's plan; a ``SLOW_QUERY_ANALYZE_RATE`` share of those is explained
+    with EXPLAIN ANALYZE, which runs the query a second time. Unless
+    ``SLOW_QUERY_LOG_PARAMS`` is set, parameters are logged as ``?`` and the
+    quoted values in plans are replaced too.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.threshold = settings.SLOW_QUERY_THRESHOLD_MS / 1000
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        elapsed = time.perf_counter() - started
+        if elapsed >= self.threshold and not self.explaining:
+            self.record(context['connection'], sql, params, many, elapsed)
+        return result
+
+    def record(self, connection, sql: str, params, many: bool, elapsed: float) -> None:
+        entry = {
+            'at': timezone.now().isoformat(),
+            'database': connection.alias,
+            'view': view_label(self.request),
+            'ms': round(elapsed * 1000, 3),
+            'fingerprint': fingerprint(sql),
+            'sql': sql,
+            'params': None if many else [redact(str(param)[:MAX_PARAM_LENGTH]) for param in params or ()],
+            'origin': query_origin(),
+            'plan': None,
+            'analyzed': False,
+        }
+        if not many and sql.lstrip()[:6].upper() == 'SELECT':
+            self.explaining = True
+            try:
+                entry['plan'], entry['analyzed'] = explain(
+                    connection, sql, params, random.random() < settings.SLOW_QUERY_ANALYZE_RATE)
+            except DatabaseError as error:
+                entry['plan'] = f'EXPLAIN failed: {error}'
+            finally:
+                self.explaining = False
+            if not settings.SLOW_QUERY_LOG_PARAMS:
+                entry['plan'] = STRING_RE.sub("'?'", entry['plan'])
+        append_entry(entry)
@@ -0,0 +1,55 @@
+import gzip
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestFilesMixin, StaticFilesStorage
+from django.core.files.base import ContentFile
+
+# Names produced by HashedFilesMixin, e.g. bundle.3f2a9c1b7d4e.js
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+ENCODINGS = {'.gz': 'gzip', '.br': 'br'}
+
+
+def compress(content: bytes) -> dict[str, bytes]:
+    """Returns gzip and brotli encodings of the content, keyed by file suffix."""
+    import brotli
+
+    return {
+        '.gz': gzip.compress(content, compresslevel=9, mtime=0),
+        '.br': brotli.compress(content, mode=brotli.MODE_TEXT, quality=11),
+    }
+
+
+class CompressedManifestMixin(ManifestFilesMixin):
+    """Writes precompressed ``.gz`` and ``.br`` siblings next to every hashed text file.
+
+    Hashed names never change content, so a CDN or the bucket can serve them
+    with ``Cache-Control: immutable`` and pick a sibling by ``Accept-Encoding``
+    instead of compressing on every request.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not isinstance(processed, Exception) and self.is_compressible(hashed_name):
+                self.save_compressed(hashed_name)
+            yield name, hashed_name, processed
+
+    def is_compressible(self, name: str | None) -> bool:
+        return bool(name) and name.endswith(settings.STATIC_COMPRESSED_EXTENSIONS)
+
+    def save_compressed(self, name: str) -> None:
+        with self.open(name) as file:
+            content = file.read()
+        if len(content) < settings.STATIC_COMPRESS_MIN_SIZE:
+            return
+        for suffix, compressed in compress(content).items():
+            if len(compressed) < len(content):
+                # Deleted first so a re-run overwrites instead of picking an alternative name.
+                self.delete(name + suffix)
+                self.save(name + suffix, ContentFile(compressed))
+
+
+class CompressedManifestStaticFilesStorage(CompressedManifestMixin, StaticFilesStorage):
+    """Local ``STATIC_ROOT`` storage for servers that serve precompressed files themselves."""
+
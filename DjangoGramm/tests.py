@@ -0,0 +1,683 @@
+import gzip
+import io
+import json
+import os
+import smtplib
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import brotli
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.checks import Tags, run_checks
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.template import Context, Template
+from django.http import HttpResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.test import RequestFactory, SimpleTestCase, TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from DjangoGramm import metrics
+from DjangoGramm.middleware import CompressionMiddleware
+from DjangoGramm.slow_queries import fingerprint, normalize, read_entries
+from DjangoGramm.routers import ReplicaRouter
+from DjangoGramm.sharding import bucket_map, bucket_of, shard_for
+from DjangoGramm.gcloud import CompressedManifestGoogleCloudStorage
+from photos.models import PostImage
+from posts.models import Like, Post, ShardBucket, Tag
+from users.models import Followers
+from users.utils import send_verification_email
+
+User = get_user_model()
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(TestCase):
+    """Tests for read-replica routing, using two local SQLite databases as primary and replica."""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        """Create the viewer on both databases and a post that only exists on each one."""
+        self.client = Client()
+        self.user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        replica_user = User(id=self.user.id, username='test_user', password=self.user.password)
+        replica_user.save(using='replica')
+        self.primary_post = Post.objects.create(user=self.user, text='post on primary')
+        Post.objects.using('replica').create(user=replica_user, text='post on replica')
+        self.client.login(username='test_user', password='3C5TeBt21')
+
+    def test_listing_reads_from_replica(self):
+        """Listing views read from the replica."""
+        for url in (reverse('feed'), reverse('profile', args=['test_user'])):
+            response = self.client.get(url)
+            self.assertContains(response, 'post on replica')
+            self.assertNotContains(response, 'post on primary')
+
+    def test_reads_stick_to_primary_after_write(self):
+        """After a write the same client reads its own writes from the primary."""
+        response = self.client.post(reverse('like', args=[self.primary_post.id]))
+        self.assertEqual(response.json()['likes_count'], 1)
+        self.assertIn('pin_primary', response.cookies)
+
+        response = self.client.get(reverse('feed'))
+        self.assertContains(response, 'post on primary')
+        self.assertNotContains(response, 'post on replica')
+
+    def test_writes_and_other_reads_use_primary(self):
+        """Outside listing views both reads and writes go to the primary."""
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Post), 'default')
+        self.assertEqual(router.db_for_write(Post), 'default')
+
+    @override_settings(STREAMING_LISTING_PAGES=True)
+    def test_streamed_cards_read_from_replica(self):
+        """Cards streamed after the view returns are still read from the replica."""
+        response = self.client.get(reverse('feed'))
+        body = b''.join(response.streaming_content)
+        self.assertIn(b'post on replica', body)
+        self.assertNotIn(b'post on primary', body)
+
+
+@override_settings(DATABASE_SHARDS=['default', 'shard_1', 'shard_2'])
+class ShardingTest(TestCase):
+    """Tests for sharding posts, likes and follows, using three local SQLite databases as shards."""
+
+    databases = {'default', 'shard_1', 'shard_2'}
+
+    def setUp(self):
+        """Create a viewer and two authors, each on their own shard, with one post per author."""
+        bucket_map.clear()
+        self.client = Client()
+        self.viewer, self.first, self.second = (
+            User.objects.create_user(username=username, password='3C5TeBt21')
+            for username in ('viewer', 'first_author', 'second_author'))
+        self.first_post = Post.objects.create(user=self.first, text='first shard post')
+        self.second_post = Post.objects.create(user=self.second, text='second shard post')
+        self.client.login(username='viewer', password='3C5TeBt21')
+
+    def stored_on(self, model, **filters) -> list[str]:
+        return [alias for alias in self.databases if model.objects.using(alias).filter(**filters).exists()]
+
+    def test_rows_live_on_their_shard(self):
+        """Posts and likes live on the author's shard, follows on the follower's, and post ids name the shard."""
+        self.assertEqual(len({shard_for(user.pk) for user in (self.viewer, self.first, self.second)}), 3)
+        for post in (self.first_post, self.second_post):
+            self.assertEqual(bucket_of(post.pk), bucket_of(post.user_id))
+            self.assertEqual(self.stored_on(Post, pk=post.pk), [shard_for(post.user_id)])
+
+        self.assertTrue(self.client.post(reverse('like', args=[self.first_post.pk])).json()['liked'])
+        self.client.post(reverse('subscribe', args=[self.first.pk]))
+        self.assertEqual(self.stored_on(Like, user=self.viewer), [shard_for(self.first.pk)])
+        self.assertEqual(self.stored_on(Followers, follower=self.viewer), [shard_for(self.viewer.pk)])
+
+    def test_friends_news_merges_shards(self):
+        """Friends news reads each followed author's shard and lists their posts newest first."""
+        for author in (self.first, self.second):
+            self.client.post(reverse('subscribe', args=[author.pk]))
+        newest = Post.objects.create(user=self.first, text='newest shard post')
+        self.client.post(reverse('like', args=[self.second_post.pk]))
+
+        response = self.client.get(reverse('friends_news'))
+        posts = list(response.context['posts'])
+        self.assertEqual(posts, [newest, self.second_post, self.first_post])
+        self.assertEqual([post.likes_count for post in posts], [0, 1, 0])
+        self.assertEqual([bool(post.liked_by_user) for post in posts], [False, True, False])
+
+        with self.settings(STREAMING_LISTING_PAGES=True):
+            body = b''.join(self.client.get(reverse('feed')).streaming_content).decode()
+        self.assertLess(body.index('newest shard post'), body.index('second shard post'))
+        self.assertLess(body.index('second shard post'), body.index('first shard post'))
+
+    def test_followers_span_shards(self):
+        """A user's followers are counted and listed from every follower's shard."""
+        for follower in (self.viewer, self.second):
+            Followers.objects.create(user=self.first, follower=follower)
+        self.assertEqual(len(self.stored_on(Followers, user=self.first)), 2)
+
+        response = self.client.get(reverse('profile', args=['first_author']))
+        self.assertEqual(response.context['followers_count'], 2)
+        self.assertEqual(response.context['following_count'], 0)
+        self.assertContains(response, 'first shard post')
+        response = self.client.get(reverse('followers_list', args=['first_author']))
+        self.assertCountEqual(response.context['users'], [self.viewer, self.second])
+
+    def test_delete_post_clears_its_shard(self):
+        """Deleting a post removes it and its likes from its shard."""
+        Like.objects.create(user=self.viewer, post=self.first_post)
+        self.client.login(username='first_author', password='3C5TeBt21')
+        self.client.post(reverse('delete_post', args=[self.first_post.pk]), HTTP_REFERER='/feed/')
+        self.assertEqual(self.stored_on(Post, pk=self.first_post.pk), [])
+        self.assertEqual(self.stored_on(Like, post_id=self.first_post.pk), [])
+
+    def test_admin_deletes_posts_from_their_shard(self):
+        """The admin's delete page and delete action remove posts that live outside the default database."""
+        User.objects.create_superuser(username='admin', password='3C5TeBt21')
+        self.client.login(username='admin', password='3C5TeBt21')
+        posts = [post for post in (self.first_post, self.second_post) if shard_for(post.pk) != 'default']
+        extra = Post.objects.create(user=posts[0].user, text='another shard post')
+        Like.objects.create(user=self.viewer, post=extra)
+
+        self.client.post(reverse('admin:posts_post_delete', args=[posts[0].pk]), {'post': 'yes'})
+        self.assertEqual(self.stored_on(Post, pk=posts[0].pk), [])
+
+        self.client.post(reverse('admin:posts_post_changelist') + f'?shard={shard_for(extra.pk)}',
+                         {'action': 'delete_selected', 'post': 'yes', '_selected_action': [extra.pk]})
+        self.assertEqual(self.stored_on(Post, pk=extra.pk), [])
+        self.assertEqual(self.stored_on(Like, post_id=extra.pk), [])
+
+    def test_rebalance_moves_buckets_to_new_shard(self):
+        """Adding a shard and rebalancing moves whole buckets onto it, and every post is still found."""
+        with self.settings(DATABASE_SHARDS=['default', 'shard_1']):
+            bucket_map.clear()
+            # High buckets are the ones given up to the new shard.
+            authors = [User.objects.create_user(id=user_id, username=f'author_{user_id}', password='3C5TeBt21')
+                       for user_id in (500, 501, 1020, 1021, 1022, 1023)]
+            posts = [Post.objects.create(user=author, text=f'post of {author.username}') for author in authors]
+            Like.objects.bulk_create(Like(user=self.viewer, post=post) for post in posts)
+            Followers.objects.bulk_create(Followers(user=self.first, follower=author) for author in authors)
+            call_command('rebalance_shards', stdout=io.StringIO())
+            self.assertEqual(ShardBucket.objects.count(), 1024)
+
+        output = io.StringIO()
+        call_command('rebalance_shards', wait=0, stdout=output)
+        self.assertIn('Moved 341 buckets.', output.getvalue())
+        self.assertEqual(ShardBucket.objects.filter(alias='shard_2').count(), 341)
+
+        moved = [post for post in posts if shard_for(post.user_id) == 'shard_2']
+        self.assertEqual([post.user_id for post in moved], [1020, 1021, 1022, 1023])
+        for post in posts:
+            self.assertEqual(self.stored_on(Post, pk=post.pk), [shard_for(post.user_id)])
+            self.assertEqual(self.stored_on(Like, post_id=post.pk), [shard_for(post.user_id)])
+        self.assertEqual(Post.objects.using('shard_2').get(pk=moved[0].pk).created_at, moved[0].created_at)
+        self.assertEqual(sum(Followers.objects.using(alias).filter(user=self.first).count()
+                             for alias in self.databases), 6)
+
+        response = self.client.get(reverse('feed'))
+        self.assertEqual(len(response.context['posts']), 8)
+
+
+class LegacyPostShardingTest(TestCase):
+    """Tests for moving posts created before sharding onto shards."""
+
+    databases = {'default', 'shard_1', 'shard_2'}
+
+    def setUp(self):
+        """Create two authors with a post each, liked, tagged and with an image, while sharding is off."""
+        bucket_map.clear()
+        self.addCleanup(bucket_map.clear)
+        self.viewer = User.objects.create_user(username='viewer', password='3C5TeBt21')
+        self.authors = [User.objects.create_user(id=user_id, username=f'author_{user_id}', password='3C5TeBt21')
+                        for user_id in (1021, 1022)]
+        self.posts = [Post.objects.create(user=author, text=f'post of {author.username}') for author in self.authors]
+        tag = Tag.objects.create(name='legacy')
+        for post in self.posts:
+            Like.objects.create(user=self.viewer, post=post)
+            post.tags.add(tag)
+            PostImage.objects.bulk_create([PostImage(post=post, uploaded_by=post.user, file='legacy')])
+
+    def test_sharding_refuses_unnumbered_posts(self):
+        """Legacy post ids do not name their author's bucket, so sharding refuses to start until they are renumbered."""
+        with self.settings(DATABASE_SHARDS=['default', 'shard_1']):
+            with self.assertRaises(ImproperlyConfigured):
+                shard_for(self.viewer.pk)
+            with self.assertRaises(CommandError):
+                call_command('shard_existing_posts', stdout=io.StringIO())
+
+    def test_renumbered_posts_keep_their_rows(self):
+        """Renumbered posts sit in their author's bucket with their likes, tags and images, and survive a rebalance."""
+        call_command('shard_existing_posts', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(ShardBucket.objects.filter(alias='default').count(), 1024)
+        with self.assertRaises(CommandError):
+            call_command('shard_existing_posts', stdout=io.StringIO())
+
+        posts = list(Post.objects.order_by('user_id'))
+        self.assertEqual([post.user_id for post in posts], [1021, 1022])
+        for post in posts:
+            self.assertGreater(post.pk, max(old.pk for old in self.posts))
+            self.assertEqual(bucket_of(post.pk), bucket_of(post.user_id))
+            self.assertEqual(post.likes.count(), 1)
+            self.assertEqual(post.tags.count(), 1)
+            self.assertEqual(post.images.count(), 1)
+
+        with self.settings(DATABASE_SHARDS=['default', 'shard_1', 'shard_2']):
+            bucket_map.clear()
+            newest = Post.objects.create(user=self.authors[0], text='sharded post')
+            self.assertNotIn(newest.pk, [post.pk for post in posts])
+            call_command('rebalance_shards', wait=0, stdout=io.StringIO())
+            for post in posts:
+                alias = shard_for(post.user_id)
+                self.assertNotEqual(alias, 'default')
+                self.assertTrue(Post.objects.using(alias).filter(pk=post.pk).exists())
+                self.assertTrue(Like.objects.using(alias).filter(post_id=post.pk).exists())
+
+    def test_unsharded_tools_refuse_to_run(self):
+        """Exports and imports only know the default database, so they refuse to run while posts are sharded."""
+        call_command('shard_existing_posts', stdout=io.StringIO())
+        with self.settings(DATABASE_SHARDS=['default', 'shard_1']):
+            with self.assertRaises(CommandError):
+                call_command('export_data', stdout=io.StringIO())
+            with self.assertRaises(CommandError):
+                call_command('import_data', 'users.jsonl', source='legacy', stdout=io.StringIO())
+            self.client.login(username='viewer', password='3C5TeBt21')
+            response = self.client.get(reverse('edit_profile', args=['viewer']))
+            self.assertContains(response, 'Data exports are unavailable at the moment.')
+
+    def test_admin_reads_every_shard(self):
+        """The admin lists one shard at a time and finds a post on whichever shard holds it."""
+        call_command('shard_existing_posts', stdout=io.StringIO())
+        self.client.force_login(User.objects.create_superuser(username='admin', password='3C5TeBt21'))
+        with self.settings(DATABASE_SHARDS=['default', 'shard_1', 'shard_2']):
+            call_command('rebalance_shards', wait=0, stdout=io.StringIO())
+            alias = shard_for(self.authors[0].pk)
+            post = Post.objects.using(alias).get(user=self.authors[0])
+            response = self.client.get(reverse('admin:posts_post_changelist'), {'shard': alias})
+            self.assertIn(post, response.context['cl'].result_list)
+            self.assertNotEqual(alias, 'default')
+            response = self.client.get(reverse('admin:posts_post_change', args=[post.pk]))
+            self.assertEqual(response.context['original'], post)
+
+
+class StaticStorageTest(SimpleTestCase):
+    """Tests for the content-hashed, precompressed static files storage."""
+
+    def setUp(self):
+        """Collect the static files into a temporary STATIC_ROOT."""
+        self.static_root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(STATIC_ROOT=self.static_root, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'DjangoGramm.storage.CompressedManifestStaticFilesStorage'},
+        }))
+        call_command('collectstatic', interactive=False, verbosity=0, stdout=io.StringIO())
+        self.manifest = json.loads((self.static_root / 'staticfiles.json').read_text())['paths']
+
+    def test_bundles_get_hashed_names_with_compressed_siblings(self):
+        """Hashed bundles have gzip and brotli siblings holding the same content."""
+        for name in ('bundle.js', 'bundle.css'):
+            hashed = self.static_root / self.manifest[name]
+            self.assertNotEqual(hashed.name, name)
+            content = hashed.read_bytes()
+            self.assertEqual(gzip.decompress(Path(f'{hashed}.gz').read_bytes()), content)
+            self.assertEqual(brotli.decompress(Path(f'{hashed}.br').read_bytes()), content)
+
+    def test_static_tag_resolves_hashed_names(self):
+        """The {% static %} tag in base.html resolves names through the manifest."""
+        rendered = Template("{% load static %}{% static 'bundle.js' %}").render(Context())
+        self.assertEqual(rendered, f"/static/{self.manifest['bundle.js']}")
+
+
+class GoogleCloudStaticStorageTest(SimpleTestCase):
+    """Tests for the object metadata of static files uploaded to the bucket."""
+
+    def setUp(self):
+        """Create the storage with a local manifest so no request reaches the bucket."""
+        manifest_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.storage = CompressedManifestGoogleCloudStorage(
+            bucket_name='static', manifest_storage=FileSystemStorage(location=manifest_dir))
+
+    def test_hashed_files_are_immutable(self):
+        """Hashed names and their compressed siblings are cached forever with the right encoding."""
+        self.assertEqual(self.storage.get_object_parameters('bundle.0123456789ab.js'),
+                         {'cache_control': 'public, max-age=31536000, immutable'})
+        self.assertEqual(self.storage.get_object_parameters('bundle.0123456789ab.css.br'), {
+            'cache_control': 'public, max-age=31536000, immutable',
+            'content_encoding': 'br',
+            'content_type': 'text/css',
+        })
+
+    def test_unhashed_files_are_revalidated(self):
+        """The manifest and unhashed copies must be revalidated."""
+        self.assertEqual(self.storage.get_object_parameters('staticfiles.json'), {'cache_control': 'no-cache'})
+
+
+class CompressionMiddlewareTest(SimpleTestCase):
+    """Tests for brotli/gzip response compression."""
+
+    page = b'<article class="card">post</article>' * 100
+
+    def respond(self, response, accept_encoding='br, gzip', use_csrf=False):
+        """Pass a response through the middleware for a request accepting the given encodings."""
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        if use_csrf:
+            get_token(request)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_prefers_brotli(self):
+        """Brotli is used when accepted and the body decompresses to the original."""
+        response = self.respond(HttpResponse(self.page))
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(brotli.decompress(response.content), self.page)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+    def test_respects_quality_values(self):
+        """Encodings refused with q=0 are not used."""
+        response = self.respond(HttpResponse(self.page), accept_encoding='br;q=0, gzip;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.respond(HttpResponse(self.page), accept_encoding='identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_skips_small_and_binary_responses(self):
+        """Responses under the size threshold and already compressed types are left alone."""
+        self.assertFalse(self.respond(HttpResponse(b'short')).has_header('Content-Encoding'))
+        image = HttpResponse(self.page, content_type='image/jpeg')
+        self.assertFalse(self.respond(image).has_header('Content-Encoding'))
+
+    def test_csrf_pages_are_gzipped_with_random_padding(self):
+        """Pages carrying a CSRF token are never brotli-compressed and vary in length."""
+        lengths = set()
+        for _ in range(10):
+            response = self.respond(HttpResponse(self.page), use_csrf=True)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(response.content), self.page)
+            lengths.add(len(response.content))
+        self.assertGreater(len(lengths), 1)
+
+    def test_streaming_responses_are_flushed_per_chunk(self):
+        """Every streamed chunk produces compressed output before the next one is read."""
+        chunks = [self.page[:1000], self.page[1000:2000], self.page[2000:]]
+        response = self.respond(StreamingHttpResponse(iter(chunks)))
+        self.assertEqual(response['Content-Encoding'], 'br')
+        compressed = list(response.streaming_content)
+        self.assertGreaterEqual(len(compressed), len(chunks))
+        decompressor = brotli.Decompressor()
+        self.assertEqual(decompressor.process(compressed[0]), chunks[0])
+        self.assertEqual(brotli.decompress(b''.join(compressed)), self.page)
+
+
+class CompressionStackTest(TestCase):
+    """Tests for response compression behind the project's full middleware stack."""
+
+    def test_csrf_pages_gzipped_through_full_stack(self):
+        """With CsrfViewMiddleware in the stack, a page with a form is still gzipped with a padded header."""
+        user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        client = Client()
+        client.force_login(user)
+        with override_settings(COMPRESSION_MIN_SIZE=0):
+            response = client.get(reverse('create_post'), HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        # FLG.FNAME: the header carries the random file name.
+        self.assertTrue(response.content[3] & 0x08)
+        self.assertIn(b'csrfmiddlewaretoken', gzip.decompress(response.content))
+
+
+@override_settings(THROTTLE_RATES={
+    'like_user': '3/min', 'like_target': '5/min', 'subscribe_user': '2/min', 'subscribe_target': '10/min',
+})
+class ToggleThrottleTest(TestCase):
+    """Tests for the token-bucket throttle and contention guard of the like and subscribe toggles."""
+
+    def setUp(self):
+        """Create a post and users to like it, starting from empty buckets."""
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'user_{number}', password='3C5TeBt21')
+                      for number in range(3)]
+        self.post = Post.objects.create(user=self.users[0], text='Viral post')
+        self.client.force_login(self.users[1])
+
+    def like(self, client=None):
+        """Toggle the like on the post."""
+        return (client or self.client).post(reverse('like', args=[self.post.id]))
+
+    def test_user_bucket_returns_429_with_retry_after(self):
+        """A user gets 429 with Retry-After once their bucket is empty."""
+        statuses = [self.like().status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        response = self.like()
+        self.assertEqual(response.json()['success'], False)
+        self.assertIn(int(response['Retry-After']), range(15, 21))
+        self.assertTrue(Like.objects.filter(user=self.users[1]).exists())
+
+    def test_target_bucket_is_shared_by_users(self):
+        """A hot post is limited across all users liking it."""
+        other_client = Client()
+        other_client.force_login(self.users[2])
+        statuses = [self.like(client).status_code for client in (self.client, other_client) * 3]
+        self.assertEqual(statuses, [200, 200, 200, 200, 200, 429])
+
+    def test_toggle_in_progress_is_short_circuited(self):
+        """A toggle arriving while the same user's previous toggle runs does not reach the database."""
+        cache.add(f'throttle:like:guard:{self.users[1].pk}:{self.post.id}', True)
+        with self.assertNumQueries(2):
+            response = self.like()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Like.objects.exists())
+
+    def test_subscribe_is_throttled(self):
+        """Subscribe toggles use their own buckets."""
+        url = reverse('subscribe', args=[self.users[0].id])
+        statuses = [self.client.post(url).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_deploy_check_requires_shared_cache(self):
+        """The deployment checks reject throttling on a cache each worker keeps to itself."""
+        errors = run_checks(tags=[Tags.caches], include_deployment_checks=True)
+        self.assertIn('DjangoGramm.E001', [error.id for error in errors])
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            errors = run_checks(tags=[Tags.caches], include_deployment_checks=True)
+        self.assertNotIn('DjangoGramm.E001', [error.id for error in errors])
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='scraper-token')
+class MetricsTest(TestCase):
+    """Tests for the Prometheus metrics endpoint and the samples recorded for it."""
+
+    def setUp(self):
+        """Log in a user with a post in their feed."""
+        cache.clear()
+        self.user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        self.post = Post.objects.create(user=self.user, text='Measured post')
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def sample(name: str, **labels) -> float:
+        return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+    def scrape(self, token='scraper-token'):
+        return self.client.get(reverse('metrics'), HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_endpoint_requires_the_token(self):
+        """Scrapes without the configured bearer token are refused."""
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.assertEqual(self.scrape('wrong').status_code, 401)
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_endpoint_is_hidden_when_disabled(self):
+        """Without METRICS_ENABLED the endpoint does not exist."""
+        self.assertEqual(self.scrape().status_code, 404)
+
+    def test_requests_are_timed_per_url_name(self):
+        """Latency, status and database queries are recorded under the view's URL name."""
+        observed = self.sample('djangogramm_request_duration_seconds_count', view='feed', method='GET')
+        queries = self.sample('djangogramm_db_queries_total', view='feed', database='default')
+        self.assertEqual(self.client.get(reverse('feed')).status_code, 200)
+
+        self.assertEqual(self.sample('djangogramm_request_duration_seconds_count', view='feed', method='GET'),
+                         observed + 1)
+        self.assertGreater(self.sample('djangogramm_db_queries_total', view='feed', database='default'), queries)
+        self.assertGreater(self.sample('djangogramm_db_query_seconds_total', view='feed', database='default'), 0)
+        self.assertContains(self.scrape(), 'djangogramm_responses_total{status="200",view="feed"}')
+
+    def test_unresolved_requests_share_a_label(self):
+        """404s for unknown paths do not create a label per path."""
+        count = self.sample('djangogramm_responses_total', view=metrics.UNRESOLVED, status='404')
+        self.client.get('/no/such/page/')
+        self.assertEqual(self.sample('djangogramm_responses_total', view=metrics.UNRESOLVED, status='404'),
+                         count + 1)
+
+    def test_throttle_cache_hits_and_misses(self):
+        """The first toggle misses both token buckets in the cache, the second hits them."""
+        hits = self.sample('djangogramm_cache_lookups_total', cache='default', result='hit')
+        misses = self.sample('djangogramm_cache_lookups_total', cache='default', result='miss')
+        for _ in range(2):
+            self.client.post(reverse('like', args=[self.post.id]))
+        self.assertEqual(self.sample('djangogramm_cache_lookups_total', cache='default', result='miss'), misses + 2)
+        self.assertEqual(self.sample('djangogramm_cache_lookups_total', cache='default', result='hit'), hits + 2)
+
+    def test_email_outcomes(self):
+        """Verification emails are counted as sent or failed."""
+        request = RequestFactory().get('/')
+        sent = self.sample('djangogramm_emails_total', kind='verification', outcome='sent')
+        failed = self.sample('djangogramm_emails_total', kind='verification', outcome='failed')
+        send_verification_email(request, self.user)
+        with mock.patch('users.utils.send_mail', side_effect=smtplib.SMTPException), \
+                self.assertRaises(smtplib.SMTPException):
+            send_verification_email(request, self.user)
+        self.assertEqual(self.sample('djangogramm_emails_total', kind='verification', outcome='sent'), sent + 1)
+        self.assertEqual(self.sample('djangogramm_emails_total', kind='verification', outcome='failed'), failed + 1)
+
+    def test_worker_processes_are_summed(self):
+        """In multiprocess mode a scrape adds up the samples every worker process wrote."""
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory}
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', 'from DjangoGramm.metrics import RESPONSES; '
+                                'RESPONSES.labels("feed", "200").inc(3)'], env=env, check=True)
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}):
+                registry = metrics.registry()
+            self.assertEqual(registry.get_sample_value('djangogramm_responses_total',
+                                                       {'view': 'feed', 'status': '200'}), 6)
+
+
+class StartupLogTest(SimpleTestCase):
+    """Tests for the startup time a worker logs."""
+
+    def test_wsgi_logs_load_time(self):
+        """Loading the WSGI application logs how long it took."""
+        result = subprocess.run([sys.executable, '-c', 'import DjangoGramm.wsgi'], capture_output=True, text=True,
+                                check=True, cwd=settings.BASE_DIR)
+        self.assertRegex(result.stderr, r'WSGI application loaded in \d+ ms')
+
+
+class SlowQueryLogTest(TestCase):
+    """Tests for the slow-query log and its summary command."""
+
+    def setUp(self):
+        """Log in a user with a post and point the log at a temporary file."""
+        self.user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        Post.objects.create(user=self.user, text='Slow post')
+        self.client.force_login(self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = Path(directory.name) / 'slow.jsonl'
+        log_setting = override_settings(SLOW_QUERY_LOG=self.log)
+        log_setting.enable()
+        self.addCleanup(log_setting.disable)
+
+    def test_fingerprint_ignores_values(self):
+        """Queries differing only in literals, placeholders and list lengths share a fingerprint."""
+        self.assertEqual(normalize("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'o''k' LIMIT 21"),
+                         'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?')
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+                         fingerprint('SELECT  *\nFROM t WHERE id IN (%s)'))
+        self.assertEqual(normalize('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)'),
+                         'INSERT INTO t (a, b) VALUES (...)')
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_ANALYZE_RATE=1)
+    def test_slow_queries_are_logged_with_view_origin_and_plan(self):
+        """Queries over the threshold are logged with their view, calling code and plan."""
+        self.client.get(reverse('profile', args=['test_user']))
+        entries = [entry for entry in read_entries(self.log) if entry['view'] == 'profile']
+        self.assertTrue(entries)
+        selects = [entry for entry in entries if entry['sql'].startswith('SELECT')]
+        self.assertTrue(all(entry['plan'] for entry in selects))
+        # SQLite has no EXPLAIN ANALYZE, so the plain plan is kept.
+        self.assertFalse(any(entry['analyzed'] for entry in selects))
+        self.assertTrue(any(entry['origin'].startswith('users/views.py') for entry in entries))
+        self.assertNotIn('test_user', [param for entry in entries for param in entry['params']])
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG_PARAMS=True)
+    def test_parameters_are_logged_when_allowed(self):
+        """Parameters are only written to the log with SLOW_QUERY_LOG_PARAMS."""
+        self.client.get(reverse('profile', args=['test_user']))
+        self.assertIn('test_user', [param for entry in read_entries(self.log) for param in entry['params'] or ()])
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=60000)
+    def test_fast_queries_are_not_logged(self):
+        """Nothing is written while every query stays under the threshold."""
+        self.client.get(reverse('profile', args=['test_user']))
+        self.assertFalse(self.log.exists())
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_command_ranks_fingerprints(self):
+        """The summary lists the fingerprints of the logged queries with their counts and plans."""
+        for _ in range(3):
+            self.client.get(reverse('feed'))
+        output = io.StringIO()
+        call_command('slow_queries', '--sort', 'count', '--top', '3', '--plans', stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('fingerprint'))
+        top = lines[1].split()
+        self.assertGreaterEqual(int(top[1]), 3)
+        self.assertIn(f'{top[0]}  SELECT', output.getvalue())
+        self.assertIn('EXPLAIN:', output.getvalue())
+
+        output = io.StringIO()
+        call_command('slow_queries', '--since', '0', stdout=output)
+        self.assertEqual(output.getvalue().strip(), 'No slow queries logged.')
+
+
+class AdminChangelistTest(TestCase):
+    """Tests for admin changelists that stay cheap on large tables."""
+
+    changelists = ['posts_post', 'posts_like', 'posts_tag', 'photos_imageblob', 'photos_postimage',
+                   'photos_avatarimage', 'photos_pendingassetdeletion', 'users_user', 'users_profile',
+                   'users_followers']
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='3C5TeBt21')
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count: int) -> None:
+        for _ in range(count):
+            user = User.objects.create_user(username=f'user{User.objects.count()}')
+            post = Post.objects.create(user=user, text='Test')
+            Like.objects.create(user=self.admin, post=post)
+            Followers.objects.create(user=user, follower=self.admin)
+
+    def changelist_queries(self) -> dict[str, int]:
+        counts = {}
+        for name in self.changelists:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(f'admin:{name}_changelist'))
+            self.assertEqual(response.status_code, 200, name)
+            counts[name] = len(queries)
+        return counts
+
+    def test_queries_do_not_grow_with_rows(self):
+        """Listing more rows does not add a query per row for the related objects they display."""
+        self.add_rows(2)
+        few = self.changelist_queries()
+        self.add_rows(5)
+        self.assertEqual(self.changelist_queries(), few)
+
+    @mock.patch('DjangoGramm.admin.estimated_row_count', return_value=2_000_000)
+    def test_large_unfiltered_table_is_estimated(self, mock_estimate):
+        """The planner's estimate replaces COUNT(*) on large tables, but filtered lists are counted."""
+        self.add_rows(3)
+        response = self.client.get(reverse('admin:posts_post_changelist'))
+        self.assertEqual(response.context['cl'].result_count, 2_000_000)
+        mock_estimate.assert_called_once_with(Post, 'default')
+
+        user = Post.objects.first().user
+        response = self.client.get(reverse('admin:posts_post_changelist'), {'user': user.pk})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    @mock.patch('DjangoGramm.admin.estimated_row_count', return_value=500)
+    def test_small_table_is_counted(self, mock_estimate):
+        """Below ADMIN_EXACT_COUNT_BELOW rows the exact count is shown."""
+        self.add_rows(3)
+        response = self.client.get(reverse('admin:posts_post_changelist'))
+        self.assertEqual(response.context['cl'].result_count, 3)
@@ -0,0 +1,99 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+from DjangoGramm.metrics import record_cache_lookup
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    """Parses a rate such as '30/min' into (requests, period in seconds)."""
+    count, _, period = rate.partition('/')
+    seconds = {'s': 1, 'sec': 1, 'min': 60, 'm': 60, 'hour': 3600, 'h': 3600, 'day': 86400, 'd': 86400}[period]
+    return int(count), seconds
+
+
+class TokenBucket:
+    """A token bucket kept in the throttle cache.
+
+    The bucket holds up to ``capacity`` tokens and refills at ``capacity``
+    tokens per period, so short bursts are allowed while the sustained rate
+    stays bounded. Reading and writing the state is not atomic; concurrent
+    requests may let a few extra requests through, which is acceptable for
+    throttling.
+    """
+
+    def __init__(self, key: str, rate: str):
+        self.key = key
+        self.capacity, period = parse_rate(rate)
+        self.refill_per_second = self.capacity / period
+        self.cache = caches[settings.THROTTLE_CACHE]
+
+    def consume(self) -> float:
+        """Takes a token.
+
+        Returns:
+            0 if a token was taken, otherwise the seconds until one is available.
+        """
+        now = time.time()
+        state = self.cache.get(self.key)
+        record_cache_lookup(settings.THROTTLE_CACHE, state is not None)
+        tokens, updated_at = state or (self.capacity, now)
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+        if tokens < 1:
+            return (1 - tokens) / self.refill_per_second
+        timeout = math.ceil(self.capacity / self.refill_per_second)
+        self.cache.set(self.key, (tokens - 1, now), timeout)
+        return 0
+
+
+def throttled_response(retry_after: float, error: str) -> JsonResponse:
+    response = JsonResponse({'success': False, 'error': error}, status=429)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def throttle_toggle(scope: str, target_kwarg: str):
+    """Limits how often a user can toggle a relation, such as a like or a follow.
+
+    Three checks run before the view:
+
+    * a token bucket per user, with the ``THROTTLE_RATES[f'{scope}_user']`` rate;
+    * a token bucket per target, with the ``THROTTLE_RATES[f'{scope}_target']``
+      rate, protecting hot rows such as a viral post;
+    * a contention guard per user and target, so a toggle sent while the
+      previous one is still being processed is answered without touching the
+      database. The guard expires after ``TOGGLE_GUARD_SECONDS`` at the latest.
+
+    Throttled requests get a 429 JSON response with a ``Retry-After`` header.
+
+    Args:
+        scope: The name of the toggle, e.g. 'like'.
+        target_kwarg: The view keyword argument identifying the target.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'POST' or not settings.THROTTLE_ENABLED:
+                return view(request, *args, **kwargs)
+            target = kwargs[target_kwarg]
+            cache = caches[settings.THROTTLE_CACHE]
+            guard_key = f'throttle:{scope}:guard:{request.user.pk}:{target}'
+            if not cache.add(guard_key, True, settings.TOGGLE_GUARD_SECONDS):
+                return throttled_response(1, 'The previous toggle is still in progress.')
+            try:
+                for bucket in (TokenBucket(f'throttle:{scope}:user:{request.user.pk}',
+                                           settings.THROTTLE_RATES[f'{scope}_user']),
+                               TokenBucket(f'throttle:{scope}:target:{target}',
+                                           settings.THROTTLE_RATES[f'{scope}_target'])):
+                    retry_after = bucket.consume()
+                    if retry_after:
+                        return throttled_response(retry_after, 'Too many requests, try again later.')
+                return view(request, *args, **kwargs)
+            finally:
+                cache.delete(guard_key)
+        return wrapper
+    return decorator
@@ -19,10 +19,14 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from DjangoGramm.metrics import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('users.urls')),
     path('', include('posts.urls')),
+    path('photos/', include('photos.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
 
 if settings.DEBUG:
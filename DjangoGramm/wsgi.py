@@ -7,10 +7,16 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 """
 
+import logging
 import os
+import time
 
 from django.core.wsgi import get_wsgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DjangoGramm.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DjangoGramm.prod_settings')
 
+started = time.perf_counter()
 application = get_wsgi_application()
+
+logging.getLogger('DjangoGramm.startup').info(
+    'WSGI application loaded in %.0f ms', (time.perf_counter() - started) * 1000)
@@ -1,3 +1,6 @@
 import './like.js';
 import './subscribe.js';
+import './upload.js';
+import './tags.js';
+import './live.js';
 import '../css/style.css';
\ No newline at end of file
@@ -0,0 +1,39 @@
+document.addEventListener('DOMContentLoaded', function () {
+    const url = document.body.dataset.liveCounts;
+    if (!url || !window.EventSource) {
+        return;
+    }
+    const likeCounts = new Map();
+    document.querySelectorAll('.like-btn[data-post-id]').forEach(button => {
+        likeCounts.set(button.dataset.postId, button.querySelector('.like-count'));
+    });
+    const followerCounts = new Map();
+    document.querySelectorAll('[data-followers-of]').forEach(count => {
+        followerCounts.set(count.dataset.followersOf, count);
+    });
+    if (!likeCounts.size && !followerCounts.size) {
+        return;
+    }
+
+    const query = new URLSearchParams({
+        posts: Array.from(likeCounts.keys()).join(','),
+        users: Array.from(followerCounts.keys()).join(','),
+    });
+    const source = new EventSource(`${url}?${query}`);
+    source.addEventListener('message', e => {
+        const changes = JSON.parse(e.data);
+        // The absolute count is applied, so the viewer's own clicks are not counted twice.
+        Object.entries(changes.posts || {}).forEach(([id, change]) => {
+            const count = likeCounts.get(id);
+            if (count) {
+                count.textContent = change.count;
+            }
+        });
+        Object.entries(changes.users || {}).forEach(([id, change]) => {
+            const count = followerCounts.get(id);
+            if (count) {
+                count.textContent = change.count;
+            }
+        });
+    });
+});
@@ -0,0 +1,87 @@
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('input[data-tag-autocomplete]').forEach(input => {
+        const wrapper = document.createElement('span');
+        wrapper.className = 'tag-autocomplete';
+        input.parentNode.insertBefore(wrapper, input);
+        wrapper.appendChild(input);
+        const list = document.createElement('ul');
+        list.className = 'tag-suggestions';
+        wrapper.appendChild(list);
+
+        let timer = null;
+        let active = -1;
+        const cache = new Map();
+
+        // Only the tag being typed, after the last comma, is completed.
+        const currentPrefix = () => input.value.split(',').pop().trim().toLowerCase();
+
+        function show(tags) {
+            active = -1;
+            list.replaceChildren(...tags.map(tag => {
+                const item = document.createElement('li');
+                const name = document.createElement('span');
+                name.textContent = `#${tag.name}`;
+                const count = document.createElement('span');
+                count.className = 'tag-count';
+                count.textContent = tag.posts;
+                item.append(name, count);
+                item.addEventListener('mousedown', e => {
+                    e.preventDefault();
+                    choose(tag.name);
+                });
+                return item;
+            }));
+        }
+
+        function choose(name) {
+            const parts = input.value.split(',');
+            parts[parts.length - 1] = parts.length > 1 ? ` ${name}` : name;
+            input.value = `${parts.join(',')}, `;
+            show([]);
+            input.focus();
+        }
+
+        function suggest() {
+            const prefix = currentPrefix();
+            if (!prefix) {
+                show([]);
+                return;
+            }
+            if (cache.has(prefix)) {
+                show(cache.get(prefix));
+                return;
+            }
+            fetch(`${input.dataset.tagAutocomplete}?q=${encodeURIComponent(prefix)}`)
+                .then(res => res.json())
+                .then(data => {
+                    cache.set(prefix, data.tags);
+                    if (currentPrefix() === prefix) {
+                        show(data.tags);
+                    }
+                })
+                .catch(() => show([]));
+        }
+
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            timer = setTimeout(suggest, 100);
+        });
+        input.addEventListener('blur', () => show([]));
+        input.addEventListener('keydown', e => {
+            const items = list.querySelectorAll('li');
+            if (!items.length) {
+                return;
+            }
+            if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                e.preventDefault();
+                active = (active + (e.key === 'ArrowDown' ? 1 : -1) + items.length) % items.length;
+                items.forEach((item, index) => item.classList.toggle('active', index === active));
+            } else if (e.key === 'Enter' && active >= 0) {
+                e.preventDefault();
+                choose(items[active].firstChild.textContent.slice(1));
+            } else if (e.key === 'Escape') {
+                show([]);
+            }
+        });
+    });
+});
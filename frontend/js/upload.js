@@ -0,0 +1,63 @@
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('form[data-direct-upload]').forEach(form => {
+        form.addEventListener('submit', function (e) {
+            const input = this.querySelector('input[type=file][name=images]');
+            if (!input || !input.files.length || this.dataset.uploading) {
+                return;
+            }
+            e.preventDefault();
+            this.dataset.uploading = 'true';
+            const csrfToken = this.querySelector('[name=csrfmiddlewaretoken]').value;
+            const button = this.querySelector('button[type=submit]');
+            button.disabled = true;
+
+            Promise.all(Array.from(input.files).map(file => uploadFile(this.dataset.directUpload, file, csrfToken)))
+                .then(publicIds => {
+                    publicIds.forEach(publicId => {
+                        const hidden = document.createElement('input');
+                        hidden.type = 'hidden';
+                        hidden.name = 'uploaded_images';
+                        hidden.value = publicId;
+                        this.appendChild(hidden);
+                    });
+                    // The images are stored already; only their public ids are submitted.
+                    input.value = '';
+                    this.submit();
+                })
+                .catch(() => {
+                    // Fall back to a regular multipart submit.
+                    this.submit();
+                });
+        });
+    });
+});
+
+function uploadFile(startUrl, file, csrfToken) {
+    return fetch(startUrl, {method: 'POST', headers: {'X-CSRFToken': csrfToken}})
+        .then(res => res.json())
+        .then(upload => uploadChunks(upload, file, csrfToken, 0))
+        .then(upload => upload.public_id);
+}
+
+function uploadChunks(upload, file, csrfToken, start) {
+    const end = Math.min(start + upload.chunk_size, file.size);
+    const body = new FormData();
+    Object.entries(upload.fields).forEach(([name, value]) => body.append(name, value));
+    body.append('file', file.slice(start, end), file.name);
+
+    const headers = {
+        'Content-Range': `bytes ${start}-${end - 1}/${file.size}`,
+        'X-Unique-Upload-Id': upload.public_id,
+    };
+    // Only the local stand-in is on this origin; the CSRF token must not leak to the storage backend.
+    if (new URL(upload.upload_url, window.location.href).origin === window.location.origin) {
+        headers['X-CSRFToken'] = csrfToken;
+    }
+    return fetch(upload.upload_url, {method: 'POST', headers: headers, body: body})
+        .then(res => {
+            if (!res.ok) {
+                throw new Error(`Upload failed with status ${res.status}`);
+            }
+            return end < file.size ? uploadChunks(upload, file, csrfToken, end) : upload;
+        });
+}
@@ -0,0 +1,24 @@
+"""Gunicorn hooks; gunicorn reads this file from the working directory it is started in."""
+import os
+import shutil
+
+# Live counts hold a connection open per client, which only the ASGI application can afford.
+if os.environ.get('LIVE_COUNTS_ENABLED') == '1':
+    wsgi_app = 'DjangoGramm.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+
+
+def on_starting(server):
+    """Clears the metric files of a previous run, which would otherwise be summed into the new one."""
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    """Drops the live gauges of a worker that exited; its counters and histograms stay in the totals."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
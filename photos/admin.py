@@ -1,3 +1,36 @@
 from django.contrib import admin
 
-# Register your models here.
+from DjangoGramm.admin import LargeTableAdmin
+from photos.models import AvatarImage, ImageBlob, PendingAssetDeletion, PostImage
+
+
+@admin.register(ImageBlob)
+class ImageBlobAdmin(LargeTableAdmin):
+    list_display = ('id', 'digest', 'ref_count', 'created_at')
+    sortable_by = ('id',)
+    # Only whole digests, so the lookup uses the unique index.
+    search_fields = ('digest__exact',)
+
+
+@admin.register(PostImage)
+class PostImageAdmin(LargeTableAdmin):
+    list_display = ('id', 'post_id', 'uploaded_by', 'uploaded_at')
+    list_select_related = ('uploaded_by',)
+    sortable_by = ('id',)
+    raw_id_fields = ('post', 'blob', 'uploaded_by')
+
+
+@admin.register(AvatarImage)
+class AvatarImageAdmin(LargeTableAdmin):
+    list_display = ('id', 'uploaded_by', 'uploaded_at')
+    list_select_related = ('uploaded_by',)
+    sortable_by = ('id',)
+    raw_id_fields = ('blob', 'uploaded_by')
+
+
+@admin.register(PendingAssetDeletion)
+class PendingAssetDeletionAdmin(LargeTableAdmin):
+    list_display = ('id', 'location', 'name', 'attempts', 'created_at')
+    sortable_by = ('id',)
+    # The unique (location, name) index starts with the location.
+    list_filter = ('location',)
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from photos.utils import delete_pending_assets
+
+
+class Command(BaseCommand):
+    help = 'Deletes queued unreferenced image assets from Cloudinary and the default storage in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help='Keep running, polling the queue at this interval once it is empty.')
+
+    def handle(self, *args, **options):
+        handled = 0
+        while True:
+            count = delete_pending_assets(options['batch_size'])
+            handled += count
+            if count:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
+        self.stdout.write(self.style.SUCCESS(f'Handled {handled} queued assets.'))
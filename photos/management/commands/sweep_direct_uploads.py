@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from photos.utils import sweep_started_uploads
+
+
+class Command(BaseCommand):
+    help = ('Queues the files of direct uploads that were started but never claimed by a post for deletion '
+            'by delete_remote_assets.')
+
+    def handle(self, *args, **options):
+        count = sweep_started_uploads()
+        self.stdout.write(self.style.SUCCESS(f'Queued {count} abandoned uploads.'))
@@ -1,19 +1,316 @@
-from django.db import models
+import hashlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from cloudinary import CloudinaryResource, uploader
 from cloudinary.models import CloudinaryField
 
+from DjangoGramm.metrics import IMAGE_UPLOAD_SECONDS
+
+from photos.uploads import DirectUpload
+from photos.variants import collect_variants, save_variants, submit_variants
+
+
+# What rendering learns about an image's content that perceptual deduplication compares.
+LIKENESS_FIELDS = ('perceptual_hash', 'perceptual_detail', 'source_width', 'source_height')
+
+
+class ImageBlobManager(models.Manager):
+
+    def acquire(self, blob: 'ImageBlob') -> bool:
+        """Adds a reference to an existing blob.
+
+        Returns:
+            False if the blob was released and deleted in the meantime.
+        """
+        return bool(self.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1))
+
+    def upload(self, file: UploadedFile) -> CloudinaryResource:
+        """Uploads content the way saving a blob would, without touching the database, so it can run in a thread.
+
+        The result can be passed to ``store`` in place of the file.
+        """
+        field = self.model._meta.get_field('file')
+        file.seek(0)
+        return uploader.upload_resource(file, type=field.type, resource_type=field.resource_type, **field.options)
+
+    def find_similar(self, likeness: dict) -> 'ImageBlob | None':
+        """Returns a blob whose image looks the same as the one ``likeness`` describes, if one is stored.
+
+        Candidates share the 64-bit perceptual hash and the source dimensions.
+        The short hash collides easily, e.g. for images with large flat areas,
+        so a candidate is only taken if its 256-bit hash differs in at most
+        ``IMAGE_DEDUP_MAX_DISTANCE`` bits.
+        """
+        detail = int(likeness['perceptual_detail'], 16)
+        candidates = self.filter(perceptual_hash=likeness['perceptual_hash'], source_width=likeness['source_width'],
+                                 source_height=likeness['source_height']).exclude(perceptual_detail='')
+        for blob in candidates[:10]:
+            if (int(blob.perceptual_detail, 16) ^ detail).bit_count() <= settings.IMAGE_DEDUP_MAX_DISTANCE:
+                return blob
+        return None
+
+    def store(self, file: UploadedFile | CloudinaryResource, digest: str, likeness: dict | None) -> 'ImageBlob':
+        """Uploads new content and returns its blob holding the first reference.
+
+        The content is uploaded before the blob is inserted, so no transaction
+        is held open during the transfer. If another request stored the same
+        content concurrently, the fresh upload is discarded and a reference to
+        the existing blob is taken; if the insert fails otherwise, the fresh
+        upload is queued for deletion and the error raised.
+
+        Args:
+            file: The uploaded file, or the result of ``upload``.
+            digest: The SHA-256 of the content.
+            likeness: The ``LIKENESS_FIELDS`` of the rendered content, if it was rendered.
+        """
+        resource = self.upload(file) if isinstance(file, UploadedFile) else file
+        blob = self.model(file=resource, digest=digest, ref_count=1, **(likeness or {}))
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            existing = self.filter(digest=digest).first()
+            if existing is None:
+                PendingAssetDeletion.objects.enqueue(PendingAssetDeletion.CLOUDINARY, [resource.public_id])
+                raise
+            if resource.public_id != existing.file.public_id:
+                PendingAssetDeletion.objects.enqueue(PendingAssetDeletion.CLOUDINARY, [resource.public_id])
+            blob = existing
+            self.acquire(blob)
+        except Exception:
+            PendingAssetDeletion.objects.enqueue(PendingAssetDeletion.CLOUDINARY, [resource.public_id])
+            raise
+        return blob
+
+    def claim(self, upload: DirectUpload) -> 'ImageBlob':
+        """Returns a blob holding a new reference for an asset the browser uploaded directly.
+
+        If the same content is already stored, the fresh asset is queued for
+        deletion and the existing blob is shared instead.
+        """
+        StartedUpload.objects.filter(public_id=upload.public_id).delete()
+        blob = self.filter(digest=upload.digest).first()
+        if blob is None or not self.acquire(blob):
+            return self.store(upload.file, upload.digest, None)
+        if blob.file.public_id != upload.public_id:
+            PendingAssetDeletion.objects.enqueue(PendingAssetDeletion.CLOUDINARY, [upload.public_id])
+        return blob
+
+    def release(self, blob_id: int) -> None:
+        """Drops a reference and deletes the blob with the last one."""
+        self.release_many(Counter([blob_id]))
+
+    def release_many(self, references: Counter) -> None:
+        """Drops references to several blobs with one update per distinct count.
+
+        Blobs left without references are deleted and their remote assets are
+        queued for the background cleaner.
+
+        Args:
+            references: The number of references to drop, keyed by blob id.
+        """
+        by_count = {}
+        for blob_id, count in references.items():
+            by_count.setdefault(count, []).append(blob_id)
+        for count, blob_ids in by_count.items():
+            self.filter(pk__in=blob_ids, ref_count__gte=count).update(ref_count=F('ref_count') - count)
+        with transaction.atomic():
+            # Locked so a concurrent upload cannot take a reference to a blob being deleted.
+            orphans = list(self.select_for_update().filter(pk__in=references, ref_count=0).only('file', 'variants'))
+            if orphans:
+                self.filter(pk__in=[blob.pk for blob in orphans]).delete()
+                PendingAssetDeletion.objects.enqueue(PendingAssetDeletion.CLOUDINARY,
+                                                     [blob.file.public_id for blob in orphans])
+                PendingAssetDeletion.objects.enqueue(PendingAssetDeletion.STORAGE, [
+                    variant['name'] for blob in orphans
+                    for processed in blob.variants.values() for variant in processed['variants']
+                ])
+
+
+class ImageBlob(models.Model):
+    """A stored image asset shared by every upload of identical content."""
+    digest = models.CharField(max_length=64, unique=True)
+    perceptual_hash = models.CharField(max_length=16, null=True, blank=True, db_index=True)
+    perceptual_detail = models.CharField(max_length=64, blank=True)
+    source_width = models.PositiveIntegerField(null=True, blank=True)
+    source_height = models.PositiveIntegerField(null=True, blank=True)
+    file = CloudinaryField('image')
+    variants = models.JSONField(default=dict, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ImageBlobManager()
+
+    def __str__(self):
+        return f"Blob {self.digest[:12]} ({self.ref_count} refs)"
+
+
+class PendingAssetDeletionManager(models.Manager):
+
+    def enqueue(self, location: str, names: list[str]) -> None:
+        """Queues stored files for deletion by ``manage.py delete_remote_assets``."""
+        self.bulk_create([self.model(location=location, name=name) for name in names], ignore_conflicts=True)
+
+
+class PendingAssetDeletion(models.Model):
+    """A stored file that is no longer referenced and waits to be deleted in the background."""
+    CLOUDINARY = 'cloudinary'
+    STORAGE = 'storage'
+    LOCATION_CHOICES = [(CLOUDINARY, 'Cloudinary asset'), (STORAGE, 'Default storage file')]
+
+    location = models.CharField(max_length=16, choices=LOCATION_CHOICES)
+    name = models.CharField(max_length=255)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = PendingAssetDeletionManager()
+
+    class Meta:
+        unique_together = ('location', 'name')
+
+
+class StartedUpload(models.Model):
+    """A direct upload the browser was allowed to start and whose image no post has claimed yet."""
+    user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='+')
+    public_id = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
 
 class BaseImage(models.Model):
     file = CloudinaryField('image')
+    blob = models.ForeignKey(ImageBlob, on_delete=models.PROTECT, null=True, blank=True,
+                             related_name='%(class)s_images')
     uploaded_by = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='%(class)s_images')
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    variants = models.JSONField(default=list, blank=True)
 
     class Meta:
         abstract = True
 
+    def prepare_upload(self) -> None:
+        """Hashes a newly assigned file and starts rendering what its content still lacks.
+
+        Rendering runs in the process pool, so calling this for several images
+        before saving them lets the pool work while earlier images upload.
+        """
+        if not isinstance(self.file, UploadedFile) or getattr(self, '_pending_upload', None):
+            return
+        kind = self._meta.model_name
+        self.file.seek(0)
+        data = self.file.read()
+        self.file.seek(0)
+        digest = hashlib.sha256(data).hexdigest()
+        blob = ImageBlob.objects.filter(digest=digest).first()
+        needs_render = blob is None or (settings.IMAGE_VARIANTS_ENABLED and kind not in blob.variants)
+        future = submit_variants(data, kind) if needs_render else None
+        self._pending_upload = (digest, blob, future)
+
+    def save(self, *args, release_previous_blob: bool = True, **kwargs):
+        # Callers that keep showing the replaced content elsewhere release its blob themselves.
+        if isinstance(self.file, UploadedFile):
+            self.prepare_upload()
+            self._store_upload()
+        super().save(*args, **kwargs)
+        previous_blob_id = getattr(self, '_previous_blob_id', None)
+        if previous_blob_id:
+            self._previous_blob_id = None
+            if release_previous_blob:
+                ImageBlob.objects.release(previous_blob_id)
+
+    def _store_upload(self) -> None:
+        """Points this image at a blob for its content, uploading only unseen content."""
+        blob = self.find_blob()
+        if blob is None:
+            with IMAGE_UPLOAD_SECONDS.labels(self._meta.model_name).time():
+                blob = ImageBlob.objects.store(self.file, self.content_digest, self.likeness)
+        self.attach_blob(blob)
+
+    def find_blob(self) -> ImageBlob | None:
+        """Waits for the rendering of a prepared file and takes a reference to a blob already storing its content.
+
+        Returns:
+            The blob, or None if the content has to be uploaded and stored with
+            ``content_digest`` and ``likeness``.
+        """
+        digest, blob, future = self._pending_upload
+        self._pending_upload = None
+        self._rendered = collect_variants(future)
+        self.content_digest = digest
+        self.likeness = {field: self._rendered[field] for field in LIKENESS_FIELDS} if self._rendered else None
+
+        if blob is None and self.likeness and settings.IMAGE_DEDUP_PERCEPTUAL:
+            blob = ImageBlob.objects.find_similar(self.likeness)
+        if blob is None or not ImageBlob.objects.acquire(blob):
+            return None
+        return blob
+
+    def attach_blob(self, blob: ImageBlob) -> None:
+        """Points an image whose blob was found or stored at it, saving the variants the blob lacks."""
+        kind, digest, rendered = self._meta.model_name, self.content_digest, self._rendered
+        self._rendered = None
+        if rendered and rendered['variants'] and kind not in blob.variants:
+            blob.variants[kind] = save_variants(rendered, digest, kind)
+            ImageBlob.objects.filter(pk=blob.pk).update(variants=blob.variants)
+            # The same content may have been deleted recently, with its variant files still queued.
+            PendingAssetDeletion.objects.filter(
+                location=PendingAssetDeletion.STORAGE,
+                name__in=[variant['name'] for variant in blob.variants[kind]['variants']],
+            ).delete()
+
+        self.use_blob(blob)
+
+    def use_blob(self, blob: ImageBlob) -> None:
+        """Points this image at a blob it holds a reference to; the previous blob is released on save."""
+        self._previous_blob_id = self.blob_id
+        self.blob = blob
+        self.file = blob.file
+        processed = blob.variants.get(self._meta.model_name, {})
+        self.width = processed.get('width')
+        self.height = processed.get('height')
+        self.variants = processed.get('variants', [])
+
+    def snapshot(self) -> dict:
+        """Returns what is needed to render this image later without loading it."""
+        return {
+            'blob': self.blob_id,
+            'file': self.file.get_prep_value() if self.file else None,
+            'width': self.width,
+            'height': self.height,
+            'variants': self.variants,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> 'BaseImage':
+        """Returns an unsaved image that renders like the one the snapshot was taken of."""
+        return cls(file=cls._meta.get_field('file').to_python(snapshot['file']), blob_id=snapshot['blob'],
+                   width=snapshot['width'], height=snapshot['height'], variants=snapshot['variants'])
+
+    def variant_urls(self, fmt: str) -> list[tuple[str, int, int]]:
+        """Returns (url, width, height) for every stored variant of the given format."""
+        return [(default_storage.url(variant['name']), variant['width'], variant['height'])
+                for variant in self.variants if variant['format'] == fmt]
+
 
 class AvatarImage(BaseImage):
     pass
 
 
 class PostImage(BaseImage):
-    post = models.ForeignKey('posts.Post', on_delete=models.CASCADE, related_name='images')
+    # Posts may live on another shard (see DjangoGramm.sharding), so the key has no database constraint.
+    post = models.ForeignKey('posts.Post', on_delete=models.CASCADE, related_name='images', db_constraint=False)
+
+
+@receiver(post_delete, sender=AvatarImage)
+@receiver(post_delete, sender=PostImage)
+def release_image_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        ImageBlob.objects.release(instance.blob_id)
@@ -0,0 +1,53 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+from cloudinary.templatetags.cloudinary import cloudinary_tag
+
+from photos.variants import FORMAT_CONTENT_TYPES
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def responsive_image(context, image, sizes: str, width: int, height: int | None = None, **attrs):
+    """Renders a <picture> with AVIF/WebP/JPEG srcsets for an image with local variants.
+
+    Images uploaded before variants existed, or whose variants could not be
+    generated, fall back to the Cloudinary transformation the templates used before.
+
+    Args:
+        image: An AvatarImage or PostImage instance.
+        sizes: The ``sizes`` attribute describing the rendered width.
+        width: The 1x display width, used to pick the default ``src``.
+        height: Optional display height for square crops in the fallback.
+        attrs: Extra attributes for the <img>, such as ``class`` and ``alt``.
+    """
+    if not image.variants:
+        options = {'quality': 'auto', 'width': width, 'crop': 'pad',
+                   'background': 'gen_fill:ignore-foreground_true', 'loading': 'lazy', **attrs}
+        if height:
+            options['height'] = height
+        return cloudinary_tag(context, image.file, **options)
+
+    sources = []
+    for fmt in ('avif', 'webp'):
+        candidates = image.variant_urls(fmt)
+        if candidates:
+            srcset = ', '.join(f'{url} {w}w' for url, w, _ in candidates)
+            sources.append((FORMAT_CONTENT_TYPES[fmt], srcset, sizes))
+
+    fallbacks = image.variant_urls('jpeg')
+    src, src_width, src_height = next(((url, w, h) for url, w, h in fallbacks if w >= width), fallbacks[-1])
+    img = format_html(
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" loading="lazy" decoding="async"{}>',
+        src,
+        ', '.join(f'{url} {w}w' for url, w, _ in fallbacks),
+        sizes,
+        src_width,
+        src_height,
+        format_html_join('', ' {}="{}"', attrs.items()),
+    )
+    return format_html(
+        '<picture>{}{}</picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', sources),
+        img,
+    )
@@ -1,10 +1,23 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.template import Context, Template
+from django.urls import reverse
+from django.utils import timezone
 from unittest.mock import patch
+from PIL import Image
 
 from posts.models import Post
-from photos.models import AvatarImage, PostImage
+from photos.models import AvatarImage, ImageBlob, PendingAssetDeletion, PostImage, StartedUpload
+from photos.utils import create_post_images
 
 User = get_user_model()
 
@@ -56,3 +69,362 @@ class ImageModelsTestCase(TestCase):
         self.assertEqual(post_image.post, self.post)
         self.assertTrue(post_image.file)
         self.assertIsNotNone(post_image.uploaded_at)
+
+
+def make_jpeg(width: int, height: int, orientation: int | None = None, quality: int = 90) -> bytes:
+    """Return the bytes of a solid-colour JPEG, optionally tagged with an EXIF orientation."""
+    image = Image.new('RGB', (width, height), (200, 30, 30))
+    image.paste((30, 30, 200), (0, 0, width // 2, height))
+    exif = Image.Exif()
+    exif[0x010F] = 'TestCamera'
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', exif=exif, quality=quality)
+    return buffer.getvalue()
+
+
+class ImageVariantsTestCase(TestCase):
+    """Tests for the upload-time responsive variant pipeline."""
+
+    def setUp(self):
+        """Store variants in a temporary media root and render them inline."""
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_VARIANT_WORKERS=0)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        self.post = Post.objects.create(user=self.user, text='Test Test, Test')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    @patch('cloudinary.uploader.upload')
+    def test_post_image_variants_generated(self, mock_upload):
+        """Variants are stored for every width not larger than the source, in each format."""
+        mock_upload.return_value = {'public_id': 'test_post', 'version': '1', 'format': 'jpg',
+                                    'resource_type': 'image', 'type': 'upload'}
+        upload = SimpleUploadedFile('post.jpg', make_jpeg(800, 400), content_type='image/jpeg')
+        image = PostImage.objects.create(file=upload, uploaded_by=self.user, post=self.post)
+
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height), (800, 400))
+        jpeg_widths = [variant['width'] for variant in image.variants if variant['format'] == 'jpeg']
+        self.assertEqual(jpeg_widths, [200, 350, 700])
+        self.assertIn('webp', {variant['format'] for variant in image.variants})
+        variant = next(variant for variant in image.variants if variant['width'] == 700)
+        self.assertEqual(variant['height'], 350)
+
+    @patch('cloudinary.uploader.upload')
+    def test_avatar_variants_square_and_exif_stripped(self, mock_upload):
+        """Avatars are cropped square, orientation is applied and EXIF is dropped."""
+        mock_upload.return_value = {'public_id': 'test_avatar', 'version': '1', 'format': 'jpg',
+                                    'resource_type': 'image', 'type': 'upload'}
+        upload = SimpleUploadedFile('avatar.jpg', make_jpeg(300, 200, orientation=6), content_type='image/jpeg')
+        avatar = AvatarImage.objects.create(file=upload, uploaded_by=self.user)
+
+        self.assertEqual((avatar.width, avatar.height), (200, 200))
+        variant = next(variant for variant in avatar.variants if variant['format'] == 'jpeg')
+        with open(f"{self.media_root}/{variant['name']}", 'rb') as stored, Image.open(stored) as result:
+            self.assertEqual(result.size, (variant['width'], variant['height']))
+            self.assertFalse(result.getexif())
+
+    @patch('cloudinary.uploader.upload')
+    def test_undecodable_upload_has_no_variants(self, mock_upload):
+        """Files that are not images are still stored, just without local variants."""
+        mock_upload.return_value = {'public_id': 'test_post', 'version': '1', 'format': 'jpg',
+                                    'resource_type': 'image', 'type': 'upload'}
+        upload = SimpleUploadedFile('post.jpg', b'postimagecontent', content_type='image/jpeg')
+        image = PostImage.objects.create(file=upload, uploaded_by=self.user, post=self.post)
+        self.assertEqual(image.variants, [])
+        self.assertIsNone(image.width)
+
+    @patch('cloudinary.uploader.upload')
+    def test_responsive_image_tag(self, mock_upload):
+        """The tag emits sources per format and a lazy <img> with explicit dimensions."""
+        mock_upload.return_value = {'public_id': 'test_post', 'version': '1', 'format': 'jpg',
+                                    'resource_type': 'image', 'type': 'upload'}
+        upload = SimpleUploadedFile('post.jpg', make_jpeg(1000, 500), content_type='image/jpeg')
+        image = PostImage.objects.create(file=upload, uploaded_by=self.user, post=self.post)
+
+        template = Template('{% load responsive_images %}'
+                            '{% responsive_image image sizes="100vw" width=700 class="post-image-multi" %}')
+        html = template.render(Context({'image': image}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('sizes="100vw"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('width="700" height="350"', html)
+        self.assertIn('class="post-image-multi"', html)
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class ImageDeduplicationTestCase(TestCase):
+    """Tests for content-addressed, reference-counted image storage."""
+
+    upload_result = {'public_id': 'shared', 'version': '1', 'format': 'jpg',
+                     'resource_type': 'image', 'type': 'upload'}
+
+    def setUp(self):
+        """Create a user and post and keep variants in a temporary media root."""
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        self.post = Post.objects.create(user=self.user, text='Test Test, Test')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def create_image(self, content: bytes) -> PostImage:
+        upload = SimpleUploadedFile('post.jpg', content, content_type='image/jpeg')
+        return PostImage.objects.create(file=upload, uploaded_by=self.user, post=self.post)
+
+    @patch('cloudinary.uploader.upload')
+    def test_identical_uploads_share_one_asset(self, mock_upload):
+        """Uploading the same bytes twice transfers them once and shares the blob."""
+        mock_upload.return_value = self.upload_result
+        content = make_jpeg(400, 300)
+        first = self.create_image(content)
+        second = self.create_image(content)
+
+        self.assertEqual(mock_upload.call_count, 1)
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.public_id, second.file.public_id)
+        self.assertEqual(second.variants, first.variants)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+    @patch('cloudinary.api.delete_resources')
+    @patch('cloudinary.uploader.upload')
+    def test_asset_deleted_with_last_reference(self, mock_upload, mock_delete_resources):
+        """The remote asset is only queued for deletion once no image references it."""
+        mock_upload.return_value = self.upload_result
+        content = make_jpeg(400, 300)
+        first = self.create_image(content)
+        second = self.create_image(content)
+
+        first.delete()
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        self.assertFalse(PendingAssetDeletion.objects.exists())
+
+        second.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        queued = PendingAssetDeletion.objects.filter(location=PendingAssetDeletion.CLOUDINARY)
+        self.assertEqual(list(queued.values_list('name', flat=True)), ['shared'])
+
+        call_command('delete_remote_assets', stdout=io.StringIO())
+        mock_delete_resources.assert_called_once_with(['shared'])
+        self.assertFalse(PendingAssetDeletion.objects.exists())
+
+    @patch('cloudinary.api.delete_resources', side_effect=Exception('API unavailable'))
+    def test_failed_remote_deletion_is_retried(self, mock_delete_resources):
+        """Assets that fail to delete stay queued until the attempt limit is reached."""
+        PendingAssetDeletion.objects.enqueue(PendingAssetDeletion.CLOUDINARY, ['stale'])
+        with override_settings(ASSET_DELETION_MAX_ATTEMPTS=2):
+            call_command('delete_remote_assets', stdout=io.StringIO())
+        self.assertEqual(mock_delete_resources.call_count, 2)
+        self.assertEqual(PendingAssetDeletion.objects.get().attempts, 2)
+
+    @patch('cloudinary.uploader.upload')
+    def test_replaced_avatar_releases_previous_blob(self, mock_upload):
+        """Assigning a new file to an avatar drops the reference to the old content."""
+        mock_upload.return_value = self.upload_result
+        avatar = AvatarImage.objects.create(file=SimpleUploadedFile('a.jpg', make_jpeg(300, 300)),
+                                            uploaded_by=self.user)
+        old_blob_id = avatar.blob_id
+
+        avatar.file = SimpleUploadedFile('b.jpg', make_jpeg(320, 320))
+        avatar.save()
+        self.assertNotEqual(avatar.blob_id, old_blob_id)
+        self.assertFalse(ImageBlob.objects.filter(pk=old_blob_id).exists())
+
+    @override_settings(IMAGE_DEDUP_PERCEPTUAL=True)
+    @patch('cloudinary.uploader.upload')
+    def test_perceptual_duplicate_reuses_asset(self, mock_upload):
+        """With perceptual matching enabled, a re-encoded copy reuses the stored asset."""
+        mock_upload.return_value = self.upload_result
+        first = self.create_image(make_jpeg(400, 300, quality=95))
+        second = self.create_image(make_jpeg(400, 300, quality=60))
+
+        self.assertEqual(mock_upload.call_count, 1)
+        self.assertEqual(first.blob_id, second.blob_id)
+
+    @override_settings(IMAGE_DEDUP_PERCEPTUAL=True)
+    @patch('cloudinary.uploader.upload')
+    def test_perceptual_match_is_verified(self, mock_upload):
+        """Images with another size, or whose finer hash differs, are stored on their own despite a hash match."""
+        mock_upload.return_value = self.upload_result
+        first = self.create_image(make_jpeg(400, 300, quality=95))
+        larger = self.create_image(make_jpeg(800, 600))
+        self.assertNotEqual(larger.blob_id, first.blob_id)
+        self.assertEqual(larger.blob.perceptual_hash, first.blob.perceptual_hash)
+
+        # A collision of the 64-bit hash between images that only share their coarse shape.
+        inverted = int(first.blob.perceptual_detail, 16) ^ (2 ** 256 - 1)
+        ImageBlob.objects.filter(pk=first.blob_id).update(perceptual_detail=f'{inverted:064x}')
+        second = self.create_image(make_jpeg(400, 300, quality=60))
+        self.assertEqual(mock_upload.call_count, 3)
+        self.assertNotIn(second.blob_id, [first.blob_id, larger.blob_id])
+
+    @patch('cloudinary.uploader.upload')
+    def test_upload_runs_outside_the_blob_transaction(self, mock_upload):
+        """Content is sent before the blob's transaction starts, and an insert that fails queues it for deletion."""
+        depth = len(connection.savepoint_ids)
+        transactions = []
+        mock_upload.side_effect = lambda *args, **kwargs: (transactions.append(len(connection.savepoint_ids))
+                                                           or self.upload_result)
+        self.create_image(make_jpeg(400, 300))
+        self.assertEqual(transactions, [depth])
+
+        with patch.object(ImageBlob, 'save', side_effect=DatabaseError('Insert failed')):
+            with self.assertRaisesMessage(DatabaseError, 'Insert failed'):
+                self.create_image(make_jpeg(300, 200))
+        self.assertEqual(list(PendingAssetDeletion.objects.values_list('name', flat=True)), ['shared'])
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, IMAGE_UPLOAD_WORKERS=3)
+class ConcurrentUploadTestCase(TestCase):
+    """Tests for uploading the images of a post from the thread pool."""
+
+    def setUp(self):
+        """Create a user and post and keep variants in a temporary media root."""
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        self.post = Post.objects.create(user=self.user, text='Test Test, Test')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    @staticmethod
+    def fake_upload(file, **options):
+        if file.name == 'broken.jpg':
+            raise Exception('Upload failed')
+        return {'public_id': file.name.removesuffix('.jpg'), 'version': '1', 'format': 'jpg',
+                'resource_type': 'image', 'type': 'upload'}
+
+    def files(self, *names: str) -> list:
+        return [SimpleUploadedFile(f'{name}.jpg', make_jpeg(300 + index, 200), content_type='image/jpeg')
+                for index, name in enumerate(names)]
+
+    @patch('cloudinary.uploader.upload', side_effect=fake_upload)
+    def test_images_inserted_together(self, mock_upload):
+        """Every distinct file is uploaded once and all rows are inserted by one query."""
+        files = self.files('first', 'second', 'third')
+        files.append(SimpleUploadedFile('copy.jpg', files[0].read(), content_type='image/jpeg'))
+        with CaptureQueriesContext(connection) as queries:
+            images = create_post_images(self.post, self.user, files)
+
+        self.assertEqual(mock_upload.call_count, 3)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "photos_postimage"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(sorted(image.file.public_id for image in self.post.images.all()),
+                         ['first', 'first', 'second', 'third'])
+        self.assertTrue(all(image.pk for image in images))
+        self.assertEqual(sorted(ImageBlob.objects.values_list('ref_count', flat=True)), [1, 1, 2])
+
+    @patch('cloudinary.uploader.upload', side_effect=fake_upload)
+    def test_failed_upload_discards_the_others(self, mock_upload):
+        """If one upload fails, no image is created and the assets uploaded meanwhile are queued for deletion."""
+        with self.assertRaisesMessage(Exception, 'Upload failed'):
+            create_post_images(self.post, self.user, self.files('first', 'broken', 'third'))
+
+        self.assertFalse(PostImage.objects.exists())
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertEqual(sorted(PendingAssetDeletion.objects.values_list('name', flat=True)), ['first', 'third'])
+
+    @patch('cloudinary.uploader.upload', side_effect=fake_upload)
+    def test_failed_insert_discards_the_uploads(self, mock_upload):
+        """If the rows cannot be inserted, the blobs roll back and every uploaded asset is queued for deletion."""
+        with patch.object(PostImage.objects, 'bulk_create', side_effect=DatabaseError('Insert failed')):
+            with self.assertRaisesMessage(DatabaseError, 'Insert failed'):
+                create_post_images(self.post, self.user, self.files('first', 'second'))
+
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertEqual(sorted(PendingAssetDeletion.objects.values_list('name', flat=True)), ['first', 'second'])
+
+
+class DirectUploadTestCase(TestCase):
+    """Tests for chunked uploads straight to storage, using the local stand-in backend."""
+
+    def setUp(self):
+        """Keep direct uploads in a temporary media root and log a user in."""
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, DIRECT_UPLOAD_CHUNK_SIZE=1000,
+                                                   DIRECT_UPLOAD_BACKEND='photos.uploads.LocalDirectUpload')
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload(self, content: bytes) -> str:
+        """Uploads the content in chunks the way the browser does and returns its public id."""
+        upload = self.client.post(reverse('start_upload')).json()
+        for start in range(0, len(content), upload['chunk_size']):
+            chunk = content[start:start + upload['chunk_size']]
+            response = self.client.post(
+                upload['upload_url'], {**upload['fields'], 'file': SimpleUploadedFile('post.jpg', chunk)},
+                headers={'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{len(content)}'},
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['done'])
+        return upload['public_id']
+
+    @patch('cloudinary.uploader.upload')
+    def test_post_created_from_direct_uploads(self, mock_upload):
+        """The form submits only public ids; identical content shares one blob and nothing is re-uploaded."""
+        content = make_jpeg(400, 300)
+        first, second = self.upload(content), self.upload(content)
+
+        response = self.client.post(reverse('create_post'),
+                                    {'text': 'Direct', 'tags': '', 'uploaded_images': [first, second]})
+
+        self.assertRedirects(response, reverse('feed'))
+        mock_upload.assert_not_called()
+        images = list(Post.objects.get(text='Direct').images.all())
+        self.assertEqual([image.file.public_id for image in images], [first, first])
+        self.assertEqual((images[0].width, images[0].height), (400, 300))
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+        self.assertTrue(PendingAssetDeletion.objects.filter(name=second).exists())
+
+    def test_foreign_upload_rejected(self):
+        """Public ids outside the user's upload folder are refused and no post is created."""
+        other = User.objects.create_user(username='other', password='3C5TeBt21')
+        response = self.client.post(reverse('create_post'), {
+            'text': 'Direct', 'tags': '', 'uploaded_images': [f'direct/{other.pk}/stolen'],
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'does not belong to you')
+        self.assertFalse(Post.objects.exists())
+
+    def test_tampered_token_rejected(self):
+        """Chunks need the signed token handed out when the upload started."""
+        response = self.client.post(reverse('upload_chunk'),
+                                    {'token': 'forged', 'file': SimpleUploadedFile('post.jpg', b'data')})
+        self.assertEqual(response.status_code, 400)
+
+    def test_abandoned_uploads_swept(self):
+        """Uploads no post claimed expire for forms and are queued for deletion once twice as old."""
+        public_id = self.upload(make_jpeg(400, 300))
+        claimed = self.upload(make_jpeg(320, 240))
+        self.client.post(reverse('create_post'), {'text': 'Direct', 'tags': '', 'uploaded_images': [claimed]})
+        StartedUpload.objects.update(created_at=timezone.now() - timedelta(hours=1, minutes=1))
+
+        response = self.client.post(reverse('create_post'),
+                                    {'text': 'Late', 'tags': '', 'uploaded_images': [public_id]})
+        self.assertContains(response, 'has expired')
+
+        call_command('sweep_direct_uploads', stdout=io.StringIO())
+        self.assertTrue(StartedUpload.objects.exists())
+        StartedUpload.objects.update(created_at=timezone.now() - timedelta(hours=2, minutes=1))
+        call_command('sweep_direct_uploads', stdout=io.StringIO())
+
+        self.assertFalse(StartedUpload.objects.exists())
+        self.assertEqual(list(PendingAssetDeletion.objects.values_list('location', 'name')),
+                         [(PendingAssetDeletion.STORAGE, public_id)])
@@ -0,0 +1,178 @@
+import hashlib
+import re
+import secrets
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from cloudinary import CloudinaryResource
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+@dataclass
+class DirectUpload:
+    """An image the browser uploaded straight to storage, as checked by the server."""
+    public_id: str
+    file: CloudinaryResource
+    digest: str
+    width: int | None
+    height: int | None
+
+
+def direct_upload_backend():
+    """Returns an instance of the ``DIRECT_UPLOAD_BACKEND`` class."""
+    return import_string(settings.DIRECT_UPLOAD_BACKEND)()
+
+
+def new_public_id(user) -> str:
+    """Returns an unguessable public id in the user's upload folder."""
+    return f'{settings.DIRECT_UPLOAD_FOLDER}/{user.pk}/{secrets.token_urlsafe(16)}'
+
+
+def check_owner(user, public_id: str) -> None:
+    """Rejects public ids outside the user's upload folder."""
+    prefix = f'{settings.DIRECT_UPLOAD_FOLDER}/{user.pk}/'
+    if not public_id.startswith(prefix) or '/' in public_id[len(prefix):] or '..' in public_id:
+        raise ValidationError('An uploaded image does not belong to you.')
+
+
+class CloudinaryDirectUpload:
+    """Signed chunked uploads from the browser straight to Cloudinary.
+
+    Every file gets a fresh public id in the user's upload folder, signed with
+    the API secret. The browser sends the file in ``DIRECT_UPLOAD_CHUNK_SIZE``
+    pieces with ``Content-Range`` and ``X-Unique-Upload-Id`` headers, so an
+    interrupted upload can resume from the last chunk, and Cloudinary
+    assembles the asset. Verification reads the asset's metadata through the
+    Admin API; the image bytes never pass through Django.
+    """
+
+    def start(self, user) -> dict:
+        import cloudinary
+        from cloudinary.utils import api_sign_request, cloudinary_api_url
+
+        config = cloudinary.config()
+        params = {'public_id': new_public_id(user), 'timestamp': int(time.time())}
+        return {
+            'upload_url': cloudinary_api_url('upload', resource_type='image'),
+            'fields': {**params, 'api_key': config.api_key,
+                       'signature': api_sign_request(params, config.api_secret)},
+            'public_id': params['public_id'],
+            'chunk_size': settings.DIRECT_UPLOAD_CHUNK_SIZE,
+        }
+
+    def verify(self, user, public_id: str) -> DirectUpload:
+        from cloudinary import api
+        from cloudinary.exceptions import NotFound
+
+        check_owner(user, public_id)
+        try:
+            resource = api.resource(public_id)
+        except NotFound:
+            raise ValidationError('An uploaded image was not found, please upload it again.')
+        if resource['bytes'] > settings.DIRECT_UPLOAD_MAX_BYTES:
+            raise ValidationError('An uploaded image is too large.')
+        return DirectUpload(
+            public_id=public_id,
+            file=CloudinaryResource(public_id, format=resource['format'], version=str(resource['version']),
+                                    type='upload', resource_type='image'),
+            # Cloudinary's etag is the MD5 of the content, prefixed so it never matches a SHA-256 digest.
+            digest=f"md5:{resource['etag']}",
+            width=resource['width'],
+            height=resource['height'],
+        )
+
+    def stored_files(self, public_id: str) -> tuple[str, list[str]]:
+        """Returns the ``PendingAssetDeletion`` location and names of what an upload may have stored."""
+        from photos.models import PendingAssetDeletion
+
+        return PendingAssetDeletion.CLOUDINARY, [public_id]
+
+
+class LocalDirectUpload:
+    """Stand-in for Cloudinary that keeps direct uploads in the default storage.
+
+    Chunks are posted to the ``upload_chunk`` view with the same fields and
+    headers the browser sends to Cloudinary, and the file is saved under its
+    public id once the last chunk arrives. Meant for tests and offline
+    development; the resulting images are addressed by public id like
+    Cloudinary assets everywhere else.
+    """
+    salt = 'photos.direct-upload'
+
+    def start(self, user) -> dict:
+        public_id = new_public_id(user)
+        return {
+            'upload_url': reverse('upload_chunk'),
+            'fields': {'token': signing.dumps(public_id, salt=self.salt)},
+            'public_id': public_id,
+            'chunk_size': settings.DIRECT_UPLOAD_CHUNK_SIZE,
+        }
+
+    def receive_chunk(self, user, token: str, chunk: bytes, content_range: str | None) -> bool:
+        """Stores one chunk and assembles the file once all of it arrived.
+
+        Returns:
+            True if the upload is complete.
+        """
+        try:
+            public_id = signing.loads(token, salt=self.salt, max_age=settings.DIRECT_UPLOAD_MAX_AGE)
+        except signing.BadSignature:
+            raise ValidationError('The upload token is invalid or expired.')
+        check_owner(user, public_id)
+        start, total = 0, len(chunk)
+        if content_range:
+            match = CONTENT_RANGE_RE.match(content_range)
+            if not match or int(match.group(2)) - int(match.group(1)) + 1 != len(chunk):
+                raise ValidationError('Invalid Content-Range header.')
+            start, total = int(match.group(1)), int(match.group(3))
+        if total > settings.DIRECT_UPLOAD_MAX_BYTES:
+            raise ValidationError('The image is too large.')
+
+        parts = f'{public_id}.parts'
+        # Deleted first so a resent chunk replaces the earlier attempt.
+        default_storage.delete(f'{parts}/{start:012d}')
+        default_storage.save(f'{parts}/{start:012d}', ContentFile(chunk))
+        _, names = default_storage.listdir(parts)
+        received = sorted(names)
+        if sum(default_storage.size(f'{parts}/{name}') for name in received) < total:
+            return False
+        content = b''.join(default_storage.open(f'{parts}/{name}').read() for name in received)
+        default_storage.save(public_id, ContentFile(content[:total]))
+        for name in received:
+            default_storage.delete(f'{parts}/{name}')
+        return True
+
+    def verify(self, user, public_id: str) -> DirectUpload:
+        from PIL import Image, UnidentifiedImageError
+
+        check_owner(user, public_id)
+        if not default_storage.exists(public_id):
+            raise ValidationError('An uploaded image was not found, please upload it again.')
+        with default_storage.open(public_id) as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+            file.seek(0)
+            try:
+                with Image.open(file) as image:
+                    width, height = image.size
+            except UnidentifiedImageError:
+                width = height = None
+        return DirectUpload(public_id=public_id, file=CloudinaryResource(public_id, type='upload',
+                                                                         resource_type='image'),
+                            digest=digest, width=width, height=height)
+
+    def stored_files(self, public_id: str) -> tuple[str, list[str]]:
+        """Returns the ``PendingAssetDeletion`` location and names of what an upload may have stored."""
+        from photos.models import PendingAssetDeletion
+
+        parts = f'{public_id}.parts'
+        chunks = [f'{parts}/{name}' for name in default_storage.listdir(parts)[1]] \
+            if default_storage.exists(parts) else []
+        return PendingAssetDeletion.STORAGE, [public_id, *chunks]
@@ -0,0 +1,7 @@
+from django.urls import path
+from photos.views import start_upload, upload_chunk
+
+urlpatterns = [
+    path('uploads/', start_upload, name='start_upload'),
+    path('uploads/chunk/', upload_chunk, name='upload_chunk'),
+]
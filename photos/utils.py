@@ -0,0 +1,232 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
+
+from DjangoGramm.metrics import IMAGE_UPLOAD_SECONDS
+from photos.models import ImageBlob, PendingAssetDeletion, PostImage, StartedUpload
+from photos.uploads import DirectUpload, direct_upload_backend
+
+User = get_user_model()
+
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+
+def create_post_images(post, user: User, files: list, uploads: list[DirectUpload] = ()) -> list[PostImage]:
+    """Stores uploaded files and direct uploads as images of a post.
+
+    Every file is hashed and its variant rendering scheduled before the first
+    upload starts, so the process pool works on all images while they are sent
+    to Cloudinary. With ``IMAGE_UPLOAD_WORKERS`` above one, several files are
+    sent at once and all rows are inserted together (see ``store_images``).
+    Direct uploads are already stored and only get their rows.
+
+    Args:
+        post: The Post the images belong to.
+        user: The user uploading the images.
+        files: The uploaded files from ``request.FILES``.
+        uploads: Images the browser uploaded directly, from ``verify_direct_uploads``.
+    """
+    images = [PostImage(file=file, uploaded_by=user, post=post) for file in files]
+    for image in images:
+        image.prepare_upload()
+    if settings.IMAGE_UPLOAD_WORKERS > 1 and len(images) > 1:
+        return store_images(post, user, images, uploads)
+    for image in images:
+        image.save()
+    for upload in uploads:
+        image = direct_upload_image(post, user, upload)
+        image.save()
+        images.append(image)
+    return images
+
+
+def direct_upload_image(post, user: User, upload: DirectUpload) -> PostImage:
+    """Returns an unsaved image of a post for an asset the browser uploaded directly."""
+    image = PostImage(uploaded_by=user, post=post)
+    image.use_blob(ImageBlob.objects.claim(upload))
+    image.width = image.width or upload.width
+    image.height = image.height or upload.height
+    return image
+
+
+def get_upload_executor() -> ThreadPoolExecutor:
+    """Returns the per-process thread pool that uploads post images, creating it on first use."""
+    global _upload_executor
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(settings.IMAGE_UPLOAD_WORKERS, thread_name_prefix='image-upload')
+        return _upload_executor
+
+
+def _timed_upload(kind: str, file):
+    with IMAGE_UPLOAD_SECONDS.labels(kind).time():
+        return ImageBlob.objects.upload(file)
+
+
+def store_images(post, user: User, images: list[PostImage], uploads: list[DirectUpload] = ()) -> list[PostImage]:
+    """Uploads the content of prepared images concurrently, then inserts every image with one query.
+
+    Content that is already stored is shared as usual. The rest is sent to
+    Cloudinary from the ``IMAGE_UPLOAD_WORKERS`` thread pool, once per
+    distinct content, and only the threads talk to Cloudinary: blobs and
+    image rows are written by the caller's thread in one transaction after
+    every upload finished. If any upload or the transaction fails, the
+    assets uploaded are queued for deletion once the transaction has rolled
+    back, the blob references taken are given back and the error is raised.
+
+    Args:
+        post: The Post the images belong to.
+        user: The user uploading the images.
+        images: Images of the post whose files went through ``prepare_upload``.
+        uploads: Images the browser uploaded directly, inserted along with them.
+
+    Returns:
+        The inserted images, direct uploads last.
+    """
+    found = [image.find_blob() for image in images]
+    sending = {}
+    for image, blob in zip(images, found):
+        if blob is None and image.content_digest not in sending:
+            sending[image.content_digest] = get_upload_executor().submit(_timed_upload, image._meta.model_name,
+                                                                         image.file)
+    wait(sending.values())
+
+    def discard():
+        PendingAssetDeletion.objects.enqueue(PendingAssetDeletion.CLOUDINARY, [
+            future.result().public_id for future in sending.values() if not future.exception()])
+        ImageBlob.objects.release_many(Counter(blob.pk for blob in found if blob is not None))
+
+    failures = [future.exception() for future in sending.values() if future.exception()]
+    if failures:
+        discard()
+        raise failures[0]
+
+    try:
+        with transaction.atomic():
+            blobs = {}
+            for image, blob in zip(images, found):
+                if blob is None:
+                    if image.content_digest in blobs:
+                        blob = blobs[image.content_digest]
+                        ImageBlob.objects.acquire(blob)
+                    else:
+                        blob = ImageBlob.objects.store(sending[image.content_digest].result(), image.content_digest,
+                                                       image.likeness)
+                        blobs[image.content_digest] = blob
+                image.attach_blob(blob)
+            images += [direct_upload_image(post, user, upload) for upload in uploads]
+            PostImage.objects.bulk_create(images)
+    except Exception:
+        discard()
+        raise
+    return images
+
+
+def verify_direct_uploads(user: User, public_ids: list[str]) -> list[DirectUpload]:
+    """Checks the public ids a form submitted for images the browser uploaded directly.
+
+    Only uploads started within ``DIRECT_UPLOAD_MAX_AGE`` are accepted, so an
+    image is never claimed once ``sweep_started_uploads`` may be deleting it.
+
+    Raises:
+        ValidationError: If an image is missing, too large, expired or not the user's.
+    """
+    backend = direct_upload_backend()
+    uploads = [backend.verify(user, public_id) for public_id in dict.fromkeys(public_ids) if public_id]
+    started_after = timezone.now() - timedelta(seconds=settings.DIRECT_UPLOAD_MAX_AGE)
+    fresh = set(StartedUpload.objects.filter(user=user, created_at__gte=started_after,
+                                             public_id__in=[upload.public_id for upload in uploads])
+                .values_list('public_id', flat=True))
+    if any(upload.public_id not in fresh for upload in uploads):
+        raise ValidationError('An uploaded image has expired, please upload it again.')
+    return uploads
+
+
+def sweep_started_uploads() -> int:
+    """Queues the files of direct uploads that no post claimed in time for deletion.
+
+    Uploads are kept twice ``DIRECT_UPLOAD_MAX_AGE``, so a form submitted just
+    before its upload expired is handled before the files are queued.
+
+    Returns:
+        The number of abandoned uploads.
+    """
+    backend = direct_upload_backend()
+    started_before = timezone.now() - timedelta(seconds=2 * settings.DIRECT_UPLOAD_MAX_AGE)
+    abandoned = list(StartedUpload.objects.filter(created_at__lt=started_before)
+                     .values_list('pk', 'public_id'))
+    with transaction.atomic():
+        for _, public_id in abandoned:
+            location, names = backend.stored_files(public_id)
+            PendingAssetDeletion.objects.enqueue(location, names)
+        StartedUpload.objects.filter(pk__in=[pk for pk, _ in abandoned]).delete()
+    return len(abandoned)
+
+
+def delete_images(images: QuerySet) -> None:
+    """Deletes image rows with a single DELETE and releases their blobs in bulk.
+
+    Unlike ``QuerySet.delete()``, this does not load every image to send its
+    ``post_delete`` signal; blobs left without references queue their assets
+    for ``delete_pending_assets``.
+
+    Args:
+        images: AvatarImage or PostImage rows to delete.
+    """
+    with transaction.atomic():
+        blob_references = Counter(images.exclude(blob=None).values_list('blob_id', flat=True))
+        # Skips the post_delete signal, whose only receiver, ``release_image_blob``, is replaced by release_many.
+        images._raw_delete(images.db)
+        ImageBlob.objects.release_many(blob_references)
+
+
+def delete_pending_assets(batch_size: int = 100) -> int:
+    """Deletes one batch of queued files from Cloudinary and the default storage.
+
+    Cloudinary assets are removed with a single Admin API call per batch. Files
+    that fail to delete stay queued and are retried up to
+    ``ASSET_DELETION_MAX_ATTEMPTS`` times.
+
+    Args:
+        batch_size: Maximum number of queued files to handle; Cloudinary accepts up to 100.
+
+    Returns:
+        The number of queued files that were handled.
+    """
+    from cloudinary import api
+
+    batch = list(PendingAssetDeletion.objects
+                 .filter(attempts__lt=settings.ASSET_DELETION_MAX_ATTEMPTS)
+                 .order_by('id')[:batch_size])
+    done, failed = [], []
+
+    remote = [pending for pending in batch if pending.location == PendingAssetDeletion.CLOUDINARY]
+    if remote:
+        try:
+            api.delete_resources([pending.name for pending in remote])
+            done.extend(remote)
+        except Exception:
+            failed.extend(remote)
+
+    for pending in batch:
+        if pending.location == PendingAssetDeletion.STORAGE:
+            try:
+                default_storage.delete(pending.name)
+                done.append(pending)
+            except Exception:
+                failed.append(pending)
+
+    PendingAssetDeletion.objects.filter(pk__in=[pending.pk for pending in done]).delete()
+    PendingAssetDeletion.objects.filter(pk__in=[pending.pk for pending in failed]).update(
+        attempts=F('attempts') + 1)
+    return len(batch)
@@ -0,0 +1,156 @@
+import io
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# Widths (in CSS pixels, 1x and 2x) at which the templates display each kind of image.
+VARIANT_SPECS = {
+    'postimage': {'widths': (200, 350, 700, 1400), 'square': False},
+    'avatarimage': {'widths': (50, 100, 150, 300), 'square': True},
+}
+
+FORMAT_CONTENT_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+_executor = None
+
+
+def render_variants(data: bytes, widths: tuple, square: bool, formats: tuple) -> dict:
+    """Decodes an image once and encodes it at every requested width and format.
+
+    Runs inside a worker process, so it only depends on Pillow and its arguments.
+    EXIF metadata is applied (orientation) and then dropped from every variant.
+
+    Args:
+        data: The raw bytes of the uploaded image.
+        widths: Target widths in pixels; widths larger than the source are skipped.
+        square: Whether to center-crop the image to a square first.
+        formats: Pillow format names to encode, e.g. ('avif', 'webp', 'jpeg').
+
+    Returns:
+        A dict with the 64-bit ``perceptual_hash`` and 256-bit
+        ``perceptual_detail`` of the source, its ``source_width`` and
+        ``source_height``, the processed ``width`` and ``height`` and a list of
+        ``variants``, each holding ``format``, ``width``, ``height`` and encoded
+        ``content``.
+    """
+    from PIL import Image, ImageOps, features
+
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        icc_profile = source.info.get('icc_profile')
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    likeness = {'perceptual_hash': perceptual_hash(image), 'perceptual_detail': perceptual_hash(image, 16),
+                'source_width': image.width, 'source_height': image.height}
+    if square:
+        side = min(image.size)
+        image = ImageOps.fit(image, (side, side))
+
+    source_width, source_height = image.size
+    fitting = [width for width in sorted(set(widths)) if width <= source_width] or [source_width]
+    encodable = [fmt for fmt in formats if fmt == 'jpeg' or features.check(fmt)]
+
+    variants = []
+    for width in fitting:
+        height = max(1, round(source_height * width / source_width))
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        resized.info = {}
+        for fmt in encodable:
+            frame = resized
+            if fmt == 'jpeg' and frame.mode == 'RGBA':
+                frame = Image.new('RGB', frame.size, (255, 255, 255))
+                frame.paste(resized, mask=resized.getchannel('A'))
+            buffer = io.BytesIO()
+            options = {'quality': 80}
+            if icc_profile:
+                options['icc_profile'] = icc_profile
+            if fmt == 'jpeg':
+                options.update(optimize=True, progressive=True)
+            frame.save(buffer, format=fmt.upper(), **options)
+            variants.append({'format': fmt, 'width': width, 'height': height, 'content': buffer.getvalue()})
+    return {**likeness, 'width': source_width, 'height': source_height, 'variants': variants}
+
+
+def perceptual_hash(image, size: int = 8) -> str:
+    """Returns a difference hash of ``size`` squared bits that survives re-encoding and resizing."""
+    from PIL import Image
+
+    small = image.convert('L').resize((size + 1, size), Image.Resampling.LANCZOS)
+    pixels = small.load()
+    bits = 0
+    for y in range(size):
+        for x in range(size):
+            bits = (bits << 1) | (pixels[x, y] > pixels[x + 1, y])
+    return f'{bits:0{size * size // 4}x}'
+
+
+def get_executor():
+    """Returns the per-process pool used to render variants, creating it on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def submit_variants(data: bytes, kind: str) -> Future:
+    """Schedules variant rendering for uploaded bytes without blocking the caller.
+
+    Args:
+        data: The raw bytes of the uploaded file.
+        kind: The image model name, a key of ``VARIANT_SPECS``.
+    """
+    spec = VARIANT_SPECS[kind]
+    formats = tuple(settings.IMAGE_VARIANT_FORMATS) if settings.IMAGE_VARIANTS_ENABLED else ()
+    args = (data, spec['widths'], spec['square'], formats)
+    if settings.IMAGE_VARIANT_WORKERS:
+        return get_executor().submit(render_variants, *args)
+    future = Future()
+    try:
+        future.set_result(render_variants(*args))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+def collect_variants(future: Future | None) -> dict | None:
+    """Waits for rendered variants, returning None if the file is not a decodable image."""
+    if future is None:
+        return None
+    try:
+        return future.result()
+    except Exception:
+        return None
+
+
+def save_variants(rendered: dict, digest: str, kind: str) -> dict:
+    """Writes rendered variants to the default storage.
+
+    Args:
+        rendered: The result of ``render_variants``.
+        digest: The SHA-256 of the source bytes, used as the storage prefix.
+        kind: The image model name.
+
+    Returns:
+        The processed ``width`` and ``height`` and the stored ``variants``
+        without their encoded content.
+    """
+    variants = []
+    for variant in rendered['variants']:
+        name = f"variants/{kind}/{digest[:32]}/{variant['width']}.{variant['format']}"
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(variant['content']))
+        variants.append({
+            'format': variant['format'],
+            'width': variant['width'],
+            'height': variant['height'],
+            'name': name,
+        })
+    return {'width': rendered['width'], 'height': rendered['height'], 'variants': variants}
@@ -1,3 +1,32 @@
-from django.shortcuts import render
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.http import Http404, JsonResponse
 
-# Create your views here.
+from photos.models import StartedUpload
+from photos.uploads import LocalDirectUpload, direct_upload_backend
+
+
+@login_required
+def start_upload(request):
+    """Returns the signed upload URL, fields and chunk size for one direct image upload."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    upload = direct_upload_backend().start(request.user)
+    StartedUpload.objects.create(user=request.user, public_id=upload['public_id'])
+    return JsonResponse(upload)
+
+
+@login_required
+def upload_chunk(request):
+    """Receives one chunk of a direct upload when the local stand-in backend is configured."""
+    backend = direct_upload_backend()
+    if not isinstance(backend, LocalDirectUpload):
+        raise Http404
+    if request.method != 'POST' or 'file' not in request.FILES:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    try:
+        done = backend.receive_chunk(request.user, request.POST.get('token', ''), request.FILES['file'].read(),
+                                     request.headers.get('Content-Range'))
+    except ValidationError as error:
+        return JsonResponse({'error': error.messages[0]}, status=400)
+    return JsonResponse({'done': done})
@@ -1,3 +1,43 @@
 from django.contrib import admin
 
-# Register your models here.
+from DjangoGramm.admin import LargeTableAdmin, ShardedModelAdmin
+from DjangoGramm.sharding import group_by_shard
+from posts.models import Like, Post, Tag
+from posts.utils import delete_posts
+
+
+@admin.register(Post)
+class PostAdmin(ShardedModelAdmin):
+    # A user's posts are listed by following ?user=<id>, which reads the foreign key's index.
+    list_display = ('id', 'user', 'created_at')
+    list_select_related = ('user',)
+    sortable_by = ('id',)
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('tags',)
+
+    def delete_model(self, request, obj):
+        delete_posts(Post.objects.using(obj._state.db).filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        # The changelist reads one shard, so the selected posts are looked up again on the shard of each.
+        for alias, post_ids in group_by_shard(queryset.values_list('pk', flat=True)).items():
+            delete_posts(Post.objects.using(alias).filter(pk__in=post_ids))
+
+
+@admin.register(Like)
+class LikeAdmin(ShardedModelAdmin):
+    list_display = ('id', 'user', 'post_id')
+    list_select_related = ('user',)
+    sortable_by = ('id',)
+    raw_id_fields = ('user', 'post')
+
+
+@admin.register(Tag)
+class TagAdmin(LargeTableAdmin):
+    list_display = ('name',)
+    sortable_by = ('name',)
+    # Case-sensitive prefix matches can use the index on the unique name; tags are stored lower case.
+    search_fields = ('name__startswith',)
+
+    def get_search_results(self, request, queryset, search_term):
+        return super().get_search_results(request, queryset, search_term.lstrip('#').lower())
@@ -0,0 +1,168 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.db import NotSupportedError, connection, transaction
+from django.db.models import Count, QuerySet
+from django.utils import timezone
+
+from DjangoGramm.sharding import shard_aliases
+from photos.models import ImageBlob, PostImage
+from posts.models import ArchivedLike, ArchivedPost, Like, Post
+from posts.utils import delete_posts
+
+User = get_user_model()
+
+# Archive tables and the column each one is range-partitioned by on PostgreSQL.
+PARTITIONED_MODELS = [(ArchivedPost, 'created_at'), (ArchivedLike, 'post_created_at')]
+
+
+def archive_posts(older_than: timedelta, batch_size: int = 500) -> int:
+    """Moves one batch of old posts and their likes into the archive tables.
+
+    Tags and images are stored inline on the archived post, so archived posts
+    need no joins to render. Image blob references move with the images; the
+    blobs stay alive until the archived post is deleted.
+
+    With sharding, each shard moves a batch of its own posts in turn.
+
+    Args:
+        older_than: Posts created before now minus this age are archived.
+        batch_size: Maximum number of posts to move in one transaction.
+
+    Returns:
+        The number of archived posts.
+    """
+    cutoff = timezone.now() - older_than
+    return sum(archive_shard_posts(alias, cutoff, batch_size) for alias in shard_aliases())
+
+
+def archive_shard_posts(alias: str | None, cutoff: datetime, batch_size: int) -> int:
+    with transaction.atomic(), transaction.atomic(using=alias):
+        posts = list(Post.objects.using(alias).filter(created_at__lt=cutoff)
+                     .annotate(likes_count=Count('likes'))
+                     .prefetch_related('tags', 'images')
+                     .order_by('created_at')[:batch_size])
+        if not posts:
+            return 0
+        ensure_partitions({post.created_at.year for post in posts})
+        ArchivedPost.objects.bulk_create(ArchivedPost(
+            post_id=post.pk,
+            user_id=post.user_id,
+            text=post.text,
+            created_at=post.created_at,
+            tags=[tag.name for tag in post.tags.all()],
+            images=[image.snapshot() for image in post.images.all()],
+            likes_count=post.likes_count,
+        ) for post in posts)
+
+        created_at = {post.pk: post.created_at for post in posts}
+        likes = Like.objects.using(alias).filter(post__in=created_at).values_list('post_id', 'user_id')
+        ArchivedLike.objects.bulk_create(
+            (ArchivedLike(post_created_at=created_at[post_id], post_id=post_id, user_id=user_id)
+             for post_id, user_id in likes.iterator(chunk_size=2000)),
+            batch_size=2000,
+        )
+
+        # The archived posts now own the blob references, so the images are
+        # removed without the post_delete signal that would release them.
+        images = PostImage.objects.filter(post__in=created_at)
+        images._raw_delete(images.db)
+        delete_posts(Post.objects.using(alias).filter(pk__in=created_at))
+    return len(posts)
+
+
+def delete_archived_posts(archived_posts: QuerySet) -> None:
+    """Deletes archived posts with their likes and releases their image blobs."""
+    with transaction.atomic():
+        keys = list(archived_posts.values_list('created_at', 'post_id', 'images'))
+        ImageBlob.objects.release_many(Counter(
+            image['blob'] for _, _, images in keys for image in images if image['blob']
+        ))
+        # The creation times only let PostgreSQL prune partitions; post ids are unique on their own.
+        ArchivedLike.objects.filter(post_created_at__in={created_at for created_at, _, _ in keys},
+                                    post_id__in=[post_id for _, post_id, _ in keys]).delete()
+        archived_posts.delete()
+
+
+def ensure_partitions(years: set[int]) -> None:
+    """Creates the yearly partitions of the archive tables, if they are partitioned."""
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for model, _ in PARTITIONED_MODELS:
+            if not is_partitioned(cursor, model._meta.db_table):
+                continue
+            for year in sorted(years):
+                cursor.execute(partition_sql(model._meta.db_table, year))
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [table])
+    return cursor.fetchone() is not None
+
+
+def partition_sql(table: str, year: int) -> str:
+    start = datetime(year, 1, 1, tzinfo=dt_timezone.utc)
+    end = datetime(year + 1, 1, 1, tzinfo=dt_timezone.utc)
+    quote = connection.ops.quote_name
+    return (f"CREATE TABLE IF NOT EXISTS {quote(f'{table}_{year}')} PARTITION OF {quote(table)} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+
+
+def convert_to_partitioned_sql(model, column: str, years: list[int]) -> list[str]:
+    """Returns the statements that turn an archive table into a range-partitioned one.
+
+    The rows are copied into a new partitioned table with yearly partitions,
+    which keeps the primary key and indexes; the foreign key to the user table
+    is added again because ``LIKE`` does not copy it.
+
+    Args:
+        model: ArchivedPost or ArchivedLike.
+        column: The partition key, the first column of the model's primary key.
+        years: The years to create partitions for.
+    """
+    table = model._meta.db_table
+    quote = connection.ops.quote_name
+    old_table = f'{table}_unpartitioned'
+    user_table = User._meta.db_table
+    return [
+        f'ALTER TABLE {quote(table)} RENAME TO {quote(old_table)}',
+        f'CREATE TABLE {quote(table)} (LIKE {quote(old_table)} INCLUDING ALL) PARTITION BY RANGE ({quote(column)})',
+        *(partition_sql(table, year) for year in years),
+        f'INSERT INTO {quote(table)} SELECT * FROM {quote(old_table)}',
+        f'DROP TABLE {quote(old_table)}',
+        f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(f"{table}_user_id_fk")} FOREIGN KEY ("user_id") '
+        f'REFERENCES {quote(user_table)} ("id") DEFERRABLE INITIALLY DEFERRED',
+    ]
+
+
+def partition_archive_tables(years_ahead: int = 1) -> list[str]:
+    """Converts the archive tables to range partitioning by creation time on PostgreSQL.
+
+    Tables that are already partitioned only get any missing yearly
+    partitions, so this can run on every deploy.
+
+    Returns:
+        The names of the tables that were converted.
+    """
+    if connection.vendor != 'postgresql':
+        raise NotSupportedError('Range partitioning of the archive tables requires PostgreSQL.')
+    converted = []
+    current_year = timezone.now().year
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model, column in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            cursor.execute(f'SELECT MIN({column}), MAX({column}) FROM {connection.ops.quote_name(table)}')
+            oldest, newest = cursor.fetchone()
+            first_year = min(oldest.year if oldest else current_year, current_year)
+            last_year = max(newest.year if newest else current_year, current_year + years_ahead)
+            years = list(range(first_year, last_year + 1))
+            if is_partitioned(cursor, table):
+                statements = [partition_sql(table, year) for year in years]
+            else:
+                statements = convert_to_partitioned_sql(model, column, years)
+                converted.append(table)
+            for statement in statements:
+                cursor.execute(statement)
+    return converted
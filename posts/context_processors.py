@@ -0,0 +1,7 @@
+from django.conf import settings
+from django.urls import reverse
+
+
+def live_counts(request) -> dict:
+    """Exposes the live count stream to templates as ``live_counts_url``, while ``LIVE_COUNTS_ENABLED`` is set."""
+    return {'live_counts_url': reverse('live_counts') if settings.LIVE_COUNTS_ENABLED else None}
@@ -1,4 +1,5 @@
 from django import forms
+from django.urls import reverse_lazy
 from posts.models import Post
 
 
@@ -17,7 +18,9 @@ class PostForm(forms.ModelForm):
         help_text='Enter tags separated by commas: travel, summer, beach',
         widget=forms.TextInput(attrs={
             'placeholder': 'travel, summer',
-            'class': 'form-control'
+            'class': 'form-control',
+            'autocomplete': 'off',
+            'data-tag-autocomplete': reverse_lazy('tag_autocomplete'),
         }),
     )
 
@@ -32,6 +35,8 @@ class AddTagsForm(forms.Form):
         label='Add Tags',
         widget=forms.TextInput(attrs={
             'placeholder': 'New tags, comma separated',
-            'class': 'form-control'
+            'class': 'form-control',
+            'autocomplete': 'off',
+            'data-tag-autocomplete': reverse_lazy('tag_autocomplete'),
         }),
     )
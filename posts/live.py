@@ -0,0 +1,177 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils.module_loading import import_string
+
+from posts.models import LiveCountEvent
+
+# Channel prefixes and the key each one's changes are sent under.
+CHANNEL_KINDS = {'post': 'posts', 'user': 'users'}
+
+
+class Subscription:
+    """The count changes of the channels one client watches, coalesced until the client takes them.
+
+    Changes may be pushed from any thread; they are summed per channel, and
+    the latest absolute count is kept so a client that missed a change, or
+    already applied its own click, still ends up with the right number.
+    """
+
+    def __init__(self, channels, loop: asyncio.AbstractEventLoop):
+        self.channels = frozenset(channels)
+        self._loop = loop
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+
+    def push(self, channel: str, delta: int, count: int) -> None:
+        with self._lock:
+            total = self._pending.get(channel, (0, count))[0]
+            self._pending[channel] = (total + delta, count)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The client's event loop is closed; it is unsubscribed as its stream ends.
+            pass
+
+    async def wait(self, timeout: float) -> bool:
+        """Waits up to ``timeout`` seconds for a change, returning whether one arrived."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def drain(self) -> dict:
+        """Takes the pending changes as ``{'posts': {id: {'delta', 'count'}}, 'users': {...}}``."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._ready.clear()
+        changes = {}
+        for channel, (delta, count) in pending.items():
+            kind, _, pk = channel.partition(':')
+            changes.setdefault(CHANNEL_KINDS[kind], {})[pk] = {'delta': delta, 'count': count}
+        return changes
+
+
+class InProcessBroker:
+    """Delivers count changes to the subscriptions of this process only.
+
+    A stand-in for tests and single-process development; with several
+    workers, use ``DatabaseBroker`` so changes made in one reach the
+    clients of all.
+    """
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels) -> Subscription:
+        subscription = Subscription(channels, asyncio.get_running_loop())
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscriptions)
+
+    def publish(self, channel: str, delta: int, count: int) -> None:
+        self.deliver(channel, delta, count)
+
+    def deliver(self, channel: str, delta: int, count: int) -> None:
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.push(channel, delta, count)
+
+
+class DatabaseBroker(InProcessBroker):
+    """Shares count changes between workers through the ``LiveCountEvent`` table.
+
+    Publishing appends a row. While a worker has subscribers, one task on its
+    event loop reads the rows added since its last look every
+    ``LIVE_COUNTS_INTERVAL_SECONDS`` and delivers them locally. A row committed
+    out of id order can be missed; the next change of the same count carries
+    the absolute value again. ``manage.py prune_live_events`` trims the table.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._last_id = None
+        self._poller = None
+
+    def subscribe(self, channels) -> Subscription:
+        subscription = super().subscribe(channels)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.get_running_loop().create_task(self.poll_forever())
+        return subscription
+
+    def publish(self, channel: str, delta: int, count: int) -> None:
+        LiveCountEvent.objects.create(channel=channel, delta=delta, count=count)
+
+    async def poll_forever(self) -> None:
+        while self.has_subscribers():
+            await sync_to_async(self.poll)()
+            await asyncio.sleep(settings.LIVE_COUNTS_INTERVAL_SECONDS)
+        self._last_id = None
+
+    def poll(self) -> None:
+        """Delivers the events added since the previous poll; the first poll only notes where the table ends."""
+        if self._last_id is None:
+            self._last_id = LiveCountEvent.objects.aggregate(last=Max('id'))['last'] or 0
+            return
+        events = (LiveCountEvent.objects.filter(id__gt=self._last_id).order_by('id')
+                  .values_list('id', 'channel', 'delta', 'count'))
+        for self._last_id, channel, delta, count in events:
+            self.deliver(channel, delta, count)
+
+
+_brokers = {}
+
+
+def live_broker() -> InProcessBroker:
+    """Returns this process's instance of the ``LIVE_COUNTS_BROKER`` class."""
+    path = settings.LIVE_COUNTS_BROKER
+    if path not in _brokers:
+        _brokers[path] = import_string(path)()
+    return _brokers[path]
+
+
+def publish_count(kind: str, pk: int, delta: int, count: int) -> None:
+    """Announces a changed like or follower count to live clients once the current transaction commits.
+
+    Args:
+        kind: 'post' for a post's like count, 'user' for a user's follower count.
+        pk: The id of the post or user.
+        delta: How much the count changed.
+        count: The count after the change.
+    """
+    if not settings.LIVE_COUNTS_ENABLED:
+        return
+    channel = f'{kind}:{pk}'
+    transaction.on_commit(lambda: live_broker().publish(channel, delta, count))
+
+
+def parse_channels(request) -> list[str]:
+    """Returns the channels named by the ``posts`` and ``users`` id lists of a request, up to the limit."""
+    channels = []
+    for kind, key in CHANNEL_KINDS.items():
+        for pk in request.GET.get(key, '').split(','):
+            if pk.strip().isdigit():
+                channels.append(f'{kind}:{int(pk)}')
+    return channels[:settings.LIVE_COUNTS_MAX_CHANNELS]
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.archive import archive_posts
+
+
+class Command(BaseCommand):
+    help = 'Moves old posts with their likes, tags and images into the archive tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, metavar='DAYS', default=settings.POST_ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        archived = 0
+        while count := archive_posts(timedelta(days=options['older_than']), options['batch_size']):
+            archived += count
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} posts.'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.utils import flush_pending_likes
+
+
+class Command(BaseCommand):
+    help = 'Applies like toggles buffered in write-behind mode to posts_like in coalesced batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help='Keep running, polling the buffer at this interval once it is empty.')
+
+    def handle(self, *args, **options):
+        applied = 0
+        while True:
+            count = flush_pending_likes(options['batch_size'])
+            applied += count
+            if count:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
+        self.stdout.write(self.style.SUCCESS(f'Applied {applied} buffered like toggles.'))
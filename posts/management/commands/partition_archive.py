@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError
+
+from posts.archive import partition_archive_tables
+
+
+class Command(BaseCommand):
+    help = 'Range-partitions the archive tables by year on PostgreSQL and creates missing partitions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years-ahead', type=int, default=1,
+                            help='Number of future years to create partitions for.')
+
+    def handle(self, *args, **options):
+        try:
+            converted = partition_archive_tables(options['years_ahead'])
+        except NotSupportedError as exc:
+            raise CommandError(exc)
+        for table in converted:
+            self.stdout.write(f'Partitioned {table}.')
+        self.stdout.write(self.style.SUCCESS('Archive partitions are up to date.'))
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.models import LiveCountEvent
+
+
+class Command(BaseCommand):
+    help = 'Deletes live count events older than LIVE_EVENT_RETENTION_MINUTES.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=settings.LIVE_EVENT_RETENTION_MINUTES)
+        deleted, _ = LiveCountEvent.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} live count events.'))
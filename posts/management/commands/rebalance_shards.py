@@ -0,0 +1,114 @@
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from DjangoGramm.sharding import bucket_map, bucket_rows
+from posts.models import Like, Post, ShardBucket
+from users.models import Followers
+
+# Copied in this order and deleted in reverse, so a like never outlives its post on either shard. Post
+# ids are global and kept; likes and follows get new ids from the target's own sequence.
+MOVED_MODELS = [(Post, True), (Like, False), (Followers, False)]
+
+
+def plan_moves(placement: dict[int, str], shards: list[str]) -> list[tuple[int, str, str]]:
+    """Returns the (bucket, source, target) moves that spread the buckets evenly over ``shards``.
+
+    As few buckets as possible move: shards already holding the most keep
+    the extra bucket when the count does not divide evenly, and databases no
+    longer listed in ``shards`` give up all of theirs.
+    """
+    held = {alias: [] for alias in shards}
+    for bucket, alias in sorted(placement.items()):
+        held.setdefault(alias, []).append(bucket)
+    base, extra = divmod(len(placement), len(shards))
+    largest_first = sorted(shards, key=lambda alias: len(held[alias]), reverse=True)
+    quota = {alias: base + (index < extra) for index, alias in enumerate(largest_first)}
+
+    spare = []
+    for alias, buckets in held.items():
+        excess = len(buckets) - quota.get(alias, 0)
+        if excess > 0:
+            spare.extend((bucket, alias) for bucket in buckets[-excess:])
+    moves = []
+    for alias in shards:
+        for _ in range(quota[alias] - len(held[alias])):
+            bucket, source = spare.pop()
+            moves.append((bucket, source, alias))
+    return moves
+
+
+def copy_bucket(bucket: int, source: str, target: str, batch_size: int) -> int:
+    """Copies the rows of a bucket to another shard, skipping rows already there; returns how many were read."""
+    copied = 0
+    for model, keep_pk in MOVED_MODELS:
+        fields = [field for field in model._meta.concrete_fields if keep_pk or not field.primary_key]
+        size = min(batch_size, connections[target].ops.bulk_batch_size(fields, [None] * batch_size))
+        rows = bucket_rows(model.objects.using(source), bucket).order_by('pk').iterator(chunk_size=size)
+        while batch := list(islice(rows, size)):
+            # raw=True keeps the rows' creation times instead of stamping auto_now_add fields anew.
+            model._base_manager._insert(batch, fields=fields, using=target, raw=True, on_conflict=OnConflict.IGNORE)
+            copied += len(batch)
+    return copied
+
+
+def delete_bucket(bucket: int, alias: str) -> None:
+    for model, _ in reversed(MOVED_MODELS):
+        bucket_rows(model.objects.using(alias), bucket)._raw_delete(alias)
+
+
+class Command(BaseCommand):
+    help = ('Moves buckets of posts, likes and follows between shards until DATABASE_SHARDS hold equal shares. '
+            'Rows are copied, the bucket map is switched, and once every worker had time to load it the rows '
+            'written to the old shard meanwhile are copied again before it is cleared. Likes, follows and posts '
+            'removed from a moving bucket during that wait come back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only print the planned moves.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows copied per INSERT.')
+        parser.add_argument('--wait', type=float, metavar='SECONDS',
+                            help='Time for workers to load the new map; SHARD_MAP_REFRESH_SECONDS by default.')
+
+    def handle(self, *args, **options):
+        shards = settings.DATABASE_SHARDS
+        if not shards:
+            raise CommandError('DATABASE_SHARDS is empty, so nothing is sharded.')
+        bucket_map.clear()
+        placement = bucket_map.placement()
+        moves = plan_moves(placement, shards)
+
+        after = dict(placement)
+        for bucket, _, target in moves:
+            after[bucket] = target
+        self.stdout.write(f"{'shard':<16}{'buckets':>9}{'after':>9}")
+        for alias in dict.fromkeys([*shards, *placement.values()]):
+            before = sum(1 for held in placement.values() if held == alias)
+            self.stdout.write(f"{alias:<16}{before:>9}{sum(1 for held in after.values() if held == alias):>9}")
+        if options['dry_run']:
+            return
+
+        # Recording every bucket's shard first means later changes to DATABASE_SHARDS move nothing by themselves.
+        ShardBucket.objects.using('default').bulk_create(
+            [ShardBucket(bucket=bucket, alias=alias) for bucket, alias in placement.items()], ignore_conflicts=True)
+        if not moves:
+            self.stdout.write(self.style.SUCCESS('Buckets recorded; none need to move.'))
+            return
+
+        copied = sum(copy_bucket(bucket, source, target, options['batch_size']) for bucket, source, target in moves)
+        with transaction.atomic(using='default'):
+            for bucket, _, target in moves:
+                ShardBucket.objects.using('default').filter(bucket=bucket).update(alias=target, moved_at=timezone.now())
+        wait = settings.SHARD_MAP_REFRESH_SECONDS if options['wait'] is None else options['wait']
+        self.stdout.write(f'Copied {copied} rows; waiting {wait:g}s for workers to load the new bucket map.')
+        time.sleep(wait)
+
+        for bucket, source, target in moves:
+            copy_bucket(bucket, source, target, options['batch_size'])
+            delete_bucket(bucket, source)
+        bucket_map.clear()
+        self.stdout.write(self.style.SUCCESS(f'Moved {len(moves)} buckets.'))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from DjangoGramm.sharding import across_shards
+from posts.models import PendingAuthorRefresh, Post
+from posts.utils import refresh_author_snapshots
+
+
+class Command(BaseCommand):
+    help = "Rewrites the author username and avatar stored on posts after users change them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help='Keep running, polling the queue at this interval once it is empty.')
+        parser.add_argument('--all', action='store_true',
+                            help='Queue every user with posts first.')
+        parser.add_argument('--missing', action='store_true',
+                            help='Queue the users with posts that have no snapshot yet first, to fill them in.')
+
+    def handle(self, *args, **options):
+        if options['all'] or options['missing']:
+            posts = Post.objects.all() if options['all'] else Post.objects.filter(author_username='')
+            author_ids = set().union(*across_shards(posts, None).gather(
+                lambda posts: set(posts.values_list('user_id', flat=True).distinct())))
+            PendingAuthorRefresh.objects.bulk_create(
+                (PendingAuthorRefresh(user_id=user_id) for user_id in author_ids),
+                ignore_conflicts=True,
+            )
+        refreshed = 0
+        while True:
+            count = refresh_author_snapshots(options['batch_size'])
+            refreshed += count
+            if count:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed the posts of {refreshed} users.'))
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Case, Max, Value, When
+
+from DjangoGramm.sharding import sharded_id
+from photos.models import PostImage
+from posts.models import ArchivedPost, Like, LikeCount, PendingLike, Post, PostNumber, ShardBucket
+
+# Every column holding a post id; the posts themselves are renumbered last.
+POST_ID_COLUMNS = [(Like, 'post_id'), (PendingLike, 'post_id'), (LikeCount, 'post_id'),
+                   (Post.tags.through, 'post_id'), (PostImage, 'post_id'), (Post, 'id')]
+
+
+def renumber(mapping: dict[int, int]) -> None:
+    """Rewrites one batch of old post ids to new ones in every column holding a post id."""
+    for model, column in POST_ID_COLUMNS:
+        new_ids = Case(*(When(**{column: old}, then=Value(new)) for old, new in mapping.items()))
+        model.objects.using('default').filter(**{f'{column}__in': list(mapping)}).update(**{column: new_ids})
+
+
+def renumber_posts(batch_size: int) -> int:
+    """Gives every post on the default database an id built from a ``PostNumber`` in its author's bucket.
+
+    Numbers start above every existing id divided by ``SHARD_BUCKETS``, so
+    each new id is larger than any old one and never collides with a post
+    that still waits for its turn, or with an archived post.
+
+    Returns:
+        The number of renumbered posts.
+    """
+    top = max(Post.objects.aggregate(top=Max('pk'))['top'] or 0,
+              ArchivedPost.objects.aggregate(top=Max('post_id'))['top'] or 0)
+    number = top // settings.SHARD_BUCKETS + 1
+    renumbered, last = 0, 0
+    while batch := list(Post.objects.using('default').filter(pk__gt=last, pk__lte=top).order_by('pk')
+                        .values_list('pk', 'user_id')[:batch_size]):
+        renumber({pk: sharded_id(number + index, user_id) for index, (pk, user_id) in enumerate(batch)})
+        number += len(batch)
+        renumbered += len(batch)
+        last = batch[-1][0]
+    if not renumbered:
+        return 0
+    # The last number used is recorded and the sequence moved past it, so new posts continue from there.
+    PostNumber.objects.using('default').create(pk=number - 1)
+    connection = connections['default']
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [PostNumber]):
+            cursor.execute(sql)
+    return renumbered
+
+
+class Command(BaseCommand):
+    help = ('Prepares posts created before sharding for DATABASE_SHARDS. Every post gets an id in its '
+            "author's bucket, with its likes, tags and images following, and every bucket is recorded on "
+            'the default database, where all rows still are. Run it once, with writes stopped and '
+            'DATABASE_SHARDS still empty; then set DATABASE_SHARDS and run rebalance_shards to spread the '
+            'buckets. Bloom filters of seen posts and live count events keep the old ids.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Posts renumbered per UPDATE.')
+
+    def handle(self, *args, **options):
+        if settings.DATABASE_SHARDS:
+            raise CommandError('Run this before setting DATABASE_SHARDS.')
+        if PostNumber.objects.exists():
+            raise CommandError('Posts are numbered for sharding already.')
+        with transaction.atomic():
+            renumbered = renumber_posts(options['batch_size'])
+            ShardBucket.objects.bulk_create([ShardBucket(bucket=bucket, alias='default')
+                                             for bucket in range(settings.SHARD_BUCKETS)], ignore_conflicts=True)
+        self.stdout.write(self.style.SUCCESS(f'Renumbered {renumbered} posts; every bucket is on default.'))
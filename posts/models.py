@@ -1,28 +1,115 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+from DjangoGramm.sharding import ShardKeyQuerySet, sharded_id
+
 User = get_user_model()
 
 
+class PostQuerySet(ShardKeyQuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        if settings.DATABASE_SHARDS:
+            assign_post_ids(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+# Posts and likes may live on another shard than the users and tags they point to (see
+# DjangoGramm.sharding), so those foreign keys have no database constraint.
 class Post(models.Model):
-    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="posts")
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="posts", db_constraint=False)
     text = models.TextField()
-    tags = models.ManyToManyField('Tag', blank=True, related_name='posts')
+    tags = models.ManyToManyField('Tag', blank=True, related_name='posts', db_constraint=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Snapshot of the author for post cards, refreshed by `manage.py refresh_author_snapshots`.
+    author_username = models.CharField(max_length=150, blank=True)
+    author_avatar = models.JSONField(null=True, blank=True)
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         return f"Post by {self.user.username} on {self.created_at}"
 
+    def save(self, *args, **kwargs):
+        if not self.author_username:
+            for field, value in self.author_snapshot(self.user).items():
+                setattr(self, field, value)
+        if self.pk is None and settings.DATABASE_SHARDS:
+            assign_post_ids([self])
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def author_snapshot(user) -> dict:
+        """Returns the author fields of a post card for the given user."""
+        avatar = getattr(getattr(user, 'profile', None), 'avatar', None)
+        return {
+            'author_username': user.username,
+            'author_avatar': avatar.snapshot() if avatar and avatar.file else None,
+        }
+
+    def author_avatar_image(self):
+        """Returns an unsaved AvatarImage that renders the author's avatar, if they have one."""
+        from photos.models import AvatarImage
+
+        return AvatarImage.from_snapshot(self.author_avatar) if self.author_avatar else None
+
 
 class Like(models.Model):
-    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="likes")
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="likes", db_constraint=False)
     post = models.ForeignKey(to=Post, on_delete=models.CASCADE, related_name="likes")
 
+    objects = ShardKeyQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'post')
 
     def __str__(self):
-        return f"{self.user.username} liked Post {self.post.id}"
+        return f"{self.user.username} liked Post {self.post_id}"
+
+
+class PendingLike(models.Model):
+    """A like toggle buffered in write-behind mode until ``manage.py flush_likes`` applies it.
+
+    ``delta`` is +1 for a like and -1 for an unlike. A user's toggles of a
+    post are numbered by ``sequence``, which is unique among the buffered
+    ones, so two concurrent toggles cannot both flip the same state.
+    """
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="+")
+    post = models.ForeignKey(to=Post, on_delete=models.CASCADE, related_name="pending_likes", db_constraint=False)
+    delta = models.SmallIntegerField()
+    sequence = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'post', 'sequence')
+
+    def __str__(self):
+        return f"{self.user_id} {'liked' if self.delta > 0 else 'unliked'} Post {self.post_id}"
+
+
+class LikeCount(models.Model):
+    """A post's like count as of the last flush of its buffered toggles, written only by ``flush_pending_likes``."""
+    post = models.OneToOneField(to=Post, on_delete=models.CASCADE, primary_key=True, related_name="+",
+                                db_constraint=False)
+    count = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"Post {self.post_id}: {self.count} likes"
+
+
+class PendingAuthorRefresh(models.Model):
+    """A user whose username or avatar changed and whose posts' author snapshots are stale.
+
+    ``replaced_blobs`` are the blobs of avatars the user replaced, which the
+    stale snapshots still show; they are released once the posts are rewritten.
+    """
+    user = models.OneToOneField(to=User, on_delete=models.CASCADE, related_name="+")
+    requested_at = models.DateTimeField(default=timezone.now)
+    replaced_blobs = models.JSONField(default=list, blank=True)
 
 
 class Tag(models.Model):
@@ -30,3 +117,109 @@ class Tag(models.Model):
 
     def __str__(self):
         return f"#{self.name}"
+
+
+class ArchivedPost(models.Model):
+    """A post moved out of the hot tables by ``manage.py archive_posts``.
+
+    Tags, images and the like count are stored inline, and the primary key
+    starts with ``created_at`` so the table can be range-partitioned by it.
+    The images keep their blob references, which are released when the
+    archived post is deleted.
+    """
+    pk = models.CompositePrimaryKey('created_at', 'post_id')
+    post_id = models.BigIntegerField()
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="archived_posts")
+    text = models.TextField()
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    tags = models.JSONField(default=list, blank=True)
+    images = models.JSONField(default=list, blank=True)
+    likes_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-created_at'])]
+
+    def __str__(self):
+        return f"Archived post by {self.user_id} on {self.created_at}"
+
+    def image_list(self) -> list:
+        """Returns unsaved PostImage instances that render the archived images."""
+        from photos.models import PostImage
+
+        return [PostImage.from_snapshot(image) for image in self.images]
+
+
+class ArchivedLike(models.Model):
+    """A like of an archived post, keyed by the post's creation time for partitioning."""
+    pk = models.CompositePrimaryKey('post_created_at', 'post_id', 'user_id')
+    post_created_at = models.DateTimeField()
+    post_id = models.BigIntegerField()
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="archived_likes")
+
+
+class SeenPostsFilter(models.Model):
+    """The Bloom filters of the posts a user has been shown, persisted from the cache (see ``posts.seen``)."""
+    user = models.OneToOneField(to=User, on_delete=models.CASCADE, related_name="+")
+    current = models.BinaryField()
+    current_count = models.PositiveIntegerField(default=0)
+    previous = models.BinaryField(blank=True, default=b'')
+    hashes = models.PositiveSmallIntegerField()
+    generation = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class LiveCountEvent(models.Model):
+    """A like or follower count change, read by every worker's live count broker (see ``posts.live``)."""
+    channel = models.CharField(max_length=32)
+    delta = models.IntegerField()
+    count = models.IntegerField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.channel} {self.delta:+d} = {self.count}"
+
+
+class PostNumber(models.Model):
+    """Hands out the numbers that post ids are built from while posts are sharded (see ``assign_post_ids``)."""
+
+
+class ShardBucket(models.Model):
+    """The shard holding one bucket of posts, likes and follows, when recorded (see ``DjangoGramm.sharding``)."""
+    bucket = models.PositiveIntegerField(primary_key=True)
+    alias = models.CharField(max_length=64)
+    moved_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Bucket {self.bucket} on {self.alias}"
+
+
+def assign_post_ids(posts) -> None:
+    """Gives new posts ids that fall in their author's bucket, so a post id alone names the post's shard.
+
+    The ids are numbered from ``PostNumber`` on the default database, since
+    each shard's own sequence would hand out ids already used on another.
+    """
+    new = [post for post in posts if post.pk is None]
+    numbers = PostNumber.objects.using('default').bulk_create([PostNumber() for _ in new])
+    for post, number in zip(new, numbers):
+        post.pk = sharded_id(number.pk, post.user_id)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def count_tag_links(sender, instance, action, reverse, pk_set, **kwargs):
+    """Updates this worker's tag autocomplete counts once added or removed tag links are committed.
+
+    ``pk_set`` only holds the links that actually changed. Cleared links are
+    left to the index's periodic rebuild.
+    """
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    from posts.tag_index import tag_index
+
+    delta = 1 if action == 'post_add' else -1
+    if reverse:
+        tag_ids, delta = [instance.pk], delta * len(pk_set)
+    else:
+        tag_ids = list(pk_set)
+    transaction.on_commit(lambda: tag_index.adjust(tag_ids, delta))
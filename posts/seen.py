@@ -0,0 +1,188 @@
+import hashlib
+import math
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from DjangoGramm.sharding import ShardedQuerySet
+from posts.models import SeenPostsFilter
+
+
+class BloomFilter:
+    """A fixed-size set of integers that may report false positives but never false negatives.
+
+    Each value sets ``hashes`` bits, picked by double hashing one BLAKE2b
+    digest of the value.
+    """
+
+    def __init__(self, bits: bytearray, hashes: int, count: int = 0):
+        self.bits = bits
+        self.size = len(bits) * 8
+        self.hashes = hashes
+        self.count = count
+
+    @classmethod
+    def empty(cls, size_bytes: int, false_positive_rate: float) -> 'BloomFilter':
+        """Returns an empty filter of ``size_bytes`` using the number of hashes that suits the rate."""
+        return cls(bytearray(size_bytes), max(1, round(-math.log2(false_positive_rate))))
+
+    @property
+    def capacity(self) -> int:
+        """Returns how many values fit before false positives exceed the rate the hash count was chosen for."""
+        return int(self.size * math.log(2) / self.hashes)
+
+    def positions(self, value: int) -> list[int]:
+        digest = hashlib.blake2b(value.to_bytes(8, 'little', signed=True), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(first + index * second) % size for index in range(self.hashes)]
+
+    def add(self, value: int) -> None:
+        bits = self.bits
+        for position in self.positions(value):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: int) -> bool:
+        bits = self.bits
+        for position in self.positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def union(self, other: 'BloomFilter') -> 'BloomFilter':
+        """Returns a filter of the values of both, counted from the share of bits that are set."""
+        merged = int.from_bytes(self.bits, 'little') | int.from_bytes(other.bits, 'little')
+        filled = merged.bit_count()
+        count = (round(-self.size / self.hashes * math.log(1 - filled / self.size))
+                 if filled < self.size else self.capacity)
+        return BloomFilter(bytearray(merged.to_bytes(len(self.bits), 'little')), self.hashes,
+                           max(count, self.count, other.count))
+
+
+class SeenPosts:
+    """The ids of the posts a user has been shown, in two generations of Bloom filters.
+
+    ``SEEN_POSTS_BYTES_PER_USER`` is split between the generations. When the
+    current one reaches the capacity that keeps it within
+    ``SEEN_POSTS_FALSE_POSITIVE_RATE``, it becomes the previous one and a new
+    one starts, so the oldest seen posts are forgotten instead of the rate
+    growing. The filters are kept in the ``SEEN_POSTS_CACHE`` and written to
+    ``SeenPostsFilter`` once ``SEEN_POSTS_PERSIST_EVERY`` posts were added, or
+    when the generations rotate. Writes are merged with the stored filters,
+    so workers that marked posts concurrently do not undo each other.
+    """
+
+    def __init__(self, user_id: int, current: BloomFilter, previous: BloomFilter | None, unsaved: int = 0,
+                 generation: int = 0):
+        self.user_id = user_id
+        self.current = current
+        self.previous = previous
+        self.unsaved = unsaved
+        self.generation = generation
+        self.rotated = False
+
+    @staticmethod
+    def cache_key(user_id: int) -> str:
+        return f'seen_posts:{user_id}'
+
+    @classmethod
+    def load(cls, user_id: int) -> 'SeenPosts':
+        """Returns the user's filters from the cache, the database, or new empty ones, in that order."""
+        state = caches[settings.SEEN_POSTS_CACHE].get(cls.cache_key(user_id))
+        if state is None:
+            stored = SeenPostsFilter.objects.filter(user_id=user_id).first()
+            if stored is not None:
+                state = (bytes(stored.current), stored.current_count, bytes(stored.previous) or None,
+                         stored.hashes, 0, stored.generation)
+        generation_bytes = settings.SEEN_POSTS_BYTES_PER_USER // 2
+        fresh = BloomFilter.empty(generation_bytes, settings.SEEN_POSTS_FALSE_POSITIVE_RATE)
+        if state is None or len(state[0]) != generation_bytes or state[3] != fresh.hashes:
+            # Nothing stored yet, or stored with a size or rate that is no longer configured.
+            return cls(user_id, fresh, None)
+        current, count, previous, hashes, unsaved, generation = state
+        return cls(user_id, BloomFilter(bytearray(current), hashes, count),
+                   previous and BloomFilter(bytearray(previous), hashes), unsaved, generation)
+
+    def __contains__(self, post_id: int) -> bool:
+        return post_id in self.current or (self.previous is not None and post_id in self.previous)
+
+    def unseen(self, post_ids) -> list[int]:
+        return [post_id for post_id in post_ids if post_id not in self]
+
+    def mark(self, post_ids) -> None:
+        for post_id in post_ids:
+            # Posts only in the previous generation are added again, so posts seen lately outlive a rotation.
+            if post_id in self.current:
+                continue
+            if self.current.count >= self.current.capacity:
+                self.previous = self.current
+                self.current = BloomFilter(bytearray(len(self.current.bits)), self.current.hashes)
+                self.generation += 1
+                self.rotated = True
+            self.current.add(post_id)
+            self.unsaved += 1
+
+    def merge(self, stored: SeenPostsFilter) -> None:
+        """Adds the posts of filters another worker saved, matching the generations by number.
+
+        Only the two newest generations of both are kept, so a rotation on
+        either side is carried over.
+        """
+        hashes = self.current.hashes
+        generations = {self.generation: self.current}
+        if self.previous is not None:
+            generations[self.generation - 1] = self.previous
+        for number, bits, count in ((stored.generation, stored.current, stored.current_count),
+                                    (stored.generation - 1, stored.previous, 0)):
+            if bits:
+                other = BloomFilter(bytearray(bits), hashes, count)
+                generations[number] = generations[number].union(other) if number in generations else other
+        self.generation = max(generations)
+        self.current = generations[self.generation]
+        self.previous = generations.get(self.generation - 1)
+
+    def save(self) -> None:
+        """Caches the filters, and writes them to the database when enough changed since the last write."""
+        if self.rotated or self.unsaved >= settings.SEEN_POSTS_PERSIST_EVERY:
+            with transaction.atomic():
+                stored = SeenPostsFilter.objects.select_for_update().filter(user_id=self.user_id).first()
+                if (stored is not None and stored.hashes == self.current.hashes
+                        and len(stored.current) == len(self.current.bits)):
+                    self.merge(stored)
+                SeenPostsFilter.objects.update_or_create(user_id=self.user_id, defaults={
+                    'current': bytes(self.current.bits), 'current_count': self.current.count,
+                    'previous': bytes(self.previous.bits) if self.previous else b'', 'hashes': self.current.hashes,
+                    'generation': self.generation,
+                })
+            self.unsaved, self.rotated = 0, False
+        caches[settings.SEEN_POSTS_CACHE].set(
+            self.cache_key(self.user_id),
+            (bytes(self.current.bits), self.current.count, self.previous and bytes(self.previous.bits),
+             self.current.hashes, self.unsaved, self.generation),
+            settings.SEEN_POSTS_CACHE_SECONDS,
+        )
+
+
+def track_seen_posts(request, posts: ShardedQuerySet) -> tuple[ShardedQuerySet, bool]:
+    """Marks the newest posts of a listing as seen by the viewer, keeping only unseen ones when asked.
+
+    Only the ``SEEN_POSTS_CANDIDATES`` newest posts are considered. With the
+    ``new`` parameter the listing is narrowed to those of them the viewer has
+    not been shown before; the check runs against the filter in memory, with
+    no join against a table of seen posts.
+
+    Returns:
+        The posts to list, and whether they are narrowed to unseen ones.
+    """
+    seen = SeenPosts.load(request.user.pk)
+    newest = posts.only('pk', 'created_at').order_by('-created_at')[:settings.SEEN_POSTS_CANDIDATES]
+    candidates = [post.pk for post in newest]
+    new_only = bool(request.GET.get('new'))
+    if new_only:
+        candidates = seen.unseen(candidates)
+        posts = posts.filter(pk__in=candidates)
+    seen.mark(candidates)
+    seen.save()
+    return posts, new_only
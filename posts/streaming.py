@@ -0,0 +1,70 @@
+from contextvars import copy_context
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.shortcuts import render
+from django.template.context import make_context
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+STREAM_SLOT = mark_safe('<!-- stream-slot -->')
+
+
+def render_listing(request, template_name: str, context: dict, posts, card_template: str,
+                   empty_template: str | None = None):
+    """Renders a page listing posts, streaming the post cards when enabled.
+
+    In streaming mode the page is rendered once around a placeholder. Everything
+    before it, including the <head> with the CSS and JS links, is sent
+    immediately; the cards follow in chunks while the queryset is read with a
+    server-side iterator that prefetches relations one chunk at a time.
+
+    Args:
+        request: The HTTP request object.
+        template_name: The page template; it renders ``stream_slot`` in place of the cards.
+        context: The page context, also visible to every card.
+        posts: The posts queryset, exposed to the page as ``posts`` when not streaming.
+        card_template: The template rendering a single ``post``.
+        empty_template: An optional template rendered when there are no posts.
+    """
+    if not settings.STREAMING_LISTING_PAGES:
+        return render(request, template_name, {**context, 'posts': posts})
+
+    # The CSRF cookie has to be set before the headers go out, not when the first card renders.
+    get_token(request)
+    page = render_to_string(template_name, {**context, 'stream_slot': STREAM_SLOT}, request)
+    head, tail = page.split(STREAM_SLOT, 1)
+    # Cards render after the view returns, so keep the view's context (e.g. its database routing).
+    cards = _stream_cards(request, head, tail, context, posts, card_template, empty_template)
+    return StreamingHttpResponse(_run_in_context(copy_context(), cards), content_type='text/html; charset=utf-8')
+
+
+def _run_in_context(context, iterator):
+    while True:
+        try:
+            yield context.run(next, iterator)
+        except StopIteration:
+            return
+
+
+def _stream_cards(request, head, tail, context, posts, card_template, empty_template):
+    yield head
+    chunk_size = settings.STREAMING_CHUNK_SIZE
+    card = get_template(card_template).template
+    card_context = make_context(context, request)
+    rendered = 0
+    chunk = []
+    with card_context.bind_template(card):
+        for post in posts.iterator(chunk_size=chunk_size):
+            with card_context.push(post=post):
+                chunk.append(card.render(card_context))
+            rendered += 1
+            if len(chunk) == chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+    if chunk:
+        yield ''.join(chunk)
+    if not rendered and empty_template:
+        yield render_to_string(empty_template, context, request)
+    yield tail
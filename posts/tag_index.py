@@ -0,0 +1,120 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Count
+
+from posts.models import Tag
+
+
+class TagIndex:
+    """A per-process prefix index over tag names, for autocompletion without a LIKE query per keystroke.
+
+    Names are kept in a sorted list, so the names starting with a prefix are
+    one contiguous slice found with bisect; the slice is ranked by post
+    count and the best ``TAG_AUTOCOMPLETE_LIMIT`` are remembered per prefix,
+    for at most ``TAG_INDEX_CACHED_PREFIXES`` prefixes. At most every
+    ``TAG_INDEX_REFRESH_SECONDS`` tags created by other workers are added
+    incrementally; this worker's own tag links adjust the counts as they are
+    committed, and every ``TAG_INDEX_REBUILD_SECONDS`` the whole index is
+    reloaded so counts changed by other workers catch up.
+    """
+
+    def __init__(self):
+        self._names = []
+        self._weights = {}
+        self._ids = {}
+        self._top = OrderedDict()
+        self._last_id = 0
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._checked_at = 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._names, self._weights, self._ids, self._last_id = [], {}, {}, 0
+            self._top.clear()
+            self._built_at = None
+
+    def rebuild(self) -> None:
+        """Reloads every tag name with its post count."""
+        rows = Tag.objects.annotate(weight=Count('posts')).values_list('pk', 'name', 'weight')
+        with self._lock:
+            self.clear()
+            for pk, name, weight in rows:
+                self._ids[pk] = name
+                self._weights[name] = weight
+                self._last_id = max(self._last_id, pk)
+            self._names = sorted(self._weights)
+            self._built_at = self._checked_at = time.monotonic()
+
+    def refresh(self) -> None:
+        """Adds the tags created since the index last looked."""
+        with self._lock:
+            rows = (Tag.objects.filter(pk__gt=self._last_id).annotate(weight=Count('posts'))
+                    .values_list('pk', 'name', 'weight'))
+            for pk, name, weight in rows:
+                self.add(pk, name, weight)
+            self._checked_at = time.monotonic()
+
+    def add(self, pk: int, name: str, weight: int = 0) -> None:
+        with self._lock:
+            self._last_id = max(self._last_id, pk)
+            if pk in self._ids:
+                return
+            self._ids[pk] = name
+            if name not in self._weights:
+                insort(self._names, name)
+            self._weights[name] = weight
+            self._forget(name)
+
+    def adjust(self, tag_ids, delta: int) -> None:
+        """Changes the post counts of the given tags, e.g. by 1 when a post is tagged with them."""
+        with self._lock:
+            if self._built_at is None:
+                return
+            known = [pk for pk in tag_ids if pk in self._ids]
+            if len(known) < len(tag_ids):
+                # New tags are loaded with their committed counts, which include this change already.
+                self.refresh()
+            for pk in known:
+                name = self._ids[pk]
+                self._weights[name] = max(0, self._weights[name] + delta)
+                self._forget(name)
+
+    def _forget(self, name: str) -> None:
+        for end in range(1, len(name) + 1):
+            self._top.pop(name[:end], None)
+
+    def _ensure_current(self) -> None:
+        now = time.monotonic()
+        if self._built_at is None or now - self._built_at >= settings.TAG_INDEX_REBUILD_SECONDS:
+            self.rebuild()
+        elif now - self._checked_at >= settings.TAG_INDEX_REFRESH_SECONDS:
+            self.refresh()
+
+    def complete(self, prefix: str) -> list[tuple[str, int]]:
+        """Returns the most used tags starting with ``prefix`` as (name, post count) pairs, most used first."""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        self._ensure_current()
+        with self._lock:
+            names = self._top.get(prefix)
+            if names is None:
+                start = bisect_left(self._names, prefix)
+                end = bisect_left(self._names, prefix + '\U0010ffff', start)
+                names = heapq.nsmallest(settings.TAG_AUTOCOMPLETE_LIMIT, self._names[start:end],
+                                        key=lambda name: (-self._weights[name], name))
+                self._top[prefix] = names
+                if len(self._top) > settings.TAG_INDEX_CACHED_PREFIXES:
+                    self._top.popitem(last=False)
+            else:
+                self._top.move_to_end(prefix)
+            return [(name, self._weights[name]) for name in names]
+
+
+tag_index = TagIndex()
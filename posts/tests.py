@@ -1,11 +1,32 @@
-from django.test import TestCase, Client
+import asyncio
+import io
+
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.core.cache import cache
+from django.core.checks import Tags, run_checks
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from unittest.mock import patch
 
-from posts.models import Post, Like, Tag
-from photos.models import PostImage
+from posts.live import DatabaseBroker, live_broker
+from posts.models import (ArchivedLike, ArchivedPost, LiveCountEvent, Post, Like, LikeCount, PendingAuthorRefresh,
+                          PendingLike, SeenPostsFilter, Tag)
+from posts.seen import BloomFilter, SeenPosts
+from posts.tag_index import tag_index
+from posts.utils import (buffer_like_toggle, buffered_likes_count, delete_posts, flush_pending_likes,
+                         parse_and_add_tags)
+from photos.models import ImageBlob, PendingAssetDeletion, PostImage
+from users.utils import delete_user_account
 
 User = get_user_model()
 
@@ -153,6 +174,35 @@ class PostViewsTest(TestCase, CloudinaryMockMixin):
         self.assertEqual(post.tags.count(), 2)
         self.assertEqual(PostImage.objects.count(), 2)
 
+    def test_edit_post_applies_only_differences(self):
+        """Editing keeps unchanged tag links and removes only the requested image."""
+        post = Post.objects.create(user=self.user, text='Diff post')
+        parse_and_add_tags('nice, summer', post)
+        kept_link = Post.tags.through.objects.get(post=post, tag__name='nice')
+        images = [PostImage.objects.create(post=post, uploaded_by=self.user, file='image/upload/v1/kept'),
+                  PostImage.objects.create(post=post, uploaded_by=self.user, file='image/upload/v1/dropped')]
+
+        self.client.post(reverse('edit_post', args=[post.id]),
+                         {'text': 'Diff post', 'tags': 'nice, work', 'delete_images': [images[1].id]})
+
+        self.assertEqual(set(post.tags.values_list('name', flat=True)), {'nice', 'work'})
+        self.assertTrue(Post.tags.through.objects.filter(pk=kept_link.pk).exists())
+        self.assertEqual(list(post.images.all()), [images[0]])
+
+    def test_edit_post_without_changes_writes_nothing(self):
+        """Submitting the form unchanged issues no INSERT, UPDATE or DELETE."""
+        post = Post.objects.create(user=self.user, text='Same post')
+        parse_and_add_tags('nice', post)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('edit_post', args=[post.id]), {'text': 'Same post', 'tags': 'Nice'})
+
+        self.assertEqual(response.status_code, 302)
+        writes = [query['sql'] for query in queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+                  and 'django_session' not in query['sql']]
+        self.assertEqual(writes, [])
+
     def test_like_view_toggle(self):
         """Should like and unlike a post."""
         post = Post.objects.create(user=self.user, text='Likeable post')
@@ -189,3 +239,606 @@ class PostViewsTest(TestCase, CloudinaryMockMixin):
         self.assertTemplateUsed(response, 'posts/friends_news.html')
         self.assertContains(response, 'test 1')
         self.assertContains(response, 'test 2')
+
+
+@override_settings(STREAMING_LISTING_PAGES=True, STREAMING_CHUNK_SIZE=2)
+class StreamingListingTest(TestCase):
+    """Tests for the streaming render mode of listing pages."""
+
+    def setUp(self):
+        """Log in a user who has a few posts."""
+        self.client = Client()
+        self.user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        self.client.login(username='test_user', password='3C5TeBt21')
+        for number in range(5):
+            Post.objects.create(user=self.user, text=f'streamed post {number}')
+
+    def test_feed_streams_head_first(self):
+        """The first chunk carries the page head and no post cards."""
+        response = self.client.get(reverse('feed'))
+        self.assertTrue(response.streaming)
+        chunks = [chunk.decode() for chunk in response.streaming_content]
+        self.assertIn('bundle.css', chunks[0])
+        self.assertIn('</head>', chunks[0])
+        self.assertNotIn('streamed post', chunks[0])
+        body = ''.join(chunks)
+        for number in range(5):
+            self.assertIn(f'streamed post {number}', body)
+        self.assertLess(body.index('streamed post 4'), body.index('streamed post 0'))
+        self.assertIn('csrftoken', response.cookies)
+
+    def test_cards_streamed_in_chunks(self):
+        """Cards are grouped by the configured chunk size between the head and the tail."""
+        response = self.client.get(reverse('friends_news'))
+        self.assertEqual(len(list(response.streaming_content)), 2)
+
+        self.client.post(reverse('like', args=[Post.objects.first().id]))
+        response = self.client.get(reverse('profile', args=[self.user.username]))
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 1 + 3 + 1)
+        self.assertIn(b'like-btn liked', b''.join(chunks))
+
+    def test_profile_without_posts(self):
+        """An empty listing still streams the empty-state message."""
+        User.objects.create_user(username='quiet_user', password='3C5TeBt21')
+        response = self.client.get(reverse('profile', args=['quiet_user']))
+        self.assertIn(b"You haven't posted anything yet.", b''.join(response.streaming_content))
+
+
+class BulkDeleteTest(TestCase, CloudinaryMockMixin):
+    """Tests for set-based deletion of posts and users."""
+
+    def setUp(self):
+        """Create an author with an illustrated, tagged post liked by other users."""
+        self.author = User.objects.create_user(username='author', password='3C5TeBt21')
+        self.fans = [User.objects.create_user(username=f'fan_{number}', password='3C5TeBt21') for number in range(3)]
+        self.post = Post.objects.create(user=self.author, text='Popular post')
+        self.post.tags.add(Tag.objects.create(name='summer'))
+        Like.objects.bulk_create(Like(user=fan, post=self.post) for fan in self.fans)
+
+    @patch('cloudinary.uploader.upload')
+    def test_delete_posts_removes_dependents(self, mock_upload):
+        """Likes, images and tag links go with the post and the asset is queued for deletion."""
+        self.mock_cloudinary(mock_upload)
+        PostImage.objects.create(post=self.post, uploaded_by=self.author,
+                                 file=SimpleUploadedFile('post.jpg', b'postimagecontent', content_type='image/jpeg'))
+
+        delete_posts(Post.objects.filter(pk=self.post.pk))
+
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(PostImage.objects.exists())
+        self.assertFalse(Post.tags.through.objects.exists())
+        self.assertTrue(Tag.objects.filter(name='summer').exists())
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertEqual(PendingAssetDeletion.objects.get(location='cloudinary').name, 'test_post')
+
+    def test_delete_user_account(self):
+        """A deleted user's posts, likes and follow relations are removed."""
+        other_post = Post.objects.create(user=self.fans[0], text='Fan post')
+        Like.objects.create(user=self.author, post=other_post)
+        self.client.force_login(self.fans[1])
+        self.client.post(reverse('subscribe', args=[self.author.id]))
+
+        delete_user_account(self.author)
+
+        self.assertFalse(User.objects.filter(username='author').exists())
+        self.assertEqual(list(Post.objects.all()), [other_post])
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(self.fans[1].following.exists())
+
+
+@override_settings(LIKES_WRITE_BEHIND=True)
+class WriteBehindLikeTest(TestCase):
+    """Tests for buffered like toggles and their batched flushing."""
+
+    def setUp(self):
+        """Create a post that already has one stored like."""
+        self.author = User.objects.create_user(username='author', password='3C5TeBt21')
+        self.user = User.objects.create_user(username='fan', password='3C5TeBt21')
+        self.post = Post.objects.create(user=self.author, text='Viral post')
+        Like.objects.create(user=self.author, post=self.post)
+        self.client.force_login(self.user)
+
+    def toggle(self):
+        """Toggle the current user's like and return the JSON response."""
+        return self.client.post(reverse('like', args=[self.post.id])).json()
+
+    def test_toggle_is_buffered_and_visible_to_the_user(self):
+        """A toggle only appends to the buffer but is reflected in the response."""
+        data = self.toggle()
+        self.assertEqual((data['liked'], data['likes_count']), (True, 2))
+        self.assertEqual(Like.objects.count(), 1)
+        data = self.toggle()
+        self.assertEqual((data['liked'], data['likes_count']), (False, 1))
+        self.assertEqual(list(PendingLike.objects.order_by('sequence').values_list('delta', flat=True)), [1, -1])
+
+    def test_toggle_only_inserts(self):
+        """After a flush, a toggle updates no shared row and does not count the post's likes."""
+        self.toggle()
+        flush_pending_likes()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer_like_toggle(self.user, self.post), (False, 1))
+        statements = [query['sql'].upper() for query in queries.captured_queries]
+        self.assertFalse([sql for sql in statements if sql.startswith(('UPDATE', 'DELETE')) or 'FOR UPDATE' in sql])
+        self.assertFalse([sql for sql in statements if 'COUNT(' in sql])
+
+    def test_flush_coalesces_toggles(self):
+        """Flushing applies only the final state of each user and post."""
+        for _ in range(3):
+            self.toggle()
+        self.client.force_login(self.author)
+        self.toggle()
+
+        call_command('flush_likes', stdout=io.StringIO())
+
+        self.assertEqual(list(self.post.likes.values_list('user__username', flat=True)), ['fan'])
+        self.assertFalse(PendingLike.objects.exists())
+
+    def test_flush_in_batches(self):
+        """Buffered likes split across batches are all stored, and the count stays right in between."""
+        self.toggle()
+        self.client.force_login(self.author)
+        self.toggle()
+        self.assertEqual(flush_pending_likes(batch_size=1), 1)
+        self.assertTrue(self.post.likes.filter(user=self.user).exists())
+        self.assertEqual(buffered_likes_count(self.post), 1)
+        self.assertEqual(flush_pending_likes(batch_size=1), 1)
+        self.assertFalse(self.post.likes.filter(user=self.author).exists())
+        self.assertEqual(flush_pending_likes(batch_size=1), 0)
+        self.assertEqual(LikeCount.objects.get(post=self.post).count, 1)
+
+    def test_count_follows_toggles_between_flushes(self):
+        """The running count matches the stored likes after toggles, flushes and discarded likes."""
+        fans = [User.objects.create_user(username=f'fan_{index}') for index in range(3)]
+        for fan in fans:
+            buffer_like_toggle(fan, self.post)
+        buffer_like_toggle(fans[0], self.post)
+        self.assertEqual(buffered_likes_count(self.post), 3)
+        flush_pending_likes(batch_size=2)
+        buffer_like_toggle(fans[1], self.post)
+        self.assertEqual(buffered_likes_count(self.post), 2)
+
+        delete_user_account(fans[2])
+        self.assertEqual(buffered_likes_count(self.post), 1)
+        flush_pending_likes()
+        self.assertEqual(buffered_likes_count(self.post), self.post.likes.count())
+        self.assertEqual(LikeCount.objects.get(post=self.post).count, self.post.likes.count())
+        self.assertFalse(PendingLike.objects.exists())
+
+
+class ArchiveTest(TestCase, CloudinaryMockMixin):
+    """Tests for moving old posts into the archive tables and reading them back."""
+
+    @patch('cloudinary.uploader.upload')
+    def setUp(self, mock_upload):
+        """Create a two-year-old post with a tag, a like and an image, and a recent post."""
+        self.mock_cloudinary(mock_upload)
+        self.author = User.objects.create_user(username='author', password='3C5TeBt21')
+        self.fan = User.objects.create_user(username='fan', password='3C5TeBt21')
+        self.old_post = Post.objects.create(user=self.author, text='Old post')
+        Post.objects.filter(pk=self.old_post.pk).update(created_at=timezone.now() - timedelta(days=730))
+        parse_and_add_tags('summer', self.old_post)
+        Like.objects.create(user=self.fan, post=self.old_post)
+        PostImage.objects.create(post=self.old_post, uploaded_by=self.author,
+                                 file=SimpleUploadedFile('post.jpg', b'postimagecontent', content_type='image/jpeg'))
+        self.recent_post = Post.objects.create(user=self.author, text='Recent post')
+        self.client.force_login(self.fan)
+
+    def test_archive_moves_old_posts(self):
+        """Old posts move to the archive with their likes while their image blob stays referenced."""
+        call_command('archive_posts', stdout=io.StringIO())
+
+        self.assertEqual(list(Post.objects.all()), [self.recent_post])
+        self.assertFalse(Like.objects.exists())
+        archived = ArchivedPost.objects.get()
+        self.assertEqual((archived.post_id, archived.tags, archived.likes_count), (self.old_post.pk, ['summer'], 1))
+        self.assertEqual(ArchivedLike.objects.get().user, self.fan)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        self.assertFalse(PendingAssetDeletion.objects.exists())
+
+    def test_profile_links_to_archived_posts(self):
+        """The profile only links to the archive, which renders the archived posts."""
+        call_command('archive_posts', stdout=io.StringIO())
+
+        response = self.client.get(reverse('profile', args=[self.author.username]))
+        self.assertNotContains(response, 'Old post')
+        self.assertContains(response, reverse('archived_posts', args=[self.author.username]))
+
+        response = self.client.get(reverse('archived_posts', args=[self.author.username]))
+        self.assertContains(response, 'Old post')
+        self.assertContains(response, '#summer')
+        self.assertContains(response, 'test_post')
+
+    @override_settings(ARCHIVE_PAGE_SIZE=1)
+    def test_archive_pages(self):
+        """Archived posts are paged by creation time."""
+        Post.objects.filter(pk=self.recent_post.pk).update(created_at=timezone.now() - timedelta(days=800))
+        call_command('archive_posts', stdout=io.StringIO())
+
+        response = self.client.get(reverse('archived_posts', args=[self.author.username]))
+        self.assertContains(response, 'Old post')
+        self.assertNotContains(response, 'Recent post')
+        response = self.client.get(reverse('archived_posts', args=[self.author.username]),
+                                   {'before': response.context['next_before']})
+        self.assertContains(response, 'Recent post')
+        self.assertIsNone(response.context['next_before'])
+
+    @override_settings(ARCHIVE_PAGE_SIZE=1)
+    def test_archive_pages_posts_created_together(self):
+        """Posts archived with the same creation time are each shown once, newest id first."""
+        old_created_at = Post.objects.get(pk=self.old_post.pk).created_at
+        Post.objects.filter(pk=self.recent_post.pk).update(created_at=old_created_at)
+        call_command('archive_posts', stdout=io.StringIO())
+
+        url = reverse('archived_posts', args=[self.author.username])
+        response = self.client.get(url)
+        self.assertContains(response, 'Recent post')
+        response = self.client.get(url, {'before': response.context['next_before'],
+                                         'before_id': response.context['next_before_id']})
+        self.assertContains(response, 'Old post')
+        self.assertNotContains(response, 'Recent post')
+        self.assertIsNone(response.context['next_before'])
+
+    def test_deleting_author_releases_archived_images(self):
+        """Deleting the author removes archived posts and likes and queues the image asset."""
+        call_command('archive_posts', stdout=io.StringIO())
+
+        delete_user_account(self.author)
+
+        self.assertFalse(ArchivedPost.objects.exists())
+        self.assertFalse(ArchivedLike.objects.exists())
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertTrue(PendingAssetDeletion.objects.filter(name='test_post').exists())
+
+    def test_partitioning_requires_postgresql(self):
+        """Partitioning is refused on other databases."""
+        with self.assertRaises(CommandError):
+            call_command('partition_archive', stdout=io.StringIO())
+
+
+class AuthorSnapshotTest(TestCase):
+    """Tests for the author username and avatar stored on posts."""
+
+    def setUp(self):
+        """Create an author with a post and log them in."""
+        self.author = User.objects.create_user(username='author', email='author@test.com', password='3C5TeBt21')
+        self.post = Post.objects.create(user=self.author, text='Snapshot post')
+        self.client.force_login(self.author)
+
+    def test_post_stores_author_snapshot(self):
+        """New posts copy the author's username."""
+        self.assertEqual(self.post.author_username, 'author')
+        self.assertIsNone(self.post.author_avatar)
+
+    def test_feed_does_not_join_author_tables(self):
+        """Post cards render from the post row without reading users, profiles or avatars per post."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('feed'))
+            self.assertContains(response, reverse('profile', args=['author']))
+        listing = [query['sql'] for query in queries.captured_queries if 'posts_post' in query['sql']]
+        self.assertFalse([sql for sql in listing if 'users_profile' in sql or 'photos_avatarimage' in sql])
+
+    def test_username_change_is_refreshed_in_background(self):
+        """Renaming queues a refresh that rewrites the snapshot on existing posts."""
+        self.client.post(reverse('edit_profile', args=['author']),
+                         {'email': 'author@test.com', 'username': 'renamed', 'description': ''})
+
+        self.assertTrue(PendingAuthorRefresh.objects.filter(user=self.author).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.author_username, 'author')
+
+        call_command('refresh_author_snapshots', stdout=io.StringIO())
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.author_username, 'renamed')
+        self.assertFalse(PendingAuthorRefresh.objects.exists())
+
+    @patch('cloudinary.uploader.upload')
+    def test_replaced_avatar_is_kept_until_posts_are_refreshed(self, mock_upload):
+        """The replaced avatar's blob is only released once no post snapshot shows it any more."""
+        mock_upload.side_effect = lambda *args, **kwargs: {
+            'public_id': f'avatar_{mock_upload.call_count}', 'version': '1', 'format': 'jpg',
+            'resource_type': 'image', 'type': 'upload'}
+
+        def upload_avatar(content: bytes) -> None:
+            self.client.post(reverse('edit_profile', args=['author']), {
+                'email': 'author@test.com', 'username': 'author', 'description': '',
+                'avatar': SimpleUploadedFile('avatar.jpg', content, content_type='image/jpeg')})
+
+        upload_avatar(b'first avatar')
+        call_command('refresh_author_snapshots', stdout=io.StringIO())
+        upload_avatar(b'second avatar')
+        first, second = ImageBlob.objects.order_by('pk')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.author_avatar['blob'], first.pk)
+        self.assertEqual(first.ref_count, 1)
+        self.assertFalse(PendingAssetDeletion.objects.exists())
+
+        call_command('refresh_author_snapshots', stdout=io.StringIO())
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.author_avatar['blob'], second.pk)
+        self.assertEqual(list(ImageBlob.objects.all()), [second])
+        self.assertEqual(PendingAssetDeletion.objects.get().name, first.file.public_id)
+
+    def test_missing_snapshots_are_filled_in(self):
+        """Posts stored without a snapshot get one from the --missing backfill."""
+        Post.objects.filter(pk=self.post.pk).update(author_username='')
+        call_command('refresh_author_snapshots', missing=True, stdout=io.StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.author_username, 'author')
+
+    def test_unchanged_profile_queues_nothing(self):
+        """Saving the profile without a new username or avatar leaves the snapshots alone."""
+        self.client.post(reverse('edit_profile', args=['author']),
+                         {'email': 'author@test.com', 'username': 'author', 'description': 'Hi'})
+        self.assertFalse(PendingAuthorRefresh.objects.exists())
+
+
+@override_settings(TAG_INDEX_REFRESH_SECONDS=3600, TAG_AUTOCOMPLETE_LIMIT=3)
+class TagAutocompleteTest(TestCase):
+    """Tests for the tag autocomplete endpoint and its in-memory prefix index."""
+
+    def setUp(self):
+        """Tag a few posts so tags starting with "su" have different post counts."""
+        tag_index.clear()
+        self.user = User.objects.create_user(username='test_user', password='3C5TeBt21')
+        self.posts = [Post.objects.create(user=self.user, text=f'Post {number}') for number in range(3)]
+        parse_and_add_tags('summer, sunset, beach', self.posts[0])
+        parse_and_add_tags('summer, sunset', self.posts[1])
+        parse_and_add_tags('summer, surf', self.posts[2])
+        self.client.force_login(self.user)
+
+    def complete(self, prefix: str) -> list:
+        response = self.client.get(reverse('tag_autocomplete'), {'q': prefix})
+        return [(tag['name'], tag['posts']) for tag in response.json()['tags']]
+
+    def test_most_used_tags_come_first(self):
+        """Tags matching the prefix are ranked by post count, then by name."""
+        self.assertEqual(self.complete('su'), [('summer', 3), ('sunset', 2), ('surf', 1)])
+        self.assertEqual(self.complete(' SUN'), [('sunset', 2)])
+        self.assertEqual(self.complete('x'), [])
+        self.assertEqual(self.complete(''), [])
+
+    def test_limit(self):
+        """At most TAG_AUTOCOMPLETE_LIMIT tags are suggested."""
+        parse_and_add_tags('sushi', self.posts[0])
+        self.assertEqual(len(self.complete('s')), 3)
+
+    def test_answers_from_memory(self):
+        """Once built, the index answers without queries."""
+        tag_index.complete('su')
+        with self.assertNumQueries(0):
+            self.assertEqual(tag_index.complete('sum'), [('summer', 3)])
+            self.assertEqual(tag_index.complete('su')[0], ('summer', 3))
+
+    def test_committed_links_update_counts(self):
+        """This worker's new tags and links show up right after they are committed, counted once."""
+        self.assertEqual(self.complete('su')[-1], ('surf', 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            parse_and_add_tags('surf, surfing', self.posts[0])
+            parse_and_add_tags('surf', self.posts[0])
+            parse_and_add_tags('surf', self.posts[1])
+        self.assertEqual(self.complete('surf'), [('surf', 3), ('surfing', 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.posts[0].tags.remove(Tag.objects.get(name='surf'))
+        self.assertEqual(self.complete('surf'), [('surf', 2), ('surfing', 1)])
+
+    def test_deleted_posts_lower_counts(self):
+        """Deleting posts lowers the counts of their tags in this worker once committed."""
+        self.assertEqual(self.complete('su'), [('summer', 3), ('sunset', 2), ('surf', 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_posts(Post.objects.filter(pk__in=[self.posts[0].pk, self.posts[1].pk]))
+        self.assertEqual(self.complete('su'), [('summer', 1), ('surf', 1), ('sunset', 0)])
+
+    def test_tags_from_other_workers_are_picked_up(self):
+        """Tags created without this worker's signals are added on the next refresh."""
+        self.complete('su')
+        Tag.objects.bulk_create([Tag(name='sundown')])
+        self.assertNotIn('sundown', dict(self.complete('sund')))
+        with override_settings(TAG_INDEX_REFRESH_SECONDS=0):
+            self.assertEqual(self.complete('sund'), [('sundown', 0)])
+
+
+@override_settings(LIVE_COUNTS_ENABLED=True, LIVE_COUNTS_BROKER='posts.live.InProcessBroker',
+                   LIVE_COUNTS_INTERVAL_SECONDS=0.05)
+class LiveCountsTest(TestCase):
+    """Tests for the server-sent stream of like and follower count changes."""
+
+    def setUp(self):
+        """Create a post, its author and two users who like it."""
+        self.author = User.objects.create_user(username='author', password='3C5TeBt21')
+        self.post = Post.objects.create(user=self.author, text='Live post')
+        self.fans = []
+        for number in range(2):
+            fan = Client()
+            fan.force_login(User.objects.create_user(username=f'fan_{number}', password='3C5TeBt21'))
+            self.fans.append(fan)
+
+    def toggle(self, url: str, *clients) -> None:
+        """Post a toggle from each client, publishing the changes as if committed."""
+        with self.captureOnCommitCallbacks(execute=True):
+            for client in clients:
+                client.post(url)
+
+    async def open_stream(self, **ids):
+        await self.async_client.aforce_login(self.author)
+        response = await self.async_client.get(reverse('live_counts'), ids)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        return stream
+
+    async def disconnect(self, stream) -> None:
+        """Cancel the stream while it waits, as the ASGI handler does when the client goes away."""
+        waiting = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+
+    async def test_changes_are_coalesced(self):
+        """Likes arriving within one interval are sent as one change with the final count."""
+        stream = await self.open_stream(posts=f'{self.post.id},999')
+        await sync_to_async(self.toggle)(reverse('like', args=[self.post.id]), *self.fans)
+        self.assertEqual(await anext(stream),
+                         b'data: {"posts": {"%d": {"delta": 2, "count": 2}}}\n\n' % self.post.id)
+        await sync_to_async(self.toggle)(reverse('like', args=[self.post.id]), self.fans[0])
+        self.assertEqual(await anext(stream),
+                         b'data: {"posts": {"%d": {"delta": -1, "count": 1}}}\n\n' % self.post.id)
+        await self.disconnect(stream)
+        self.assertFalse(live_broker().has_subscribers())
+
+    async def test_follower_counts(self):
+        """Follows of a profile on screen are pushed under "users"."""
+        stream = await self.open_stream(users=str(self.author.id))
+        await sync_to_async(self.toggle)(reverse('subscribe', args=[self.author.id]), self.fans[1])
+        self.assertEqual(await anext(stream),
+                         b'data: {"users": {"%d": {"delta": 1, "count": 1}}}\n\n' % self.author.id)
+        await self.disconnect(stream)
+
+    async def test_heartbeat(self):
+        """A comment keeps an idle stream open."""
+        stream = await self.open_stream(posts=str(self.post.id))
+        with self.settings(LIVE_COUNTS_HEARTBEAT_SECONDS=0.01):
+            self.assertEqual(await anext(stream), b': keep-alive\n\n')
+        await self.disconnect(stream)
+
+    def test_needs_asgi_login_and_ids(self):
+        """The WSGI application refuses to hold a stream open, and a stream needs a user and something to watch."""
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(reverse('live_counts'), {'posts': self.post.id}).status_code, 501)
+        response = async_to_sync(self.async_client.get)(reverse('live_counts'), {'posts': self.post.id})
+        self.assertEqual(response.status_code, 403)
+        self.async_client.force_login(self.author)
+        response = async_to_sync(self.async_client.get)(reverse('live_counts'), {'posts': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(LIVE_COUNTS_ENABLED=False, LIVE_COUNTS_BROKER='posts.live.DatabaseBroker')
+    def test_off_by_default(self):
+        """While live counts are off, toggles write no events, pages do not subscribe and the stream is not served."""
+        self.toggle(reverse('like', args=[self.post.id]), *self.fans)
+        self.assertFalse(LiveCountEvent.objects.exists())
+        self.client.force_login(self.author)
+        self.assertNotContains(self.client.get(reverse('create_post')), 'data-live-counts')
+        response = async_to_sync(self.async_client.get)(reverse('live_counts'), {'posts': self.post.id})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_database_broker_shares_changes_between_workers(self):
+        """Changes published by one worker reach the subscriptions of another through the events table."""
+        publisher, reader = DatabaseBroker(), DatabaseBroker()
+        subscription = reader.subscribe(['post:5'])
+        reader._poller.cancel()
+        await sync_to_async(reader.poll)()
+        for delta, count in ((1, 6), (1, 7)):
+            await sync_to_async(publisher.publish)('post:5', delta, count)
+        await sync_to_async(publisher.publish)('post:6', 1, 1)
+        await sync_to_async(reader.poll)()
+        self.assertEqual(subscription.drain(), {'posts': {'5': {'delta': 2, 'count': 7}}})
+        reader.unsubscribe(subscription)
+
+    def test_prune_live_events(self):
+        """Old events are deleted, recent ones kept."""
+        LiveCountEvent.objects.create(channel='post:1', delta=1, count=1,
+                                      created_at=timezone.now() - timedelta(hours=1))
+        LiveCountEvent.objects.create(channel='post:1', delta=1, count=2)
+        call_command('prune_live_events', stdout=io.StringIO())
+        self.assertEqual(list(LiveCountEvent.objects.values_list('count', flat=True)), [2])
+
+
+@override_settings(SEEN_POSTS_ENABLED=True, SEEN_POSTS_PERSIST_EVERY=5)
+class SeenPostsTest(TestCase):
+    """Tests for the "new since last visit" listings and their Bloom filters."""
+
+    def setUp(self):
+        """Create a viewer following an author with three posts."""
+        cache.clear()
+        self.viewer = User.objects.create_user(username='viewer', password='3C5TeBt21')
+        self.author = User.objects.create_user(username='author', password='3C5TeBt21')
+        self.viewer.following.create(user=self.author)
+        self.posts = [Post.objects.create(user=self.author, text=f'Post {number}') for number in range(3)]
+        self.client.force_login(self.viewer)
+
+    def listed(self, url_name: str, **params) -> list[int]:
+        response = self.client.get(reverse(url_name), params)
+        return [post.id for post in response.context['posts']]
+
+    def test_bloom_filter(self):
+        """Added values are always found, and other values rarely, at about the configured rate."""
+        bloom = BloomFilter.empty(2048, 0.01)
+        self.assertEqual(bloom.hashes, 7)
+        for value in range(bloom.capacity):
+            bloom.add(value)
+        self.assertTrue(all(value in bloom for value in range(bloom.capacity)))
+        false_positives = sum(value in bloom for value in range(10 ** 6, 10 ** 6 + 20000))
+        self.assertLess(false_positives / 20000, 0.02)
+
+    def test_only_new_posts_are_listed(self):
+        """Posts shown on any visit are left out of the next "new" listing."""
+        self.assertEqual(self.listed('feed'), [post.id for post in reversed(self.posts)])
+        self.assertEqual(self.listed('feed', new=1), [])
+        fresh = Post.objects.create(user=self.author, text='Fresh')
+        self.assertEqual(self.listed('friends_news', new=1), [fresh.id])
+        self.assertEqual(self.listed('friends_news', new=1), [])
+        self.assertContains(self.client.get(reverse('feed'), {'new': 1}), 'You are all caught up')
+
+    def test_filters_are_persisted_in_batches(self):
+        """The filters are written to the database every few posts and survive losing the cache."""
+        self.listed('feed')
+        self.assertFalse(SeenPostsFilter.objects.exists())
+        for number in range(2):
+            Post.objects.create(user=self.author, text=f'More {number}')
+        self.listed('feed')
+        self.assertEqual(SeenPostsFilter.objects.get(user=self.viewer).current_count, 5)
+        cache.clear()
+        self.assertEqual(self.listed('feed', new=1), [])
+
+    @override_settings(SEEN_POSTS_BYTES_PER_USER=256)
+    def test_full_filters_forget_the_oldest_posts(self):
+        """Once the current generation is full it replaces the previous one."""
+        seen = SeenPosts.load(self.viewer.pk)
+        capacity = seen.current.capacity
+        seen.mark(range(capacity * 3))
+        self.assertEqual(seen.unseen(range(capacity, capacity * 3)), [])
+        # The first generation is gone; its posts only match as false positives.
+        self.assertGreater(len(seen.unseen(range(capacity))), capacity * 0.9)
+
+    def test_workers_saving_at_once_keep_both_marks(self):
+        """Filters saved from two diverged copies are merged, so neither copy's posts come back."""
+        first, second = SeenPosts.load(self.viewer.pk), SeenPosts.load(self.viewer.pk)
+        first.mark(range(1, 6))
+        second.mark(range(11, 16))
+        first.save()
+        second.save()
+        cache.clear()
+        seen = SeenPosts.load(self.viewer.pk)
+        self.assertEqual(seen.unseen([*range(1, 6), *range(11, 16)]), [])
+        self.assertEqual(seen.current.count, 10)
+
+    @override_settings(SEEN_POSTS_BYTES_PER_USER=256)
+    def test_merge_follows_rotations(self):
+        """A copy that did not rotate is merged into the newer generations of one that did."""
+        first, second = SeenPosts.load(self.viewer.pk), SeenPosts.load(self.viewer.pk)
+        capacity = first.current.capacity
+        first.mark(range(capacity + 1))
+        second.mark(range(-5, 0))
+        first.save()
+        second.save()
+        saved = SeenPostsFilter.objects.get(user=self.viewer)
+        self.assertEqual(saved.generation, 1)
+        cache.clear()
+        self.assertEqual(SeenPosts.load(self.viewer.pk).unseen([*range(-5, 0), 0, capacity]), [])
+
+    def test_deploy_check_requires_shared_cache(self):
+        """The deployment checks reject keeping the filters in a cache each worker keeps to itself."""
+        errors = run_checks(tags=[Tags.caches], include_deployment_checks=True)
+        self.assertIn('DjangoGramm.E002', [error.id for error in errors])
+
+    @override_settings(SEEN_POSTS_ENABLED=False)
+    def test_disabled(self):
+        """Without SEEN_POSTS_ENABLED listings are unchanged and nothing is tracked."""
+        response = self.client.get(reverse('feed'), {'new': 1})
+        self.assertEqual(len(response.context['posts']), 3)
+        self.assertNotContains(response, 'New since last visit')
+        self.assertIsNone(cache.get(SeenPosts.cache_key(self.viewer.pk)))
@@ -1,5 +1,6 @@
 from django.urls import path
-from posts.views import feed, create_post, add_tags, like, delete_post, edit_post, friends_news
+from posts.views import (feed, create_post, add_tags, like, delete_post, edit_post, friends_news, live_counts,
+                         tag_autocomplete)
 
 urlpatterns = [
     path('create-post/', create_post, name='create_post'),
@@ -8,5 +9,7 @@ urlpatterns = [
     path('feed/', feed, name='feed'),
     path('friends-news/', friends_news, name='friends_news'),
     path('add-tags/<int:post_id>/', add_tags, name='add_tags'),
+    path('tags/autocomplete/', tag_autocomplete, name='tag_autocomplete'),
     path('<int:post_id>/like/', like, name='like'),
+    path('live/counts/', live_counts, name='live_counts'),
 ]
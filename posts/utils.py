@@ -1,4 +1,30 @@
-from posts.models import Tag, Post
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch, QuerySet, Sum
+from django.utils import timezone
+
+from DjangoGramm.sharding import group_by_shard, shard_for
+from posts.models import Tag, Post, Like, LikeCount, PendingAuthorRefresh, PendingLike
+from posts.tag_index import tag_index
+from photos.models import ImageBlob, PostImage
+from photos.utils import create_post_images, delete_images
+
+User = get_user_model()
+
+
+def parse_tag_names(tag_string: str) -> set[str]:
+    """Returns the normalized tag names in a comma-separated string."""
+    return {name.strip().lower() for name in tag_string.split(',') if name.strip()}
+
+
+def get_or_create_tags(names: set[str]) -> list[Tag]:
+    """Returns the tags with the given names, creating the missing ones in one query."""
+    if not names:
+        return []
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+    return list(Tag.objects.filter(name__in=names))
 
 
 def parse_and_add_tags(tag_string: str, post: Post) -> None:
@@ -8,7 +34,235 @@ def parse_and_add_tags(tag_string: str, post: Post) -> None:
         tag_string: A string of tag names separated by commas.
         post: The Post object to associate the tags with.
     """
-    tag_names = [name.strip().lower() for name in tag_string.split(',') if name.strip()]
-    for name in tag_names:
-        tag, _ = Tag.objects.get_or_create(name=name)
-        post.tags.add(tag)
+    tags = get_or_create_tags(parse_tag_names(tag_string))
+    if tags:
+        post.tags.add(*tags)
+
+
+def update_post(post: Post, form, delete_image_ids: list, files: list, uploads: list = ()) -> bool:
+    """Applies an edit to a post, writing only what differs from the stored state.
+
+    The text is saved only if it changed, tag links are added and removed by
+    difference instead of being cleared and re-added, and removed images are
+    deleted in one statement. All of this runs in one transaction; new images
+    are uploaded after it commits so no locks are held during the upload.
+
+    Args:
+        post: The Post being edited.
+        form: A valid PostForm bound to the post.
+        delete_image_ids: Ids of the post's images to remove.
+        files: Newly uploaded files from ``request.FILES``.
+        uploads: Verified images the browser uploaded directly.
+
+    Returns:
+        True if anything about the post changed.
+    """
+    new_names = parse_tag_names(form.cleaned_data.get('tags', ''))
+    current = dict(post.tags.values_list('name', 'pk'))
+    removed_tag_ids = [pk for name, pk in current.items() if name not in new_names]
+    added_names = new_names - current.keys()
+    removed_images = PostImage.objects.filter(post=post, id__in=[
+        image_id for image_id in delete_image_ids if str(image_id).isdigit()
+    ])
+
+    with transaction.atomic():
+        changed = 'text' in form.changed_data
+        if changed:
+            form.save(commit=False).save(update_fields=['text'])
+        if removed_tag_ids:
+            post.tags.remove(*removed_tag_ids)
+        if added_names:
+            post.tags.add(*get_or_create_tags(added_names))
+        images_removed = removed_images.exists()
+        if images_removed:
+            delete_images(removed_images)
+
+    create_post_images(post, post.user, files, uploads)
+    return bool(changed or removed_tag_ids or added_names or images_removed or files or uploads)
+
+
+def post_listing(queryset: QuerySet, viewer: User) -> QuerySet:
+    """Prepares posts for rendering as post cards, newest first.
+
+    Args:
+        queryset: The posts to list.
+        viewer: The user viewing the page, used to mark the posts they liked.
+    """
+    return (queryset
+            .annotate(likes_count=Count('likes'))
+            .prefetch_related('tags', 'images',
+                              Prefetch('likes', queryset=Like.objects.filter(user=viewer),
+                                       to_attr='liked_by_user'))
+            .order_by('-created_at'))
+
+
+def delete_posts(posts: QuerySet) -> None:
+    """Deletes posts together with their likes, images and tag links using set-based deletes.
+
+    Django's cascade collector loads every image row to send delete signals and
+    collects the posts again for each relation. Here images go through
+    ``delete_images``, which releases their blobs in bulk and queues their
+    remote assets for the background cleaner. The other dependents have no
+    signal receivers, so ``delete()`` clears each of them with a single
+    DELETE. Deleting tag links sends no ``m2m_changed``, so this worker's tag
+    autocomplete counts are lowered here once the deletion is committed.
+
+    Args:
+        posts: The posts to delete.
+    """
+    post_ids = list(posts.values_list('pk', flat=True))
+    with transaction.atomic():
+        delete_images(PostImage.objects.filter(post__in=post_ids))
+        tag_links = Post.tags.through.objects.filter(post__in=post_ids)
+        uncount_tag_links(Counter(tag_links.values_list('tag_id', flat=True)))
+        for dependents in (PendingLike.objects.filter(post__in=post_ids),
+                           LikeCount.objects.filter(post__in=post_ids), tag_links):
+            dependents.delete()
+        # Likes and posts go from the shard of each post; the transaction only spans the default database.
+        for alias, shard_post_ids in group_by_shard(post_ids).items():
+            Like.objects.using(alias).filter(post__in=shard_post_ids).delete()
+            # The posts' dependents are gone and Post has no signal receivers, so the collector,
+            # which would look for dependents in every related table first, is skipped.
+            shard_posts = Post.objects.using(alias).filter(pk__in=shard_post_ids)
+            shard_posts._raw_delete(shard_posts.db)
+
+
+def uncount_tag_links(links: Counter) -> None:
+    """Lowers this worker's tag autocomplete counts by the deleted links per tag id, once committed."""
+    by_count = defaultdict(list)
+    for tag_id, count in links.items():
+        by_count[count].append(tag_id)
+
+    def adjust():
+        for count, tag_ids in by_count.items():
+            tag_index.adjust(tag_ids, -count)
+    transaction.on_commit(adjust)
+
+
+def buffer_like_toggle(user: User, post: Post) -> tuple[bool, int]:
+    """Records a like toggle in the write-behind buffer instead of ``posts_like``.
+
+    The toggle is one appended row, so a like storm takes no lock on the
+    post's likes or on any row shared with other users. The row's sequence
+    number follows the user's latest buffered toggle of the post; when a
+    concurrent toggle took that number first, the state is read again. The
+    returned count already includes the buffered toggles, so the acting user
+    sees the result immediately.
+
+    Args:
+        user: The user toggling the like.
+        post: The liked or unliked post.
+
+    Returns:
+        Whether the user now likes the post, and the post's like count.
+    """
+    while True:
+        latest = (PendingLike.objects.filter(user=user, post=post)
+                  .order_by('-sequence').values_list('sequence', 'delta').first())
+        if latest is not None:
+            sequence, liked = latest[0], latest[1] > 0
+        else:
+            sequence, liked = 0, post.likes.filter(user=user).exists()
+        try:
+            with transaction.atomic():
+                PendingLike.objects.create(user=user, post=post, delta=-1 if liked else 1, sequence=sequence + 1)
+        except IntegrityError:
+            continue
+        return not liked, buffered_likes_count(post)
+
+
+def buffered_likes_count(post: Post) -> int:
+    """Returns the like count of a post: its ``LikeCount`` plus the toggles buffered since.
+
+    Posts whose toggles were never flushed are counted in ``posts_like``.
+    """
+    stored = LikeCount.objects.filter(post=post).values_list('count', flat=True).first()
+    if stored is None:
+        stored = post.likes.count()
+    return stored + (PendingLike.objects.filter(post=post).aggregate(delta=Sum('delta'))['delta'] or 0)
+
+
+def flush_pending_likes(batch_size: int = 1000) -> int:
+    """Applies one batch of buffered like toggles to ``posts_like``.
+
+    Toggles are coalesced to the net change of each (user, post) pair, so a
+    like followed by an unlike writes nothing. New likes are inserted with one
+    statement and removed likes are deleted with one statement per post. The
+    ``LikeCount`` of every post in the batch is then recounted from
+    ``posts_like``, with one query per shard, so counts changed outside the
+    buffer are corrected too. The buffered rows go in the same transaction.
+
+    Args:
+        batch_size: Maximum number of buffered toggles to apply.
+
+    Returns:
+        The number of buffered toggles that were applied.
+    """
+    with transaction.atomic():
+        batch = list(PendingLike.objects.order_by('id').values_list('id', 'user_id', 'post_id', 'delta')[:batch_size])
+        changes = defaultdict(int)
+        for _, user_id, post_id, delta in batch:
+            changes[(user_id, post_id)] += delta
+
+        Like.objects.bulk_create([Like(user_id=user_id, post_id=post_id)
+                                  for (user_id, post_id), change in changes.items() if change > 0],
+                                 ignore_conflicts=True)
+        unliked = defaultdict(list)
+        for (user_id, post_id), change in changes.items():
+            if change < 0:
+                unliked[post_id].append(user_id)
+        for post_id, user_ids in unliked.items():
+            Like.objects.using(shard_for(post_id)).filter(post_id=post_id, user_id__in=user_ids).delete()
+
+        counts = dict.fromkeys({post_id for _, post_id in changes}, 0)
+        for alias, post_ids in group_by_shard(counts).items():
+            counts.update(Like.objects.using(alias).filter(post_id__in=post_ids)
+                          .values('post_id').annotate(count=Count('pk')).values_list('post_id', 'count'))
+        LikeCount.objects.bulk_create([LikeCount(post_id=post_id, count=count) for post_id, count in counts.items()],
+                                      update_conflicts=True, unique_fields=['post'], update_fields=['count'])
+        PendingLike.objects.filter(id__in=[event_id for event_id, *_ in batch]).delete()
+    return len(batch)
+
+
+def request_author_refresh(user: User, replaced_blob_id: int | None = None) -> None:
+    """Marks the author snapshots on a user's posts as stale after a username or avatar change.
+
+    Args:
+        user: The user who changed their profile.
+        replaced_blob_id: The blob of a replaced avatar, still referenced by the user, which is released
+            once the posts no longer show it.
+    """
+    with transaction.atomic():
+        pending, _ = PendingAuthorRefresh.objects.select_for_update().get_or_create(user=user)
+        pending.requested_at = timezone.now()
+        if replaced_blob_id:
+            pending.replaced_blobs.append(replaced_blob_id)
+        pending.save()
+
+
+def refresh_author_snapshots(batch_size: int = 100) -> int:
+    """Rewrites the author snapshot on the posts of one batch of users with stale snapshots.
+
+    Each user's posts are updated with a single UPDATE, after which the blobs
+    of the avatars the user replaced are released. The queued row is locked
+    meanwhile, so a user who changes their profile again while the batch runs
+    stays queued for the next batch.
+
+    Args:
+        batch_size: Maximum number of users to refresh.
+
+    Returns:
+        The number of users whose posts were refreshed.
+    """
+    batch = list(PendingAuthorRefresh.objects.order_by('requested_at').values_list('pk', flat=True)[:batch_size])
+    for pending_id in batch:
+        with transaction.atomic():
+            pending = PendingAuthorRefresh.objects.select_for_update().filter(pk=pending_id).first()
+            if pending is None:
+                continue
+            user = User.objects.select_related('profile__avatar').get(pk=pending.user_id)
+            Post.objects.using(shard_for(user.pk)).filter(user=user).update(**Post.author_snapshot(user))
+            if pending.replaced_blobs:
+                ImageBlob.objects.release_many(Counter(pending.replaced_blobs))
+            pending.delete()
+    return len(batch)
@@ -1,12 +1,42 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db.models import Prefetch
-from django.http import HttpResponseForbidden, JsonResponse
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 
-from posts.models import Post, Like
+from DjangoGramm.routers import replica_reads
+from DjangoGramm.sharding import across_shards, scatter, shard_for
+from DjangoGramm.throttling import throttle_toggle
+from posts.models import Post
 from posts.forms import PostForm, AddTagsForm
-from posts.utils import parse_and_add_tags
-from photos.models import PostImage
+from posts.live import live_broker, parse_channels, publish_count
+from posts.seen import track_seen_posts
+from posts.streaming import render_listing
+from posts.tag_index import tag_index
+from posts.utils import buffer_like_toggle, delete_posts, parse_and_add_tags, post_listing, update_post
+from photos.utils import create_post_images, verify_direct_uploads
+from users.models import Followers
+
+
+def verified_uploads(request, form: PostForm) -> list:
+    """Verifies the images the browser uploaded directly, adding an error to the form if one is invalid.
+
+    Args:
+        request: The POST request whose ``uploaded_images`` hold the public ids.
+        form: The bound PostForm.
+
+    Returns:
+        The verified uploads, or an empty list if one of them is invalid.
+    """
+    try:
+        return verify_direct_uploads(request.user, request.POST.getlist('uploaded_images'))
+    except ValidationError as error:
+        form.add_error(None, error)
+        return []
 
 
 @login_required
@@ -15,14 +45,14 @@ def create_post(request):
     if request.method == 'POST':
         form = PostForm(request.POST)
         images = request.FILES.getlist('images')
+        uploads = verified_uploads(request, form)
         if form.is_valid():
             post = form.save(commit=False)
             post.user = request.user
             post.save()
             tag_string = form.cleaned_data.get('tags', '')
             parse_and_add_tags(tag_string, post)
-            for image in images:
-                PostImage.objects.create(file=image, uploaded_by=request.user, post=post)
+            create_post_images(post, request.user, images, uploads)
             return redirect('feed')
     else:
         form = PostForm()
@@ -32,27 +62,15 @@ def create_post(request):
 @login_required
 def edit_post(request, post_id: int):
     """Allow the post owner to edit an existing post."""
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.using(shard_for(post_id)), id=post_id)
     if post.user != request.user:
         return HttpResponseForbidden('You cannot edit this post.')
     if request.method == 'POST':
         form = PostForm(request.POST, instance=post)
         images = request.FILES.getlist('images')
+        uploads = verified_uploads(request, form)
         if form.is_valid():
-            updated_post = form.save(commit=False)
-            updated_post.user = request.user
-            updated_post.save()
-
-            tag_string = form.cleaned_data.get('tags', '')
-            post.tags.clear()
-            parse_and_add_tags(tag_string, post)
-
-            delete_ids = request.POST.getlist("delete_images")
-            if delete_ids:
-                PostImage.objects.filter(id__in=delete_ids, post=post).delete()
-
-            for image in images:
-                PostImage.objects.create(file=image, uploaded_by=request.user, post=post)
+            update_post(post, form, request.POST.getlist('delete_images'), images, uploads)
             return redirect('profile', username=request.user.username)
     else:
         tags_string = ", ".join(tag.name for tag in post.tags.all())
@@ -63,18 +81,18 @@ def edit_post(request, post_id: int):
 @login_required
 def delete_post(request, post_id: int):
     """Delete a post owned by the current user."""
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.using(shard_for(post_id)), id=post_id)
     if post.user != request.user:
         return HttpResponseForbidden('You cannot delete this post.')
     if request.method == 'POST':
-        post.delete()
+        delete_posts(Post.objects.using(shard_for(post.pk)).filter(pk=post.pk))
         return redirect(request.META.get('HTTP_REFERER', 'profile'))
 
 
 @login_required
 def add_tags(request, post_id: int):
     """Adds tags to an existing post."""
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.using(shard_for(post_id)), id=post_id)
     if request.method == 'POST':
         form = AddTagsForm(request.POST)
         if form.is_valid():
@@ -84,40 +102,98 @@ def add_tags(request, post_id: int):
 
 
 @login_required
+def tag_autocomplete(request):
+    """Returns the most used tags starting with the ``q`` parameter, from the in-memory tag index."""
+    return JsonResponse({'tags': [{'name': name, 'posts': posts}
+                                  for name, posts in tag_index.complete(request.GET.get('q', ''))]})
+
+
+@login_required
+@throttle_toggle('like', 'post_id')
 def like(request, post_id: int):
     """Toggles the like status for a post by the current user."""
     if request.method != 'POST':
         return JsonResponse({'error': 'Invalid request'}, status=400)
-    post = get_object_or_404(Post, id=post_id)
-    like, created = Like.objects.get_or_create(user=request.user, post=post)
-    if not created:
-        like.delete()
-        liked = False
+    post = get_object_or_404(Post.objects.using(shard_for(post_id)), id=post_id)
+    if settings.LIKES_WRITE_BEHIND:
+        liked, likes_count = buffer_like_toggle(request.user, post)
     else:
-        liked = True
-    return JsonResponse({'liked': liked, 'likes_count': post.likes.count(), 'success': True})
+        like, created = post.likes.get_or_create(user=request.user)
+        if not created:
+            like.delete()
+            liked = False
+        else:
+            liked = True
+        likes_count = post.likes.count()
+    publish_count('post', post.pk, 1 if liked else -1, likes_count)
+    return JsonResponse({'liked': liked, 'likes_count': likes_count, 'success': True})
+
+
+async def live_counts(request):
+    """Streams the like and follower count changes of the posts and profiles on screen as server-sent events.
+
+    The ``posts`` and ``users`` parameters hold comma-separated ids. Changes
+    are coalesced for ``LIVE_COUNTS_INTERVAL_SECONDS`` and sent as one
+    ``{"posts": {id: {"delta", "count"}}, "users": {...}}`` event; a comment
+    is sent after ``LIVE_COUNTS_HEARTBEAT_SECONDS`` without changes so proxies
+    keep the connection open. Needs the ASGI application, since every open
+    stream would hold a WSGI worker. Not served unless ``LIVE_COUNTS_ENABLED`` is set.
+    """
+    if not settings.LIVE_COUNTS_ENABLED:
+        raise Http404
+    if not hasattr(request, 'scope'):
+        return JsonResponse({'error': 'Live counts are only served by the ASGI application'}, status=501)
+    # Not login_required: the social auth backends have no async get_user, so the user is loaded in a thread.
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return JsonResponse({'error': 'Authentication required'}, status=403)
+    channels = parse_channels(request)
+    if not channels:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    async def events():
+        broker = live_broker()
+        subscription = broker.subscribe(channels)
+        try:
+            yield f'retry: {settings.LIVE_COUNTS_RETRY_MS}\n\n'
+            while True:
+                if not await subscription.wait(settings.LIVE_COUNTS_HEARTBEAT_SECONDS):
+                    yield ': keep-alive\n\n'
+                    continue
+                await asyncio.sleep(settings.LIVE_COUNTS_INTERVAL_SECONDS)
+                yield f'data: {json.dumps(subscription.drain())}\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
+@replica_reads
 def feed(request):
     """Display the feed page with posts ordered by creation date descending."""
-    posts = (Post.objects.select_related('user__profile')
-             .prefetch_related('tags', 'images',
-                               Prefetch('likes', queryset=Like.objects.filter(user=request.user),
-                                        to_attr='liked_by_user')).order_by('-created_at'))
-
-    return render(request, 'posts/feed.html', {'posts': posts})
+    posts, context = across_shards(Post.objects.all()), {}
+    if settings.SEEN_POSTS_ENABLED:
+        posts, context['new_only'] = track_seen_posts(request, posts)
+    return render_listing(request, 'posts/feed.html', context, post_listing(posts, request.user),
+                          'posts/includes/post_card.html',
+                          empty_template='posts/includes/no_new_posts.html' if context.get('new_only') else None)
 
 
 @login_required
+@replica_reads
 def friends_news(request):
-    """Render a feed of posts from users that the current authenticated user is following."""
-    following_ids = request.user.following.values_list('user', flat=True)
-    posts = (Post.objects
-             .filter(user_id__in=following_ids)
-             .select_related('user__profile')
-             .prefetch_related('tags', 'images',
-                               Prefetch('likes', queryset=Like.objects.filter(user=request.user),
-                                        to_attr='liked_by_user')).order_by('-created_at'))
-
-    return render(request, 'posts/friends_news.html', {'posts': posts})
+    """Render a feed of posts from users that the current authenticated user is following.
+
+    The followed authors' posts are read from each of their shards and merged newest first.
+    """
+    following_ids = (Followers.objects.using(shard_for(request.user.pk))
+                     .filter(follower=request.user).values_list('user', flat=True))
+    posts, context = scatter(Post.objects.all(), 'user_id', following_ids), {}
+    if settings.SEEN_POSTS_ENABLED:
+        posts, context['new_only'] = track_seen_posts(request, posts)
+    return render_listing(request, 'posts/friends_news.html', context, post_listing(posts, request.user),
+                          'posts/includes/post_card.html',
+                          empty_template='posts/includes/no_new_posts.html' if context.get('new_only') else None)
@@ -1 +1,190 @@
-(()=>{var e={488:()=>{document.addEventListener("DOMContentLoaded",function(){document.querySelectorAll(".follow-form").forEach(e=>{e.addEventListener("submit",function(e){e.preventDefault(),fetch(this.action,{method:"POST",headers:{"X-CSRFToken":this.querySelector("[name=csrfmiddlewaretoken]").value}}).then(e=>e.json()).then(e=>{if(e.success){const t=this.querySelector("button");t.textContent=e.following?"Unsubscribe":"Subscribe",t.classList.toggle("unfollow",e.following);const o=this.closest(".profile-info").querySelector(".profile-stats");o&&(o.querySelectorAll(".stat")[0].querySelector(".stat-count").textContent=e.followers_count)}})})})})},857:()=>{function e(e){let t=null;if(document.cookie&&""!==document.cookie){const o=document.cookie.split(";");for(let n of o)if(n=n.trim(),n.startsWith(e+"=")){t=decodeURIComponent(n.substring(e.length+1));break}}return t}document.addEventListener("DOMContentLoaded",function(){document.querySelectorAll(".like-btn").forEach(function(t){t.addEventListener("click",function(t){t.preventDefault();const o=this.dataset.postId;fetch(`/${o}/like/`,{method:"POST",headers:{"X-CSRFToken":e("csrftoken"),"X-Requested-With":"XMLHttpRequest"}}).then(e=>e.json()).then(e=>{if(!e.error){const t=this.querySelector("i"),o=this.querySelector(".like-count");t.className=e.liked?"fas fa-heart":"far fa-heart",o.textContent=e.likes_count,this.classList.toggle("liked",e.liked)}})})})})}},t={};function o(n){var r=t[n];if(void 0!==r)return r.exports;var s=t[n]={exports:{}};return e[n](s,s.exports,o),s.exports}o.n=e=>{var t=e&&e.__esModule?()=>e.default:()=>e;return o.d(t,{a:t}),t},o.d=(e,t)=>{for(var n in t)o.o(t,n)&&!o.o(e,n)&&Object.defineProperty(e,n,{enumerable:!0,get:t[n]})},o.o=(e,t)=>Object.prototype.hasOwnProperty.call(e,t),(()=>{"use strict";o(857),o(488)})()})();
\ No newline at end of file
+(()=>{var e={488:()=>{document.addEventListener("DOMContentLoaded",function(){document.querySelectorAll(".follow-form").forEach(e=>{e.addEventListener("submit",function(e){e.preventDefault(),fetch(this.action,{method:"POST",headers:{"X-CSRFToken":this.querySelector("[name=csrfmiddlewaretoken]").value}}).then(e=>e.json()).then(e=>{if(e.success){const t=this.querySelector("button");t.textContent=e.following?"Unsubscribe":"Subscribe",t.classList.toggle("unfollow",e.following);const o=this.closest(".profile-info").querySelector(".profile-stats");o&&(o.querySelectorAll(".stat")[0].querySelector(".stat-count").textContent=e.followers_count)}})})})})},857:()=>{function e(e){let t=null;if(document.cookie&&""!==document.cookie){const o=document.cookie.split(";");for(let n of o)if(n=n.trim(),n.startsWith(e+"=")){t=decodeURIComponent(n.substring(e.length+1));break}}return t}document.addEventListener("DOMContentLoaded",function(){document.querySelectorAll(".like-btn").forEach(function(t){t.addEventListener("click",function(t){t.preventDefault();const o=this.dataset.postId;fetch(`/${o}/like/`,{method:"POST",headers:{"X-CSRFToken":e("csrftoken"),"X-Requested-With":"XMLHttpRequest"}}).then(e=>e.json()).then(e=>{if(!e.error){const t=this.querySelector("i"),o=this.querySelector(".like-count");t.className=e.liked?"fas fa-heart":"far fa-heart",o.textContent=e.likes_count,this.classList.toggle("liked",e.liked)}})})})})},212:()=>{document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('form[data-direct-upload]').forEach(form => {
+        form.addEventListener('submit', function (e) {
+            const input = this.querySelector('input[type=file][name=images]');
+            if (!input || !input.files.length || this.dataset.uploading) {
+                return;
+            }
+            e.preventDefault();
+            this.dataset.uploading = 'true';
+            const csrfToken = this.querySelector('[name=csrfmiddlewaretoken]').value;
+            const button = this.querySelector('button[type=submit]');
+            button.disabled = true;
+
+            Promise.all(Array.from(input.files).map(file => uploadFile(this.dataset.directUpload, file, csrfToken)))
+                .then(publicIds => {
+                    publicIds.forEach(publicId => {
+                        const hidden = document.createElement('input');
+                        hidden.type = 'hidden';
+                        hidden.name = 'uploaded_images';
+                        hidden.value = publicId;
+                        this.appendChild(hidden);
+                    });
+                    // The images are stored already; only their public ids are submitted.
+                    input.value = '';
+                    this.submit();
+                })
+                .catch(() => {
+                    // Fall back to a regular multipart submit.
+                    this.submit();
+                });
+        });
+    });
+});
+
+function uploadFile(startUrl, file, csrfToken) {
+    return fetch(startUrl, {method: 'POST', headers: {'X-CSRFToken': csrfToken}})
+        .then(res => res.json())
+        .then(upload => uploadChunks(upload, file, csrfToken, 0))
+        .then(upload => upload.public_id);
+}
+
+function uploadChunks(upload, file, csrfToken, start) {
+    const end = Math.min(start + upload.chunk_size, file.size);
+    const body = new FormData();
+    Object.entries(upload.fields).forEach(([name, value]) => body.append(name, value));
+    body.append('file', file.slice(start, end), file.name);
+
+    const headers = {
+        'Content-Range': `bytes ${start}-${end - 1}/${file.size}`,
+        'X-Unique-Upload-Id': upload.public_id,
+    };
+    // Only the local stand-in is on this origin; the CSRF token must not leak to the storage backend.
+    if (new URL(upload.upload_url, window.location.href).origin === window.location.origin) {
+        headers['X-CSRFToken'] = csrfToken;
+    }
+    return fetch(upload.upload_url, {method: 'POST', headers: headers, body: body})
+        .then(res => {
+            if (!res.ok) {
+                throw new Error(`Upload failed with status ${res.status}`);
+            }
+            return end < file.size ? uploadChunks(upload, file, csrfToken, end) : upload;
+        });
+}
+},604:()=>{document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('input[data-tag-autocomplete]').forEach(input => {
+        const wrapper = document.createElement('span');
+        wrapper.className = 'tag-autocomplete';
+        input.parentNode.insertBefore(wrapper, input);
+        wrapper.appendChild(input);
+        const list = document.createElement('ul');
+        list.className = 'tag-suggestions';
+        wrapper.appendChild(list);
+
+        let timer = null;
+        let active = -1;
+        const cache = new Map();
+
+        // Only the tag being typed, after the last comma, is completed.
+        const currentPrefix = () => input.value.split(',').pop().trim().toLowerCase();
+
+        function show(tags) {
+            active = -1;
+            list.replaceChildren(...tags.map(tag => {
+                const item = document.createElement('li');
+                const name = document.createElement('span');
+                name.textContent = `#${tag.name}`;
+                const count = document.createElement('span');
+                count.className = 'tag-count';
+                count.textContent = tag.posts;
+                item.append(name, count);
+                item.addEventListener('mousedown', e => {
+                    e.preventDefault();
+                    choose(tag.name);
+                });
+                return item;
+            }));
+        }
+
+        function choose(name) {
+            const parts = input.value.split(',');
+            parts[parts.length - 1] = parts.length > 1 ? ` ${name}` : name;
+            input.value = `${parts.join(',')}, `;
+            show([]);
+            input.focus();
+        }
+
+        function suggest() {
+            const prefix = currentPrefix();
+            if (!prefix) {
+                show([]);
+                return;
+            }
+            if (cache.has(prefix)) {
+                show(cache.get(prefix));
+                return;
+            }
+            fetch(`${input.dataset.tagAutocomplete}?q=${encodeURIComponent(prefix)}`)
+                .then(res => res.json())
+                .then(data => {
+                    cache.set(prefix, data.tags);
+                    if (currentPrefix() === prefix) {
+                        show(data.tags);
+                    }
+                })
+                .catch(() => show([]));
+        }
+
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            timer = setTimeout(suggest, 100);
+        });
+        input.addEventListener('blur', () => show([]));
+        input.addEventListener('keydown', e => {
+            const items = list.querySelectorAll('li');
+            if (!items.length) {
+                return;
+            }
+            if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                e.preventDefault();
+                active = (active + (e.key === 'ArrowDown' ? 1 : -1) + items.length) % items.length;
+                items.forEach((item, index) => item.classList.toggle('active', index === active));
+            } else if (e.key === 'Enter' && active >= 0) {
+                e.preventDefault();
+                choose(items[active].firstChild.textContent.slice(1));
+            } else if (e.key === 'Escape') {
+                show([]);
+            }
+        });
+    });
+});
+},731:()=>{document.addEventListener('DOMContentLoaded', function () {
+    const url = document.body.dataset.liveCounts;
+    if (!url || !window.EventSource) {
+        return;
+    }
+    const likeCounts = new Map();
+    document.querySelectorAll('.like-btn[data-post-id]').forEach(button => {
+        likeCounts.set(button.dataset.postId, button.querySelector('.like-count'));
+    });
+    const followerCounts = new Map();
+    document.querySelectorAll('[data-followers-of]').forEach(count => {
+        followerCounts.set(count.dataset.followersOf, count);
+    });
+    if (!likeCounts.size && !followerCounts.size) {
+        return;
+    }
+
+    const query = new URLSearchParams({
+        posts: Array.from(likeCounts.keys()).join(','),
+        users: Array.from(followerCounts.keys()).join(','),
+    });
+    const source = new EventSource(`${url}?${query}`);
+    source.addEventListener('message', e => {
+        const changes = JSON.parse(e.data);
+        // The absolute count is applied, so the viewer's own clicks are not counted twice.
+        Object.entries(changes.posts || {}).forEach(([id, change]) => {
+            const count = likeCounts.get(id);
+            if (count) {
+                count.textContent = change.count;
+            }
+        });
+        Object.entries(changes.users || {}).forEach(([id, change]) => {
+            const count = followerCounts.get(id);
+            if (count) {
+                count.textContent = change.count;
+            }
+        });
+    });
+});
+}},t={};function o(n){var r=t[n];if(void 0!==r)return r.exports;var s=t[n]={exports:{}};return e[n](s,s.exports,o),s.exports}o.n=e=>{var t=e&&e.__esModule?()=>e.default:()=>e;return o.d(t,{a:t}),t},o.d=(e,t)=>{for(var n in t)o.o(t,n)&&!o.o(e,n)&&Object.defineProperty(e,n,{enumerable:!0,get:t[n]})},o.o=(e,t)=>Object.prototype.hasOwnProperty.call(e,t),(()=>{"use strict";o(857),o(488),o(212),o(604),o(731)})()})();
@@ -1,9 +1,60 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 
-from users.models import Profile
+from DjangoGramm.admin import LargeTableAdmin, ShardedModelAdmin
+from users.follow_graph import record_follow_change
+from users.models import Followers, Profile
+from users.utils import delete_user_account
 
 User = get_user_model()
 
-admin.site.register(User)
-admin.site.register(Profile)
+
+@admin.register(User)
+class UserAdmin(LargeTableAdmin):
+    list_display = ('id', 'username', 'email', 'is_staff', 'date_joined')
+    sortable_by = ('id', 'username')
+    # Prefix matches on the unique username can use its index, unlike Django's default icontains.
+    search_fields = ('username__startswith',)
+
+    def delete_model(self, request, obj):
+        delete_user_account(obj)
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            delete_user_account(user)
+
+
+@admin.register(Profile)
+class ProfileAdmin(LargeTableAdmin):
+    list_display = ('id', 'user')
+    list_select_related = ('user',)
+    sortable_by = ('id',)
+    raw_id_fields = ('user', 'avatar')
+
+
+@admin.register(Followers)
+class FollowersAdmin(ShardedModelAdmin):
+    # A user's follows are listed by following ?follower=<id>, and their followers by ?user=<id>.
+    list_display = ('id', 'follower', 'user', 'created_at')
+    list_select_related = ('follower', 'user')
+    sortable_by = ('id',)
+    raw_id_fields = ('user', 'follower')
+
+    # Every change is logged like a toggle on the site, so the workers' follow graphs see it.
+    def save_model(self, request, obj, form, change):
+        previous = (form.initial.get('user'), form.initial.get('follower')) if change else None
+        super().save_model(request, obj, form, change)
+        if previous != (obj.user_id, obj.follower_id):
+            if previous:
+                record_follow_change(*previous, False)
+            record_follow_change(obj.user_id, obj.follower_id, True)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        record_follow_change(obj.user_id, obj.follower_id, False)
+
+    def delete_queryset(self, request, queryset):
+        pairs = list(queryset.values_list('user_id', 'follower_id'))
+        super().delete_queryset(request, queryset)
+        for user_id, follower_id in pairs:
+            record_follow_change(user_id, follower_id, False)
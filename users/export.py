@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import secrets
+import shutil
+import tempfile
+import urllib.request
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from typing import Callable
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from photos.models import PostImage
+from posts.models import ArchivedPost, Like, Post
+from users.models import DataExport, Followers
+
+logger = logging.getLogger(__name__)
+
+# Downloaded images larger than this are spooled to disk while they wait to be written.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+def export_storage() -> FileSystemStorage:
+    return FileSystemStorage(location=settings.EXPORT_ROOT)
+
+
+def exports_available() -> bool:
+    """Returns whether exports can be written: they read posts, likes and follows from the default database only."""
+    return not settings.DATABASE_SHARDS
+
+
+class ClaimLost(Exception):
+    """Raised when an export this worker is writing was claimed again by another worker."""
+
+
+def renew_claim(export: DataExport, **fields) -> None:
+    """Moves the export's ``started_at`` forward, saving ``fields`` with it, if this worker still holds the claim.
+
+    The claim is the ``started_at`` this worker set, so a worker that
+    reclaimed the export in the meantime is never overwritten.
+
+    Raises:
+        ClaimLost: If another worker claimed the export since.
+    """
+    now = timezone.now()
+    if not DataExport.objects.filter(pk=export.pk, status=DataExport.RUNNING,
+                                     started_at=export.started_at).update(started_at=now, **fields):
+        raise ClaimLost(export.pk)
+    export.started_at = now
+
+
+def heartbeat(export: DataExport) -> None:
+    """Renews the claim on an export once ``EXPORT_HEARTBEAT_SECONDS`` passed since it was last renewed."""
+    if timezone.now() - export.started_at >= timedelta(seconds=settings.EXPORT_HEARTBEAT_SECONDS):
+        renew_claim(export)
+
+
+def fetch_image(url: str):
+    """Downloads an image into a temporary file and returns it rewound."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with urllib.request.urlopen(url, timeout=30) as response:
+        shutil.copyfileobj(response, spool)
+    spool.seek(0)
+    return spool
+
+
+def write_jsonl(archive: zipfile.ZipFile, name: str, rows, beat: Callable[[], None]) -> None:
+    """Streams rows into one JSON-lines entry of the archive, calling ``beat`` after each row."""
+    with archive.open(name, 'w', force_zip64=True) as entry:
+        for row in rows:
+            entry.write(json.dumps(row, cls=DjangoJSONEncoder).encode() + b'\n')
+            beat()
+
+
+def write_images(archive: zipfile.ZipFile, images: QuerySet, beat: Callable[[], None]) -> list[int]:
+    """Downloads post images concurrently and writes them into the archive in order.
+
+    At most ``EXPORT_IMAGE_WORKERS`` downloads run at once and at most twice
+    that many finished downloads wait to be written, so memory use does not
+    grow with the number of images. ``beat`` is called after each image.
+
+    Returns:
+        The ids of images that could not be downloaded.
+    """
+    missing = []
+    window = settings.EXPORT_IMAGE_WORKERS * 2
+    pending = deque()
+
+    def write_next():
+        image_id, extension, future = pending.popleft()
+        try:
+            spool = future.result()
+        except Exception:
+            missing.append(image_id)
+            return
+        with spool, archive.open(f'images/{image_id}.{extension}', 'w', force_zip64=True) as entry:
+            shutil.copyfileobj(spool, entry)
+        beat()
+
+    with ThreadPoolExecutor(max_workers=settings.EXPORT_IMAGE_WORKERS) as executor:
+        for image in images.only('id', 'file').iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            if not image.file:
+                continue
+            url = image.file.build_url(secure=True)
+            pending.append((image.pk, image.file.format or 'jpg', executor.submit(fetch_image, url)))
+            if len(pending) >= window:
+                write_next()
+        while pending:
+            write_next()
+    return missing
+
+
+def write_export(export: DataExport) -> None:
+    """Writes the user's posts, likes, follow lists and post images into a ZIP archive.
+
+    Every table is read with chunked iterators (server-side cursors on
+    PostgreSQL) and every entry is streamed into the archive, which is written
+    straight to ``EXPORT_ROOT``. The claim on the export is renewed while
+    writing, so a slow export is not taken for an abandoned one.
+
+    Raises:
+        ClaimLost: If another worker claimed the export while it was written.
+    """
+    user = export.user
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    storage = export_storage()
+    beat = partial(heartbeat, export)
+    export.file = f'{user.pk}/{export.pk}-{secrets.token_urlsafe(8)}.zip'
+    # Recorded before writing, so the partial file is deleted if this worker dies and the export is claimed again.
+    renew_claim(export, file=export.file)
+    path = storage.path(export.file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as file, zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as archive:
+        write_jsonl(archive, 'profile.jsonl', [{
+            'username': user.username, 'email': user.email, 'first_name': user.first_name,
+            'last_name': user.last_name, 'description': user.profile.description,
+            'date_joined': user.date_joined,
+        }], beat)
+        write_jsonl(archive, 'posts.jsonl', Post.objects.filter(user=user).order_by('pk')
+                    .values('id', 'text', 'created_at').iterator(chunk_size=chunk_size), beat)
+        write_jsonl(archive, 'post_tags.jsonl', Post.tags.through.objects.filter(post__user=user)
+                    .order_by('post_id').values('post_id', 'tag__name').iterator(chunk_size=chunk_size), beat)
+        write_jsonl(archive, 'archived_posts.jsonl', ArchivedPost.objects.filter(user=user)
+                    .values('post_id', 'text', 'created_at', 'tags', 'likes_count')
+                    .iterator(chunk_size=chunk_size), beat)
+        write_jsonl(archive, 'likes.jsonl', Like.objects.filter(user=user).order_by('pk')
+                    .values('post_id').iterator(chunk_size=chunk_size), beat)
+        write_jsonl(archive, 'followers.jsonl', Followers.objects.filter(user=user).order_by('pk')
+                    .values('follower__username', 'created_at').iterator(chunk_size=chunk_size), beat)
+        write_jsonl(archive, 'following.jsonl', Followers.objects.filter(follower=user).order_by('pk')
+                    .values('user__username', 'created_at').iterator(chunk_size=chunk_size), beat)
+        missing = write_images(archive, PostImage.objects.filter(post__user=user).order_by('pk'), beat)
+        if missing:
+            write_jsonl(archive, 'missing_images.jsonl', ({'id': image_id} for image_id in missing), beat)
+
+    export.size = storage.size(export.file)
+
+
+def write_claimed_export(export: DataExport) -> None:
+    """Writes an export this worker claimed and records whether it succeeded.
+
+    Raises:
+        ClaimLost: If another worker claimed the export before it was recorded.
+    """
+    try:
+        write_export(export)
+        export.status = DataExport.DONE
+    except ClaimLost:
+        raise
+    except Exception:
+        logger.exception('Export %s of user %s failed', export.pk, export.user_id)
+        export.status = DataExport.FAILED
+        delete_export_files([export])
+        export.file = ''
+    export.finished_at = timezone.now()
+    renew_claim(export, status=export.status, file=export.file, size=export.size, finished_at=export.finished_at)
+
+
+def run_pending_exports(batch_size: int = 1) -> int:
+    """Claims and writes a batch of requested exports.
+
+    Exports whose claim was not renewed for ``EXPORT_RUNNING_TIMEOUT``
+    seconds are claimed again, since the worker writing them was killed or
+    lost. A worker that finds its export claimed again drops its own file
+    and leaves the export to the new claim.
+
+    Returns:
+        The number of exports handled, whether they succeeded or failed.
+    """
+    handled = 0
+    stale = timezone.now() - timedelta(seconds=settings.EXPORT_RUNNING_TIMEOUT)
+    claimable = Q(status=DataExport.PENDING) | Q(status=DataExport.RUNNING, started_at__lt=stale)
+    for export in DataExport.objects.filter(claimable).order_by('pk')[:batch_size]:
+        # Claimed with a conditional update so concurrent workers never write the same export; claiming
+        # moves started_at forward, so a stale export is only reclaimed once.
+        claimed_at = timezone.now()
+        if not DataExport.objects.filter(claimable, pk=export.pk).update(status=DataExport.RUNNING,
+                                                                          started_at=claimed_at):
+            continue
+        export.started_at = claimed_at
+        delete_export_files([export])
+        try:
+            write_claimed_export(export)
+        except ClaimLost:
+            logger.warning('Export %s of user %s was claimed again by another worker', export.pk, export.user_id)
+            delete_export_files([export])
+        handled += 1
+    return handled
+
+
+def delete_export_files(exports) -> None:
+    storage = export_storage()
+    for export in exports:
+        if export.file:
+            storage.delete(export.file)
+
+
+def delete_expired_exports() -> int:
+    """Deletes exports finished more than ``EXPORT_RETENTION_DAYS`` ago, with their files."""
+    expired = DataExport.objects.filter(
+        finished_at__lt=timezone.now() - timedelta(days=settings.EXPORT_RETENTION_DAYS))
+    delete_export_files(expired)
+    return expired.delete()[0]
@@ -0,0 +1,140 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from DjangoGramm.sharding import shard_aliases, shard_for
+from users.models import FollowChange, Followers
+
+
+def contains(ids: array, value: int) -> bool:
+    index = bisect_left(ids, value)
+    return index < len(ids) and ids[index] == value
+
+
+class FollowGraph:
+    """A per-process index of who follows whom, for relationship checks without queries.
+
+    The followed and follower ids of a user are kept as sorted integer arrays,
+    loaded from ``Followers`` the first time the user is asked about; at most
+    ``FOLLOW_GRAPH_MAX_USERS`` arrays per direction are kept, least recently
+    used first out. At most every ``FOLLOW_GRAPH_REFRESH_SECONDS`` the graph
+    catches up from the ``FollowChange`` log, re-reading a short overlap so
+    changes committed late are not missed; applying a change twice is
+    harmless. A graph idle for longer than the log is kept starts over, and
+    an array loaded more than ``FOLLOW_GRAPH_RELOAD_SECONDS`` ago is read
+    again when next asked for, which repairs changes that never reached
+    the log, such as rows written by hand.
+    """
+
+    def __init__(self):
+        self._following = OrderedDict()
+        self._followers = OrderedDict()
+        self._lock = threading.RLock()
+        self._refreshed_at = None
+        self._checked_at = 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._following.clear()
+            self._followers.clear()
+            self._refreshed_at = None
+
+    def refresh(self) -> None:
+        """Applies the changes logged since the previous refresh."""
+        now = timezone.now()
+        with self._lock:
+            if self._refreshed_at is None or \
+                    now - self._refreshed_at > timedelta(hours=settings.FOLLOW_GRAPH_LOG_RETENTION_HOURS):
+                self._following.clear()
+                self._followers.clear()
+            else:
+                since = self._refreshed_at - timedelta(seconds=settings.FOLLOW_GRAPH_REFRESH_OVERLAP_SECONDS)
+                changes = FollowChange.objects.filter(created_at__gte=since).order_by('id')
+                for user_id, follower_id, followed in changes.values_list('user_id', 'follower_id', 'followed'):
+                    self.apply(user_id, follower_id, followed)
+            self._refreshed_at = now
+            self._checked_at = time.monotonic()
+
+    def apply(self, user_id: int, follower_id: int, followed: bool) -> None:
+        """Updates the loaded arrays for one follow or unfollow."""
+        with self._lock:
+            for index, owner, member in ((self._following, follower_id, user_id),
+                                         (self._followers, user_id, follower_id)):
+                entry = index.get(owner)
+                if entry is None:
+                    continue
+                ids = entry[1]
+                present = contains(ids, member)
+                if followed and not present:
+                    insort(ids, member)
+                elif not followed and present:
+                    del ids[bisect_left(ids, member)]
+
+    def _ids(self, index: OrderedDict, user_id: int, column: str, key: str) -> array:
+        if time.monotonic() - self._checked_at >= settings.FOLLOW_GRAPH_REFRESH_SECONDS:
+            self.refresh()
+        with self._lock:
+            entry = index.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] < settings.FOLLOW_GRAPH_RELOAD_SECONDS:
+                index.move_to_end(user_id)
+                return entry[1]
+            ids = array('q', sorted(self._load(user_id, column, key)))
+            index[user_id] = (time.monotonic(), ids)
+            index.move_to_end(user_id)
+            if len(index) > settings.FOLLOW_GRAPH_MAX_USERS:
+                index.popitem(last=False)
+            return ids
+
+    @staticmethod
+    def _load(user_id: int, column: str, key: str) -> list[int]:
+        follows = Followers.objects.filter(**{key: user_id}).values_list(column, flat=True)
+        if key == 'follower_id':
+            # Follows live on the follower's shard; a user's followers are spread over all of them.
+            return list(follows.using(shard_for(user_id)))
+        return [member for alias in shard_aliases() for member in follows.using(alias)]
+
+    def following(self, user_id: int) -> array:
+        """Returns the sorted ids of the users ``user_id`` follows."""
+        return self._ids(self._following, user_id, 'user_id', 'follower_id')
+
+    def followers(self, user_id: int) -> array:
+        """Returns the sorted ids of the users following ``user_id``."""
+        return self._ids(self._followers, user_id, 'follower_id', 'user_id')
+
+    def is_following(self, follower_id: int, user_id: int) -> bool:
+        return contains(self.following(follower_id), user_id)
+
+    def is_mutual(self, first_id: int, second_id: int) -> bool:
+        return self.is_following(first_id, second_id) and self.is_following(second_id, first_id)
+
+    def following_among(self, follower_id: int, user_ids) -> set[int]:
+        """Returns which of ``user_ids`` the follower follows, e.g. for "Following" badges."""
+        following = self.following(follower_id)
+        return {user_id for user_id in user_ids if contains(following, user_id)}
+
+    def followers_among(self, user_id: int, follower_ids) -> set[int]:
+        """Returns which of ``follower_ids`` follow the user, e.g. for "Follows you" badges."""
+        followers = self.followers(user_id)
+        return {follower_id for follower_id in follower_ids if contains(followers, follower_id)}
+
+    def common_following(self, first_id: int, second_id: int) -> set[int]:
+        """Returns the ids of the users both users follow."""
+        first, second = self.following(first_id), self.following(second_id)
+        if len(first) > len(second):
+            first, second = second, first
+        return {user_id for user_id in first if contains(second, user_id)}
+
+
+follow_graph = FollowGraph()
+
+
+def record_follow_change(user_id: int, follower_id: int, followed: bool) -> None:
+    """Logs a follow or unfollow for every worker's graph and applies it to this one right away."""
+    FollowChange.objects.create(user_id=user_id, follower_id=follower_id, followed=followed)
+    follow_graph.apply(user_id, follower_id, followed)
@@ -0,0 +1,272 @@
+import csv
+import json
+from collections import Counter
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts.models import Like, Post
+from posts.utils import get_or_create_tags, parse_tag_names
+from users.models import FollowChange, Followers, ImportedObject, Profile
+
+User = get_user_model()
+
+KINDS = ('user', 'post', 'like', 'follow')
+
+
+def read_records(path: str, kind: str | None = None):
+    """Yields the records of a JSONL or CSV file one at a time.
+
+    Each record's kind comes from its ``type`` field or column, or from
+    ``kind`` when the whole file holds one kind. CSV tag lists are
+    comma-separated strings.
+    """
+    with open(path, newline='', encoding='utf-8') as file:
+        if Path(path).suffix.lower() == '.csv':
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for row in rows:
+            row.setdefault('type', kind)
+            yield row
+
+
+class BulkWriter:
+    """Inserts rows with batched INSERTs, or with COPY on PostgreSQL.
+
+    On PostgreSQL, ids are taken from the table's sequence up front so rows can
+    be copied with their primary keys, and every batch is copied into a
+    temporary table first so conflicts can be skipped with ``ON CONFLICT DO
+    NOTHING``, which COPY itself cannot do. The insert returns the keys it
+    wrote, so callers learn which objects were skipped.
+    """
+
+    def __init__(self):
+        self.use_copy = connection.vendor == 'postgresql'
+
+    def create(self, model, objs: list, fields: list[str]) -> list:
+        """Inserts new objects with the given field values exactly as set, and sets their primary keys.
+
+        Returns:
+            The objects that were inserted. On PostgreSQL objects conflicting
+            with existing rows, e.g. over a username taken since it was
+            checked, are skipped; elsewhere the conflict raises IntegrityError.
+        """
+        if not objs:
+            return []
+        if self.use_copy:
+            for obj, pk in zip(objs, self.allocate_ids(model, len(objs))):
+                obj.pk = pk
+            inserted = self.copy(model, [model._meta.pk.attname, *fields],
+                                 ([obj.pk, *(getattr(obj, field) for field in fields)] for obj in objs),
+                                 returning=model._meta.pk.column)
+            return [obj for obj in objs if obj.pk in inserted]
+        model_fields = [model._meta.get_field(field) for field in fields]
+        batch_size = connection.ops.bulk_batch_size(model_fields, objs)
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            # raw=True keeps given values of auto_now_add fields such as Post.created_at.
+            rows = model._base_manager._insert(batch, fields=model_fields, returning_fields=[model._meta.pk],
+                                               raw=True)
+            for obj, (pk,) in zip(batch, rows):
+                obj.pk = pk
+        return objs
+
+    def link(self, model, fields: list[str], rows: list[tuple]) -> None:
+        """Inserts relation rows, skipping those that already exist."""
+        if not rows:
+            return
+        if self.use_copy:
+            self.copy(model, fields, rows)
+        else:
+            # The same statement bulk_create(ignore_conflicts=True) runs, without building model instances.
+            quote = connection.ops.quote_name
+            model_fields = [model._meta.get_field(field) for field in fields]
+            columns = ', '.join(quote(field.column) for field in model_fields)
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'{connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)} '
+                    f'{quote(model._meta.db_table)} ({columns}) VALUES ({", ".join(["%s"] * len(fields))})',
+                    [[field.get_db_prep_save(value, connection) for field, value in zip(model_fields, row)]
+                     for row in rows],
+                )
+
+    def allocate_ids(self, model, count: int) -> list[int]:
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                           [table, model._meta.pk.column, count])
+            return [pk for pk, in cursor.fetchall()]
+
+    def copy(self, model, fields: list[str], rows, returning: str | None = None) -> set:
+        """Copies rows into the model's table, skipping those that conflict with existing ones.
+
+        Returns:
+            The values of the ``returning`` column of the rows that were inserted, if one is given.
+        """
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        staging = quote(f'import_{model._meta.db_table}')
+        columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMPORARY TABLE {staging} AS SELECT {columns} FROM {table} WITH NO DATA')
+            with cursor.copy(f'COPY {staging} ({columns}) FROM STDIN') as copy:
+                for row in rows:
+                    copy.write_row(row)
+            cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} ON CONFLICT DO NOTHING'
+                           + (f' RETURNING {quote(returning)}' if returning else ''))
+            inserted = {value for value, in cursor.fetchall()} if returning else set()
+            cursor.execute(f'DROP TABLE {staging}')
+        return inserted
+
+
+class Importer:
+    """Imports users, posts, likes and follows from another platform in batches.
+
+    Every batch is written in one transaction together with the
+    ``ImportedObject`` rows mapping its external ids to the created objects.
+    Records already mapped for the source are skipped and likes and follows
+    rely on their unique constraints, so an interrupted import resumes where
+    it stopped when it is run again. Records must come in dependency order:
+    users before their posts, both before likes and follows referring to them.
+
+    Args:
+        source: A name for the dataset; external ids are unique per source.
+        batch_size: Number of records written per transaction.
+    """
+
+    def __init__(self, source: str, batch_size: int = 1000):
+        self.source = source
+        self.batch_size = batch_size
+        self.writer = BulkWriter()
+        self.counts = Counter()
+
+    def run(self, records) -> Counter:
+        """Imports an iterable of records and returns counts such as ``post created`` and ``like unresolved``."""
+        batch, kind = [], None
+        for record in records:
+            if record.get('type') not in KINDS:
+                self.counts['invalid'] += 1
+                continue
+            if batch and (record['type'] != kind or len(batch) >= self.batch_size):
+                self.flush(kind, batch)
+                batch = []
+            kind = record['type']
+            batch.append(record)
+        if batch:
+            self.flush(kind, batch)
+        return self.counts
+
+    def flush(self, kind: str, batch: list[dict]) -> None:
+        with transaction.atomic():
+            getattr(self, f'import_{kind}s')(batch)
+
+    def new_records(self, kind: str, batch: list[dict]) -> list[dict]:
+        """Drops records imported before and duplicates within the batch."""
+        seen = set(ImportedObject.objects.filter(source=self.source, kind=kind,
+                                                 external_id__in=[str(record['id']) for record in batch])
+                   .values_list('external_id', flat=True))
+        fresh = []
+        for record in batch:
+            if str(record['id']) in seen:
+                self.counts[f'{kind} skipped'] += 1
+                continue
+            seen.add(str(record['id']))
+            fresh.append(record)
+        return fresh
+
+    def resolve(self, kind: str, external_ids) -> dict[str, int]:
+        """Returns the local ids of objects imported from the given external ids."""
+        return dict(ImportedObject.objects.filter(source=self.source, kind=kind,
+                                                  external_id__in={str(external_id) for external_id in external_ids})
+                    .values_list('external_id', 'object_id'))
+
+    def record_mapping(self, kind: str, pairs: list[tuple]) -> None:
+        ImportedObject.objects.bulk_create(
+            [ImportedObject(source=self.source, kind=kind, external_id=str(external_id), object_id=pk)
+             for external_id, pk in pairs],
+            batch_size=1000,
+        )
+        self.counts[f'{kind} created'] += len(pairs)
+
+    def import_users(self, batch: list[dict]) -> None:
+        records = self.new_records('user', batch)
+        taken = set(User.objects.filter(username__in=[record['username'] for record in records])
+                    .values_list('username', flat=True))
+        users, imported = [], []
+        for record in records:
+            if record['username'] in taken:
+                self.counts['user conflicts'] += 1
+                continue
+            taken.add(record['username'])
+            users.append(User(
+                username=record['username'], email=record.get('email') or '', password='!',
+                first_name=record.get('first_name') or '', last_name=record.get('last_name') or '',
+                date_joined=parse_datetime(record['date_joined']) if record.get('date_joined') else timezone.now(),
+            ))
+            imported.append(record)
+        created = {user.pk for user in self.writer.create(
+            User, users, ['username', 'email', 'password', 'first_name', 'last_name',
+                          'date_joined', 'is_active', 'is_staff', 'is_superuser', 'email_verified'])}
+        # Usernames taken since they were checked above are skipped by the insert and left unmapped.
+        self.counts['user conflicts'] += len(users) - len(created)
+        pairs = [(user, record) for user, record in zip(users, imported) if user.pk in created]
+        # Profiles are created here because bulk inserts do not send the post_save signal that usually does it.
+        self.writer.create(Profile, [Profile(user_id=user.pk, description=record.get('description') or None)
+                                     for user, record in pairs], ['user_id', 'description'])
+        self.record_mapping('user', [(record['id'], user.pk) for user, record in pairs])
+
+    def import_posts(self, batch: list[dict]) -> None:
+        records = self.new_records('post', batch)
+        authors = self.resolve('user', (record['user'] for record in records))
+        usernames = dict(User.objects.filter(pk__in=authors.values()).values_list('pk', 'username'))
+        posts, imported = [], []
+        for record in records:
+            user_id = authors.get(str(record['user']))
+            if user_id is None:
+                self.counts['post unresolved'] += 1
+                continue
+            posts.append(Post(
+                user_id=user_id, text=record['text'], author_username=usernames[user_id],
+                created_at=parse_datetime(record['created_at']) if record.get('created_at') else timezone.now(),
+            ))
+            imported.append(record)
+        created = {post.pk for post in self.writer.create(Post, posts, ['user_id', 'text', 'created_at',
+                                                                         'author_username'])}
+        pairs = [(post, record) for post, record in zip(posts, imported) if post.pk in created]
+
+        names = {}
+        for post, record in pairs:
+            tags = record.get('tags') or []
+            names[post.pk] = parse_tag_names(tags if isinstance(tags, str) else ','.join(tags))
+        tag_ids = {tag.name: tag.pk for tag in get_or_create_tags(set().union(*names.values()))}
+        self.writer.link(Post.tags.through, ['post_id', 'tag_id'],
+                         [(post_id, tag_ids[name]) for post_id, post_names in names.items() for name in post_names])
+        self.record_mapping('post', [(record['id'], post.pk) for post, record in pairs])
+
+    def import_likes(self, batch: list[dict]) -> None:
+        users = self.resolve('user', (record['user'] for record in batch))
+        posts = self.resolve('post', (record['post'] for record in batch))
+        self.import_links('like', Like, ['user_id', 'post_id'], [
+            (users.get(str(record['user'])), posts.get(str(record['post']))) for record in batch
+        ])
+
+    def import_follows(self, batch: list[dict]) -> None:
+        users = self.resolve('user', [record[field] for record in batch for field in ('user', 'follower')])
+        now = timezone.now()
+        follows = self.import_links('follow', Followers, ['user_id', 'follower_id', 'created_at'], [
+            (users.get(str(record['user'])), users.get(str(record['follower'])), now) for record in batch
+        ])
+        self.writer.link(FollowChange, ['user_id', 'follower_id', 'followed', 'created_at'],
+                         [(user_id, follower_id, True, now) for user_id, follower_id, _ in follows])
+
+    def import_links(self, kind: str, model, fields: list[str], rows: list[tuple]) -> list[tuple]:
+        resolved = [row for row in rows if row[0] is not None and row[1] is not None]
+        self.counts[f'{kind} unresolved'] += len(rows) - len(resolved)
+        self.writer.link(model, fields, resolved)
+        self.counts[f'{kind} processed'] += len(resolved)
+        return resolved
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.export import delete_expired_exports, exports_available, run_pending_exports
+
+
+class Command(BaseCommand):
+    help = 'Writes requested user data exports as ZIP archives and deletes expired ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1)
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help='Keep running, polling for requests at this interval once none are left.')
+
+    def handle(self, *args, **options):
+        if not exports_available():
+            raise CommandError('Exports read only the default database, so they are off while DATABASE_SHARDS '
+                               'is set.')
+        written = 0
+        expired = delete_expired_exports()
+        while True:
+            count = run_pending_exports(options['batch_size'])
+            written += count
+            if count:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
+            expired += delete_expired_exports()
+        self.stdout.write(self.style.SUCCESS(f'Handled {written} exports, deleted {expired} expired ones.'))
@@ -0,0 +1,42 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.importer import KINDS, Importer, read_records
+
+
+class Command(BaseCommand):
+    help = ('Imports users, posts, likes and follows from JSONL or CSV files in batches. '
+            'Re-running a file skips what was already imported.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files in dependency order: users, posts, likes, follows.')
+        parser.add_argument('--type', choices=KINDS,
+                            help='Kind of the records in files without a "type" field or column.')
+        parser.add_argument('--source', required=True,
+                            help='Name of the dataset; external ids are unique per source across its files.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if settings.DATABASE_SHARDS:
+            raise CommandError('Imports write posts, likes and follows to the default database with their own ids, '
+                               'so they are refused while DATABASE_SHARDS is set.')
+        started = time.perf_counter()
+        total = 0
+        for path in options['paths']:
+            if not Path(path).is_file():
+                raise CommandError(f'{path} does not exist.')
+            importer = Importer(options['source'], options['batch_size'])
+            file_started = time.perf_counter()
+            counts = importer.run(read_records(path, options['type']))
+            rows = sum(counts.values())
+            total += rows
+            elapsed = time.perf_counter() - file_started
+            self.stdout.write(f'{path}: {rows} records in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)')
+            for key, count in sorted(counts.items()):
+                self.stdout.write(f'  {key:<20}{count:>10}')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} records in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s).'))
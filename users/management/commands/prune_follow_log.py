@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.models import FollowChange
+
+
+class Command(BaseCommand):
+    help = 'Deletes follow changes older than FOLLOW_GRAPH_LOG_RETENTION_HOURS from the follow graph log.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=settings.FOLLOW_GRAPH_LOG_RETENTION_HOURS)
+        deleted, _ = FollowChange.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} follow changes.'))
@@ -4,6 +4,7 @@ from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.dispatch import receiver
 
+from DjangoGramm.sharding import ShardKeyQuerySet
 from photos.models import AvatarImage
 
 
@@ -22,15 +23,57 @@ class Profile(models.Model):
 
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
+def create_user_profile(sender, instance, created, using, **kwargs):
     if created:
-        Profile.objects.create(user=instance)
+        Profile.objects.using(using).create(user=instance)
 
 
 class Followers(models.Model):
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='followers')
-    follower = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='following')
+    # Follows live on the follower's shard (see DjangoGramm.sharding), apart from the users table.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='followers',
+                             db_constraint=False)
+    follower = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='following',
+                                 db_constraint=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ShardKeyQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'follower')
+
+
+class FollowChange(models.Model):
+    """A follow or unfollow, logged so every worker's follow graph can catch up (see users.follow_graph)."""
+    # Plain ids, so the log outlives the users it mentions.
+    user_id = models.BigIntegerField()
+    follower_id = models.BigIntegerField()
+    followed = models.BooleanField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class ImportedObject(models.Model):
+    """Maps a record of an imported dataset to the object created for it, so `manage.py import_data` can be re-run."""
+    source = models.CharField(max_length=64)
+    kind = models.CharField(max_length=8)
+    external_id = models.CharField(max_length=64)
+    object_id = models.PositiveBigIntegerField()
+
+    class Meta:
+        unique_together = ('source', 'kind', 'external_id')
+
+
+class DataExport(models.Model):
+    """A requested ZIP archive of a user's data, written by `manage.py export_data`."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='data_exports')
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=PENDING)
+    file = models.CharField(max_length=255, blank=True)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
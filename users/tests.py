@@ -1,17 +1,31 @@
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 from unittest.mock import patch
 from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator
 from django.core import mail
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase, Client, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from social_django.models import UserSocialAuth
 
-from photos.models import AvatarImage
-from users.models import Profile, Followers
+from photos.models import AvatarImage, PostImage
+from posts.models import Like, Post
+from posts.utils import parse_and_add_tags
+from users.export import renew_claim, write_jsonl
+from users.follow_graph import FollowGraph, follow_graph
+from users.models import DataExport, FollowChange, ImportedObject, Profile, Followers
+from users.utils import delete_user_account
 
 User = get_user_model()
 
@@ -238,3 +252,268 @@ class OAuthUnittest(TestCase):
 
         self.assertTrue("_auth_user_id" in self.client.session)
         self.assertEqual(int(self.client.session["_auth_user_id"]), user.id)
+
+
+class DataExportTest(TestCase):
+    """Tests for the streamed ZIP export of a user's data."""
+
+    @patch('cloudinary.uploader.upload')
+    def setUp(self, mock_upload):
+        """Create a user with a tagged, liked post with an image, and a follower."""
+        mock_upload.return_value = {'public_id': 'exported', 'version': '1', 'format': 'jpg',
+                                    'resource_type': 'image', 'type': 'upload'}
+        self.export_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(EXPORT_ROOT=self.export_root, EXPORT_IMAGE_WORKERS=2)
+        self.settings_override.enable()
+        # Image URLs are built without Cloudinary credentials; the downloads themselves are mocked.
+        self.build_url = patch('cloudinary.CloudinaryResource.build_url',
+                               return_value='https://res.cloudinary.com/demo/image/upload/exported.jpg')
+        self.build_url.start()
+        self.user = User.objects.create_user(username='exporter', password='3C5TeBt21')
+        self.fan = User.objects.create_user(username='fan', password='3C5TeBt21')
+        self.post = Post.objects.create(user=self.user, text='Exported post')
+        parse_and_add_tags('summer', self.post)
+        Like.objects.create(user=self.user, post=self.post)
+        Followers.objects.create(user=self.user, follower=self.fan)
+        self.image = PostImage.objects.create(post=self.post, uploaded_by=self.user,
+                                              file=SimpleUploadedFile('post.jpg', b'imagebytes'))
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.build_url.stop()
+        self.settings_override.disable()
+        shutil.rmtree(self.export_root, ignore_errors=True)
+
+    def export(self) -> zipfile.ZipFile:
+        """Requests an export, runs the worker and downloads the archive."""
+        self.client.post(reverse('request_export'))
+        call_command('export_data', stdout=io.StringIO())
+        export = DataExport.objects.get()
+        self.assertEqual(export.status, DataExport.DONE)
+        response = self.client.get(reverse('download_export', args=[export.pk]))
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    @patch('users.export.fetch_image', side_effect=lambda url: io.BytesIO(b'imagebytes'))
+    def test_export_contains_posts_likes_follows_and_images(self, mock_fetch):
+        """The archive holds one JSON-lines file per table and the post images."""
+        archive = self.export()
+
+        self.assertIn('Exported post', archive.read('posts.jsonl').decode())
+        self.assertIn('summer', archive.read('post_tags.jsonl').decode())
+        self.assertIn(str(self.post.pk), archive.read('likes.jsonl').decode())
+        self.assertIn('fan', archive.read('followers.jsonl').decode())
+        self.assertEqual(archive.read(f'images/{self.image.pk}.jpg'), b'imagebytes')
+        self.assertNotIn('missing_images.jsonl', archive.namelist())
+
+    @patch('users.export.fetch_image', side_effect=OSError('unreachable'))
+    def test_failed_image_downloads_are_listed(self, mock_fetch):
+        """Images that cannot be fetched are listed instead of failing the export."""
+        archive = self.export()
+        self.assertIn(str(self.image.pk), archive.read('missing_images.jsonl').decode())
+
+    @patch('users.export.fetch_image', side_effect=lambda url: io.BytesIO(b'imagebytes'))
+    def test_abandoned_export_is_claimed_again(self, mock_fetch):
+        """An export left running by a lost worker is written again after a while and its partial file deleted."""
+        partial = Path(self.export_root) / str(self.user.pk) / 'partial.zip'
+        partial.parent.mkdir()
+        partial.write_bytes(b'partial')
+        abandoned = DataExport.objects.create(user=self.user, status=DataExport.RUNNING,
+                                              file=f'{self.user.pk}/partial.zip',
+                                              started_at=timezone.now() - timedelta(hours=2))
+        running = DataExport.objects.create(user=self.fan, status=DataExport.RUNNING, started_at=timezone.now())
+
+        call_command('export_data', batch_size=2, stdout=io.StringIO())
+
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.status, DataExport.DONE)
+        self.assertFalse(partial.exists())
+        self.assertTrue((Path(self.export_root) / abandoned.file).exists())
+        self.assertEqual(DataExport.objects.get(pk=running.pk).status, DataExport.RUNNING)
+
+    @override_settings(EXPORT_HEARTBEAT_SECONDS=0)
+    @patch('users.export.fetch_image', side_effect=lambda url: io.BytesIO(b'imagebytes'))
+    def test_writing_export_renews_its_claim(self, mock_fetch):
+        """A slow export keeps moving started_at forward, so it is never taken for an abandoned one."""
+        export = DataExport.objects.create(user=self.user)
+        with patch('users.export.renew_claim', wraps=renew_claim) as mock_renew:
+            call_command('export_data', stdout=io.StringIO())
+        export.refresh_from_db()
+        self.assertEqual(export.status, DataExport.DONE)
+        # Once when the file is recorded, after every row and image, and once when the export is finished.
+        self.assertEqual(mock_renew.call_count, 8)
+
+    @patch('users.export.fetch_image', side_effect=lambda url: io.BytesIO(b'imagebytes'))
+    def test_reclaimed_export_is_left_to_the_new_claim(self, mock_fetch):
+        """A worker whose export was claimed again drops its file instead of overwriting the new claim."""
+        export = DataExport.objects.create(user=self.user)
+        reclaimed_at = timezone.now() + timedelta(minutes=1)
+
+        def write_then_lose_claim(archive, name, rows, beat):
+            write_jsonl(archive, name, rows, beat)
+            DataExport.objects.filter(pk=export.pk).update(started_at=reclaimed_at)
+
+        with patch('users.export.write_jsonl', side_effect=write_then_lose_claim):
+            call_command('export_data', stdout=io.StringIO())
+        export.refresh_from_db()
+        self.assertEqual((export.status, export.started_at), (DataExport.RUNNING, reclaimed_at))
+        self.assertFalse((Path(self.export_root) / export.file).exists())
+
+    def test_export_only_downloadable_by_owner(self):
+        """Other users cannot download someone's export."""
+        export = DataExport.objects.create(user=self.user, status=DataExport.DONE, file='1/export.zip')
+        self.client.force_login(self.fan)
+        response = self.client.get(reverse('download_export', args=[export.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    @patch('users.export.fetch_image', side_effect=lambda url: io.BytesIO(b'imagebytes'))
+    def test_deleting_user_removes_export_file(self, mock_fetch):
+        """Deleting the account deletes the written archives too."""
+        self.export()
+        path = DataExport.objects.get().file
+
+        delete_user_account(self.user)
+
+        self.assertFalse(DataExport.objects.exists())
+        self.assertFalse((Path(self.export_root) / path).exists())
+
+
+class ImportDataTest(TestCase):
+    """Tests for the resumable bulk import of users, posts, likes and follows."""
+
+    records = [
+        {'type': 'user', 'id': 1, 'username': 'alice', 'email': 'alice@example.com', 'description': 'Hi'},
+        {'type': 'user', 'id': 2, 'username': 'bob'},
+        {'type': 'post', 'id': 'p1', 'user': 1, 'text': 'Imported', 'created_at': '2020-01-02T03:04:05+00:00',
+         'tags': ['Travel', 'sun']},
+        {'type': 'post', 'id': 'p2', 'user': 99, 'text': 'Orphan'},
+        {'type': 'like', 'user': 2, 'post': 'p1'},
+        {'type': 'follow', 'user': 1, 'follower': 2},
+    ]
+
+    def setUp(self):
+        """Write the records to a temporary JSON-lines file."""
+        self.directory = tempfile.mkdtemp()
+        self.path = Path(self.directory) / 'dump.jsonl'
+        self.path.write_text(''.join(json.dumps(record) + '\n' for record in self.records))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_import_creates_objects_with_profiles(self):
+        """Records become users with profiles, posts keeping their dates and tags, likes and follows."""
+        output = io.StringIO()
+        call_command('import_data', str(self.path), source='old-site', stdout=output)
+
+        alice, bob = User.objects.get(username='alice'), User.objects.get(username='bob')
+        self.assertEqual(alice.profile.description, 'Hi')
+        self.assertTrue(Profile.objects.filter(user=bob).exists())
+        post = Post.objects.get()
+        self.assertEqual((post.user, post.author_username), (alice, 'alice'))
+        self.assertEqual(post.created_at.year, 2020)
+        self.assertEqual(sorted(post.tags.values_list('name', flat=True)), ['sun', 'travel'])
+        self.assertTrue(Like.objects.filter(user=bob, post=post).exists())
+        self.assertTrue(Followers.objects.filter(user=alice, follower=bob).exists())
+        self.assertIn('post unresolved', output.getvalue())
+        self.assertIn('rows/s', output.getvalue())
+
+    def test_rerun_is_idempotent(self):
+        """Running the same file again creates nothing new."""
+        call_command('import_data', str(self.path), source='old-site', stdout=io.StringIO())
+        call_command('import_data', str(self.path), source='old-site', stdout=io.StringIO())
+
+        self.assertEqual(User.objects.count(), 2)
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(Like.objects.count(), 1)
+        self.assertEqual(Followers.objects.count(), 1)
+        self.assertEqual(ImportedObject.objects.count(), 3)
+
+    def test_csv_with_type_option(self):
+        """CSV files holding one kind of record take it from --type."""
+        path = Path(self.directory) / 'users.csv'
+        path.write_text('id,username,email\n7,carol,carol@example.com\n')
+
+        call_command('import_data', str(path), source='old-site', type='user', stdout=io.StringIO())
+
+        self.assertTrue(Profile.objects.filter(user__username='carol').exists())
+
+
+@override_settings(FOLLOW_GRAPH_REFRESH_SECONDS=0)
+class FollowGraphTest(TestCase):
+    """Tests for the in-memory follow graph and its change log."""
+
+    def setUp(self):
+        """Create three users where alice and bob follow each other and carol follows alice."""
+        follow_graph.clear()
+        self.alice, self.bob, self.carol = (User.objects.create_user(username=name, password='3C5TeBt21')
+                                            for name in ('alice', 'bob', 'carol'))
+        Followers.objects.create(user=self.alice, follower=self.bob)
+        Followers.objects.create(user=self.bob, follower=self.alice)
+        Followers.objects.create(user=self.alice, follower=self.carol)
+
+    def test_relationship_queries(self):
+        """Membership, mutual and intersection checks match the Followers table."""
+        graph = FollowGraph()
+        self.assertTrue(graph.is_following(self.bob.pk, self.alice.pk))
+        self.assertFalse(graph.is_following(self.alice.pk, self.carol.pk))
+        self.assertTrue(graph.is_mutual(self.alice.pk, self.bob.pk))
+        self.assertFalse(graph.is_mutual(self.alice.pk, self.carol.pk))
+        self.assertEqual(graph.followers_among(self.alice.pk, [self.bob.pk, self.carol.pk]),
+                         {self.bob.pk, self.carol.pk})
+        self.assertEqual(graph.common_following(self.bob.pk, self.carol.pk), {self.alice.pk})
+
+    def test_other_workers_catch_up_from_the_log(self):
+        """A toggle is visible at once in this worker and after a refresh in another one."""
+        other_worker = FollowGraph()
+        self.assertFalse(other_worker.is_following(self.alice.pk, self.carol.pk))
+        self.client.force_login(self.alice)
+
+        self.client.post(reverse('subscribe', args=[self.carol.pk]))
+
+        self.assertTrue(follow_graph.is_following(self.alice.pk, self.carol.pk))
+        self.assertTrue(other_worker.is_following(self.alice.pk, self.carol.pk))
+        self.assertTrue(FollowChange.objects.filter(user_id=self.carol.pk, follower_id=self.alice.pk,
+                                                    followed=True).exists())
+
+    def test_followers_list_badges(self):
+        """The followers list marks mutual follows and users following the viewer."""
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('followers_list', args=['alice']))
+        self.assertContains(response, 'Friends')
+        self.assertContains(response, 'Follows you')
+
+    def test_deleted_user_is_unfollowed_in_the_log(self):
+        """Deleting an account logs the removal of all of its follow relations."""
+        graph = FollowGraph()
+        self.assertTrue(graph.is_following(self.carol.pk, self.alice.pk))
+
+        delete_user_account(self.carol)
+
+        self.assertFalse(graph.is_following(self.carol.pk, self.alice.pk))
+        self.assertEqual(list(graph.followers(self.alice.pk)), [self.bob.pk])
+
+    def test_admin_changes_are_logged(self):
+        """Follows added, changed and deleted in the admin reach every worker's graph."""
+        graph = FollowGraph()
+        self.assertFalse(graph.is_following(self.bob.pk, self.carol.pk))
+        self.client.force_login(User.objects.create_superuser(username='admin', password='3C5TeBt21'))
+
+        follow = Followers.objects.get(user=self.alice, follower=self.carol)
+        self.client.post(reverse('admin:users_followers_change', args=[follow.pk]),
+                         {'user': self.bob.pk, 'follower': self.carol.pk})
+        self.assertFalse(graph.is_following(self.carol.pk, self.alice.pk))
+        self.assertTrue(graph.is_following(self.carol.pk, self.bob.pk))
+
+        self.client.post(reverse('admin:users_followers_delete', args=[follow.pk]), {'post': 'yes'})
+        self.assertFalse(graph.is_following(self.carol.pk, self.bob.pk))
+        self.client.post(reverse('admin:users_followers_add'), {'user': self.carol.pk, 'follower': self.bob.pk})
+        self.assertTrue(graph.is_following(self.bob.pk, self.carol.pk))
+
+    def test_arrays_are_reloaded(self):
+        """Follows written without a log entry show up once the loaded arrays are read again."""
+        graph = FollowGraph()
+        self.assertFalse(graph.is_following(self.bob.pk, self.carol.pk))
+        Followers.objects.create(user=self.carol, follower=self.bob)
+        self.assertFalse(graph.is_following(self.bob.pk, self.carol.pk))
+
+        with override_settings(FOLLOW_GRAPH_RELOAD_SECONDS=0):
+            self.assertTrue(graph.is_following(self.bob.pk, self.carol.pk))
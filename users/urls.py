@@ -1,7 +1,8 @@
 from django.urls import path, include
 from users.views import (login, register, profile,
                          edit_profile, activate, logout,
-                         subscribe, followers_list, following_list)
+                         subscribe, followers_list, following_list,
+                         archived_posts, request_export, download_export)
 
 urlpatterns = [
     path('auth/', include('social_django.urls', namespace='social')),
@@ -11,6 +12,9 @@ urlpatterns = [
     path('activate/<uidb64>/<token>/', activate, name='activate'),
     path('profile/<str:username>/', profile, name='profile'),
     path('profile/<str:username>/edit/', edit_profile, name='edit_profile'),
+    path('profile/<str:username>/archive/', archived_posts, name='archived_posts'),
+    path('export/', request_export, name='request_export'),
+    path('export/<int:export_id>/download/', download_export, name='download_export'),
     path('<int:user_id>/subscribe/', subscribe, name='subscribe'),
     path('profile/<str:username>/followers/', followers_list, name='followers_list'),
     path('profile/<str:username>/following/', following_list, name='following_list'),
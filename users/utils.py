@@ -1,10 +1,25 @@
+from collections import Counter
+from itertools import chain
+
 from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Q
 from django.urls import reverse
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.auth import get_user_model
 
+from DjangoGramm.metrics import record_email
+from DjangoGramm.sharding import shard_aliases, shard_for
+from photos.models import AvatarImage, ImageBlob, PostImage
+from photos.utils import delete_images
+from posts.archive import delete_archived_posts
+from posts.models import ArchivedLike, ArchivedPost, Like, LikeCount, PendingAuthorRefresh, PendingLike, Post
+from posts.utils import delete_posts
+from users.export import delete_export_files
+from users.models import DataExport, FollowChange, Followers, Profile
+
 User = get_user_model()
 
 
@@ -19,10 +34,48 @@ def send_verification_email(request, user: User) -> None:
     token = default_token_generator.make_token(user)
     link = request.build_absolute_uri(reverse('activate', args=[uid, token]))
 
-    send_mail(
-        subject='Verify your email',
-        message=f'Click the link to verify: {link}',
-        from_email=None,
-        recipient_list=[user.email],
-        fail_silently=False
-    )
+    with record_email('verification'):
+        send_mail(
+            subject='Verify your email',
+            message=f'Click the link to verify: {link}',
+            from_email=None,
+            recipient_list=[user.email],
+            fail_silently=False
+        )
+
+
+def delete_user_account(user: User) -> None:
+    """Deletes a user and everything they own using set-based deletes.
+
+    Posts go through ``delete_posts``; likes, follow relations and uploaded
+    images are removed with one DELETE per table, on every shard for likes and
+    follows, before the user row itself, so the cascade collector has nothing
+    left to load.
+
+    Args:
+        user: The user to delete.
+    """
+    with transaction.atomic():
+        delete_posts(Post.objects.using(shard_for(user.pk)).filter(user=user))
+        delete_archived_posts(ArchivedPost.objects.filter(user=user))
+        ArchivedLike.objects.filter(user=user).delete()
+        PendingLike.objects.filter(user=user).delete()
+        for alias in shard_aliases():
+            likes = Like.objects.using(alias).filter(user=user)
+            # Recounted from posts_like until the next flush of those posts.
+            LikeCount.objects.filter(post__in=list(likes.values_list('post_id', flat=True))).delete()
+            likes.delete()
+            follows = Followers.objects.using(alias).filter(Q(user=user) | Q(follower=user))
+            FollowChange.objects.bulk_create(
+                FollowChange(user_id=user_id, follower_id=follower_id, followed=False)
+                for user_id, follower_id in follows.values_list('user_id', 'follower_id').iterator()
+            )
+            follows.delete()
+        Profile.objects.filter(user=user).update(avatar=None)
+        # Replaced avatars wait for a snapshot refresh that no longer matters once the posts are gone.
+        ImageBlob.objects.release_many(Counter(chain.from_iterable(
+            PendingAuthorRefresh.objects.filter(user=user).values_list('replaced_blobs', flat=True))))
+        delete_images(AvatarImage.objects.filter(uploaded_by=user))
+        delete_images(PostImage.objects.filter(uploaded_by=user))
+        delete_export_files(DataExport.objects.filter(user=user))
+        user.delete()
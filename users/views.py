@@ -1,14 +1,25 @@
+from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.tokens import default_token_generator
-from django.http import JsonResponse
+from django.db.models import Q
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.dateparse import parse_datetime
 from django.utils.encoding import force_str
 from django.utils.http import urlsafe_base64_decode
 
-from posts.models import Post
-from users.models import Followers
+from DjangoGramm.routers import replica_reads
+from DjangoGramm.sharding import ShardedQuerySet, across_shards, shard_for
+from DjangoGramm.throttling import throttle_toggle
+from posts.live import publish_count
+from posts.models import ArchivedPost, Post
+from posts.streaming import render_listing
+from posts.utils import post_listing, request_author_refresh
+from users.export import export_storage, exports_available
+from users.follow_graph import follow_graph, record_follow_change
+from users.models import DataExport, Followers
 from users.forms import UserInfoForm, UserLoginForm, UserProfileForm, UserRegisterForm
 from users.utils import send_verification_email
 from photos.models import AvatarImage
@@ -88,19 +99,22 @@ def activate(request, uidb64: str, token: str):
 
 
 @login_required
+@replica_reads
 def profile(request, username: str):
     """Displays the profile page of a user with their posts."""
     user = get_object_or_404(User, username=username)
-    is_following = Followers.objects.filter(follower=request.user, user=user).exists()
-    posts = Post.objects.filter(user=user).prefetch_related('images', 'tags', 'likes').order_by('-created_at')
-    for post in posts:
-        post.is_liked = post.likes.filter(user=request.user).exists()
-    return render(request, 'users/profile.html', {
+    is_following = follow_graph.is_following(request.user.pk, user.pk)
+    posts = post_listing(Post.objects.using(shard_for(user.pk)).filter(user=user), request.user)
+    context = {
         'user': user,
         'is_owner': request.user == user,
-        'posts': posts,
         'is_following': is_following,
-    })
+        'followers_count': followers_of(user).count(),
+        'following_count': Followers.objects.using(shard_for(user.pk)).filter(follower=user).count(),
+        'has_archive': ArchivedPost.objects.filter(user=user).exists(),
+    }
+    return render_listing(request, 'users/profile.html', context, posts,
+                          'users/includes/post_card.html', 'users/includes/no_posts.html')
 
 
 @login_required
@@ -118,16 +132,21 @@ def edit_profile(request, username: str):
             user_form.save()
             profile = profile_form.save(commit=False)
             avatar_file = request.FILES.get('avatar')
+            replaced_blob_id = None
             if avatar_file:
                 if profile.avatar:
+                    replaced_blob_id = profile.avatar.blob_id
                     profile.avatar.file = avatar_file
                     profile.avatar.uploaded_by = request.user
-                    profile.avatar.save()
+                    # The posts' author snapshots show the old avatar until they are refreshed, which releases it.
+                    profile.avatar.save(release_previous_blob=False)
                 else:
                     avatar = AvatarImage.objects.create(file=avatar_file, uploaded_by=request.user)
                     profile.avatar = avatar
 
             profile.save()
+            if avatar_file or 'username' in user_form.changed_data:
+                request_author_refresh(request.user, replaced_blob_id)
             request.session['profile_updated'] = True
     else:
         user_form = UserInfoForm(instance=request.user)
@@ -141,11 +160,35 @@ def edit_profile(request, username: str):
         'show_success_profile': show_success_profile,
         'user_form': user_form,
         'profile_form': profile_form,
-        'username': username
+        'username': username,
+        'latest_export': request.user.data_exports.order_by('-created_at').first(),
+        'exports_available': exports_available(),
     })
 
 
 @login_required
+def request_export(request):
+    """Queues an export of the current user's data unless one is already in progress."""
+    if request.method == 'POST' and exports_available():
+        in_progress = request.user.data_exports.filter(status__in=[DataExport.PENDING, DataExport.RUNNING])
+        if not in_progress.exists():
+            DataExport.objects.create(user=request.user)
+    return redirect('edit_profile', username=request.user.username)
+
+
+@login_required
+def download_export(request, export_id: int):
+    """Sends a finished export archive to the user who requested it."""
+    export = get_object_or_404(DataExport, id=export_id, user=request.user, status=DataExport.DONE)
+    storage = export_storage()
+    if not storage.exists(export.file):
+        raise Http404
+    return FileResponse(storage.open(export.file), as_attachment=True,
+                        filename=f'djangogramm-{request.user.username}-{export.created_at:%Y%m%d}.zip')
+
+
+@login_required
+@throttle_toggle('subscribe', 'user_id')
 def subscribe(request, user_id: int):
     """Subscribe or unsubscribe the authenticated user to/from the target user."""
     target_user = get_object_or_404(User, id=user_id)
@@ -156,34 +199,88 @@ def subscribe(request, user_id: int):
     if target_user == request.user:
         return JsonResponse({'success': False, 'error': 'Cannot subscribe to yourself'})
 
-    follower_subscriber, created = Followers.objects.get_or_create(user=target_user, follower=request.user)
+    follower_subscriber, created = (Followers.objects.using(shard_for(request.user.pk))
+                                    .get_or_create(user=target_user, follower=request.user))
     if not created:
         follower_subscriber.delete()
         following = False
     else:
         following = True
-    return JsonResponse({'following': following, 'followers_count': target_user.followers.count(), 'success': True})
+    record_follow_change(target_user.pk, request.user.pk, following)
+    followers_count = followers_of(target_user).count()
+    publish_count('user', target_user.pk, 1 if following else -1, followers_count)
+    return JsonResponse({'following': following, 'followers_count': followers_count, 'success': True})
 
 
 @login_required
+@replica_reads
+def archived_posts(request, username: str):
+    """Displays a user's archived posts, newest first, one page at a time.
+
+    Args:
+        request: The HTTP request; the optional ``before`` and ``before_id``
+            parameters hold the creation time and id of the last post on the
+            previous page.
+        username: The username of the profile owner.
+    """
+    user = get_object_or_404(User, username=username)
+    posts = ArchivedPost.objects.filter(user=user).order_by('-created_at', '-post_id')
+    before = parse_datetime(request.GET.get('before', ''))
+    before_id = request.GET.get('before_id', '')
+    if before and before_id.isdigit():
+        # Posts created at the same instant are told apart by id, in the order the page is sorted.
+        posts = posts.filter(Q(created_at__lt=before) | Q(created_at=before, post_id__lt=int(before_id)))
+    elif before:
+        posts = posts.filter(created_at__lt=before)
+    page_size = settings.ARCHIVE_PAGE_SIZE
+    page = list(posts[:page_size + 1])
+    last = page[page_size - 1] if len(page) > page_size else None
+    context = {
+        'user': user,
+        'posts': page[:page_size],
+        'next_before': last.created_at.isoformat() if last else None,
+        'next_before_id': last.post_id if last else None,
+    }
+    return render(request, 'users/archived_posts.html', context)
+
+
+@login_required
+@replica_reads
 def followers_list(request, username):
     """Display a list of users who are following the specified user."""
     user = get_object_or_404(User, username=username)
-    followers = [f.follower for f in user.followers.all()]
+    followers = [f.follower for f in followers_of(user)]
     return render(request, "users/followers_list.html", {
         "users": followers,
         "profile_user": user,
-        "title": "Followers"
+        "title": "Followers",
+        **relationship_badges(request.user, followers),
     })
 
 
 @login_required
+@replica_reads
 def following_list(request, username):
     """Display a list of users that the specified user is following."""
     user = get_object_or_404(User, username=username)
-    following = [f.user for f in user.following.all()]
+    following = [f.user for f in Followers.objects.using(shard_for(user.pk)).filter(follower=user)]
     return render(request, "users/followers_list.html", {
         "users": following,
         "profile_user": user,
-        "title": "Following"
+        "title": "Following",
+        **relationship_badges(request.user, following),
     })
+
+
+def followers_of(user: User) -> ShardedQuerySet:
+    """Returns the follows of a user, which live on each follower's shard."""
+    return across_shards(Followers.objects.filter(user=user), None)
+
+
+def relationship_badges(viewer: User, users: list) -> dict:
+    """Returns the ids of the listed users the viewer follows and of those following the viewer."""
+    user_ids = [user.pk for user in users]
+    return {
+        'viewer_follows': follow_graph.following_among(viewer.pk, user_ids),
+        'follows_viewer': follow_graph.followers_among(viewer.pk, user_ids),
+    }